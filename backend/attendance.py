@@ -0,0 +1,437 @@
+from fastapi import APIRouter, HTTPException, Query, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from typing import Any, AsyncIterator, Dict, Iterator, List, Literal, Optional, Tuple, Union
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+from psycopg2.extensions import cursor as TupleCursor
+from psycopg2.extras import execute_values
+import io
+import os
+import asyncio
+import csv
+import json
+import time
+import uuid
+import threading
+from database import get_connection, register_statement, execute_prepared
+from cache import TTLCache
+from face_recognition.models import FaceRecognitionRequest
+from face_recognition.router import face_service, inference_executor, _read_image_upload
+
+# Minutes after the schedule's start time before a check-in counts as LATE
+ATTENDANCE_LATE_GRACE_MINUTES = int(os.getenv("ATTENDANCE_LATE_GRACE_MINUTES", "15"))
+
+# How long a student marked today skips the database on repeat scans, and how
+# long a user's schedule is cached
+ATTENDANCE_DEDUPE_TTL = float(os.getenv("ATTENDANCE_DEDUPE_TTL", "300"))
+ATTENDANCE_SCHEDULE_TTL = float(os.getenv("ATTENDANCE_SCHEDULE_TTL", "300"))
+
+# Write-behind buffer: flush at least this often, or sooner once this many rows are waiting
+ATTENDANCE_FLUSH_INTERVAL = float(os.getenv("ATTENDANCE_FLUSH_INTERVAL", "0.5"))
+ATTENDANCE_FLUSH_MAX_ROWS = int(os.getenv("ATTENDANCE_FLUSH_MAX_ROWS", "200"))
+
+DEFAULT_TIMEZONE = "Asia/Manila"
+
+# Attempts before a row that keeps failing to insert is dropped, and the
+# pause between attempts for rows still failing at shutdown
+MAX_WRITE_ATTEMPTS = 3
+SHUTDOWN_RETRY_SECONDS = 1.0
+
+# Rows fetched from the report's server-side cursor per round trip, and
+# written to the response as one chunk
+ATTENDANCE_REPORT_BATCH_ROWS = int(os.getenv("ATTENDANCE_REPORT_BATCH_ROWS", "2000"))
+
+# Create API router
+router = APIRouter()
+
+# Earliest class start for a user: their own class as a student, or any
+# class they teach
+register_statement("schedule_for_user", """
+    SELECT s."startTime", s."timezone"
+    FROM "User" u
+    JOIN "Schedule" s
+      ON s."classId" = u."classId"
+      OR s."classId" IN (SELECT c."id" FROM "Class" c WHERE c."teacherId" = u."id")
+    WHERE u."id" = $1
+    ORDER BY s."startTime"
+    LIMIT 1
+""")
+
+# Models
+class AttendanceResponse(BaseModel):
+    success: bool
+    user_id: Optional[str] = None
+    confidence: Optional[float] = None
+    status: Optional[str] = None
+    time_in: Optional[str] = None
+    class_date: Optional[str] = None
+    already_marked: bool = False
+    message: Optional[str] = None
+    reason: Optional[str] = None  # quality gate rejection, e.g. "blurry"
+
+class AttendanceWriter:
+    """Write-behind buffer that inserts attendance rows in grouped batches.
+
+    Rows are queued by add() and written by a background thread with one
+    INSERT ... ON CONFLICT ("userId", "classDate") DO NOTHING per flush, so
+    the first check-in of the day wins. Rows from a failed flush are retried
+    on the next one, up to MAX_WRITE_ATTEMPTS; close() keeps retrying them
+    before the writer stops, and rows that run out of attempts are logged.
+    """
+
+    def __init__(
+        self,
+        flush_interval: float = ATTENDANCE_FLUSH_INTERVAL,
+        max_rows: int = ATTENDANCE_FLUSH_MAX_ROWS
+    ):
+        self.flush_interval = flush_interval
+        self.max_rows = max_rows
+        self._pending: List[Dict[str, Any]] = []
+        self._condition = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+    def add(self, row: Dict[str, Any]):
+        """Queue one attendance row for the next flush"""
+        with self._condition:
+            if self._thread is None or not self._thread.is_alive():
+                self._closed = False
+                self._thread = threading.Thread(target=self._run, name="attendance-writer", daemon=True)
+                self._thread.start()
+            self._pending.append(dict(row, attempts=0))
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                # Sleep until a row arrives, then give others flush_interval to join it
+                self._condition.wait_for(lambda: self._pending or self._closed)
+                self._condition.wait_for(
+                    lambda: self._closed or len(self._pending) >= self.max_rows,
+                    timeout=self.flush_interval
+                )
+                rows, self._pending = self._pending, []
+                closed = self._closed
+            if rows:
+                self._flush(rows)
+            if closed:
+                self._drain()
+                return
+
+    def _drain(self):
+        """At shutdown, retry failed rows until they are written or out of attempts"""
+        while True:
+            with self._condition:
+                rows, self._pending = self._pending, []
+            if not rows:
+                return
+            time.sleep(SHUTDOWN_RETRY_SECONDS)
+            self._flush(rows)
+
+    def _flush(self, rows: List[Dict[str, Any]]):
+        now = datetime.utcnow()
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cursor:
+                    execute_values(
+                        cursor,
+                        """
+                        INSERT INTO "Attendance"
+                            ("id", "date", "status", "timeIn", "userId", "classDate", "createdAt", "updatedAt")
+                        VALUES %s
+                        ON CONFLICT ("userId", "classDate") DO NOTHING
+                        """,
+                        [
+                            (str(uuid.uuid4()), row["date"], row["status"], row["time_in"],
+                             row["user_id"], row["class_date"], now, now)
+                            for row in rows
+                        ],
+                        template="(%s, %s, %s::\"Status\", %s, %s, %s, %s, %s)",
+                        page_size=len(rows)
+                    )
+                conn.commit()
+        except Exception as e:
+            print(f"Error writing attendance batch of {len(rows)}: {e}")
+            retry = [dict(row, attempts=row["attempts"] + 1) for row in rows if row["attempts"] + 1 < MAX_WRITE_ATTEMPTS]
+            dropped = [row for row in rows if row["attempts"] + 1 >= MAX_WRITE_ATTEMPTS]
+            for row in dropped:
+                # Let the next scan of this student try again
+                dedupe_cache.pop((row["user_id"], row["class_date"]))
+            if dropped:
+                print(
+                    f"ERROR: dropped {len(dropped)} attendance rows after {MAX_WRITE_ATTEMPTS} attempts: "
+                    + ", ".join(f"{row['user_id']} {row['class_date']} {row['status']} {row['time_in']}" for row in dropped)
+                )
+            with self._condition:
+                self._pending = retry + self._pending
+
+    def pending(self) -> int:
+        with self._condition:
+            return len(self._pending)
+
+    def close(self):
+        """Flush everything queued and stop the writer thread"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+
+attendance_writer = AttendanceWriter()
+dedupe_cache = TTLCache(ATTENDANCE_DEDUPE_TTL)
+schedule_cache = TTLCache(ATTENDANCE_SCHEDULE_TTL)
+
+def get_schedule(user_id: str) -> Tuple[Optional[str], str]:
+    """Return (startTime "HH:MM" or None, timezone) for a user, cached"""
+    cached = schedule_cache.get(user_id)
+    if cached is not None:
+        return cached
+
+    schedule = (None, DEFAULT_TIMEZONE)
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                execute_prepared(cursor, "schedule_for_user", (user_id,))
+                row = cursor.fetchone()
+                if row:
+                    schedule = (row["startTime"], row["timezone"] or DEFAULT_TIMEZONE)
+    except Exception as e:
+        print(f"Error fetching schedule: {e}")
+        return schedule
+    schedule_cache.set(user_id, schedule)
+    return schedule
+
+def attendance_status(start_time: Optional[str], local_now: datetime) -> str:
+    """PRESENT until the grace period after the class start time has passed, then LATE"""
+    if not start_time:
+        return "PRESENT"
+    try:
+        hour, minute = (int(part) for part in start_time.split(":")[:2])
+    except ValueError:
+        return "PRESENT"
+    start = local_now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if local_now > start + timedelta(minutes=ATTENDANCE_LATE_GRACE_MINUTES):
+        return "LATE"
+    return "PRESENT"
+
+def mark_attendance(user_id: str) -> Dict[str, Any]:
+    """Queue today's attendance for a recognized user, skipping repeat scans"""
+    start_time, timezone = get_schedule(user_id)
+    try:
+        zone = ZoneInfo(timezone)
+    except Exception:
+        zone = ZoneInfo(DEFAULT_TIMEZONE)
+    local_now = datetime.now(zone)
+    class_date = local_now.strftime("%Y-%m-%d")
+
+    marked = dedupe_cache.get((user_id, class_date))
+    if marked is not None:
+        return dict(marked, already_marked=True, message="Attendance already recorded")
+
+    record = {
+        "status": attendance_status(start_time, local_now),
+        "time_in": local_now.strftime("%I:%M %p"),
+        "class_date": class_date,
+    }
+    dedupe_cache.set((user_id, class_date), record)
+    attendance_writer.add(dict(
+        record,
+        user_id=user_id,
+        date=local_now.astimezone(ZoneInfo("UTC")).replace(tzinfo=None)
+    ))
+    return dict(record, already_marked=False, message="Attendance recorded")
+
+async def _recognize_and_mark(image: Union[str, bytes]) -> Dict[str, Any]:
+    result = await inference_executor.embed(face_service, image)
+    if result["success"]:
+        result = await inference_executor.run(face_service.recognize_embedding, result["embedding"])
+    if not result["success"]:
+        return result
+
+    marked = await inference_executor.run(mark_attendance, result["user_id"])
+    return {**result, **marked, "success": True}
+
+@router.post("/recognize", response_model=AttendanceResponse)
+async def recognize_and_mark(request: FaceRecognitionRequest) -> Dict[str, Any]:
+    """
+    Recognize a face and record today's attendance in one call.
+    - Image should be a base64 encoded string
+    - Status is PRESENT or LATE based on the class schedule
+    - Repeat scans of the same student on the same day are not written again
+    """
+    return await _recognize_and_mark(request.image)
+
+@router.post("/recognize/upload", response_model=AttendanceResponse)
+async def recognize_and_mark_upload(request: Request) -> Dict[str, Any]:
+    """
+    Recognize a face from raw image bytes and record today's attendance.
+    - Send JPEG/PNG bytes as the body, or a multipart form with a 'file' field
+    """
+    image, _ = await _read_image_upload(request)
+    return await _recognize_and_mark(image)
+
+# Report columns, in CSV order and as NDJSON keys
+REPORT_COLUMNS = (
+    "class_date", "time_in", "status",
+    "user_id", "name", "email", "role",
+    "class_id", "grade", "section", "schedule_start", "schedule_end"
+)
+
+# Rows written by the frontend have no "classDate", so theirs is the date in school time
+REPORT_CLASS_DATE = """COALESCE(a."classDate", to_char(a."date" AT TIME ZONE 'UTC' AT TIME ZONE %(timezone)s, 'YYYY-MM-DD'))"""
+
+# Each attendance row with its user and the class it was marked against: a
+# student's own class, or for a teacher the earliest-starting class they
+# teach (the one mark_attendance takes the LATE cutoff from)
+REPORT_QUERY = """
+    SELECT
+        {class_date} AS class_date,
+        a."timeIn", a."status"::text,
+        u."id", u."name", u."email", u."role"::text,
+        k."id", k."grade", k."section", k."startTime", k."endTime"
+    FROM "Attendance" a
+    JOIN "User" u ON u."id" = a."userId"
+    LEFT JOIN LATERAL (
+        SELECT c."id", c."grade", c."section", s."startTime", s."endTime"
+        FROM "Class" c
+        LEFT JOIN "Schedule" s ON s."classId" = c."id"
+        WHERE c."id" = u."classId" OR c."teacherId" = u."id"
+        ORDER BY c."id" = u."classId" DESC, s."startTime"
+        LIMIT 1
+    ) k ON TRUE
+    {where}
+    ORDER BY class_date, k."grade", k."section", u."name"
+"""
+
+def report_query(
+    grade: Optional[int] = None,
+    class_id: Optional[str] = None,
+    role: Optional[str] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None
+) -> Tuple[str, Dict[str, Any]]:
+    """Build the report SQL and its parameters for the given filters (dates inclusive)"""
+    conditions = []
+    params: Dict[str, Any] = {"timezone": DEFAULT_TIMEZONE}
+    if grade is not None:
+        conditions.append('k."grade" = %(grade)s')
+        params["grade"] = grade
+    if class_id is not None:
+        conditions.append('k."id" = %(class_id)s')
+        params["class_id"] = class_id
+    if role is not None:
+        conditions.append('u."role" = %(role)s::"Role"')
+        params["role"] = role
+    # "YYYY-MM-DD" strings sort like the dates they hold
+    if start_date is not None:
+        conditions.append(f"{REPORT_CLASS_DATE} >= %(start_date)s")
+        params["start_date"] = start_date.isoformat()
+    if end_date is not None:
+        conditions.append(f"{REPORT_CLASS_DATE} <= %(end_date)s")
+        params["end_date"] = end_date.isoformat()
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return REPORT_QUERY.format(class_date=REPORT_CLASS_DATE, where=where), params
+
+def report_batches(query: str, params: Dict[str, Any], batch_rows: int = ATTENDANCE_REPORT_BATCH_ROWS) -> Iterator[List[tuple]]:
+    """Yield report rows batch by batch from a server-side cursor.
+
+    The result set stays in Postgres and only one batch is held here at a
+    time, so memory does not grow with the date range. The generator holds a
+    pooled connection until it is exhausted or closed.
+    """
+    with get_connection() as conn:
+        with conn.cursor(name="attendance_report", cursor_factory=TupleCursor) as cursor:
+            cursor.itersize = batch_rows
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(batch_rows)
+                if not rows:
+                    return
+                yield rows
+
+def _render_csv(rows: List[tuple]) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+def _render_ndjson(rows: List[tuple]) -> str:
+    return "".join(json.dumps(dict(zip(REPORT_COLUMNS, row))) + "\n" for row in rows)
+
+class ReportResponse(StreamingResponse):
+    """StreamingResponse that closes its body iterator however the response ends.
+
+    When the client disconnects, Starlette abandons the iterator mid-stream
+    without closing it, which would keep the report's cursor and pooled
+    connection checked out until garbage collection gets to it.
+    """
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.body_iterator.aclose()
+
+async def _close_batches(fetch: Optional[asyncio.Future], batches: Iterator[List[tuple]]):
+    """Close the batch generator on a worker thread once any fetch still running on one is done"""
+    if fetch is not None:
+        try:
+            await fetch
+        except Exception:
+            pass
+    # Closing returns the cursor and pooled connection, a round trip to Postgres
+    await run_in_threadpool(batches.close)
+
+async def _report_chunks(first: List[tuple], batches: Iterator[List[tuple]], report_format: str) -> AsyncIterator[str]:
+    """One response chunk per batch, fetching the next batch off the event loop"""
+    render = _render_csv if report_format == "csv" else _render_ndjson
+    fetch = None
+    try:
+        if report_format == "csv":
+            yield _render_csv([REPORT_COLUMNS])
+        rows = first
+        while rows:
+            yield render(rows)
+            # Shielded so a cancelled response leaves the fetch running for _close_batches to wait on
+            fetch = asyncio.ensure_future(run_in_threadpool(next, batches, []))
+            rows = await asyncio.shield(fetch)
+    except Exception as e:
+        # Headers are already sent; aborting the response leaves the download visibly incomplete
+        print(f"Error streaming attendance report: {e}")
+        raise
+    finally:
+        # A task of its own, so the generator is still closed if this wait is cancelled too
+        await asyncio.shield(asyncio.ensure_future(_close_batches(fetch, batches)))
+
+@router.get("/report")
+async def attendance_report(
+    report_format: Literal["csv", "ndjson"] = Query("csv", alias="format"),
+    grade: Optional[int] = None,
+    class_id: Optional[str] = None,
+    role: Optional[Literal["ADMIN", "TEACHER", "STUDENT"]] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None
+) -> ReportResponse:
+    """
+    Stream attendance records joined with their user, class and schedule.
+    - format: csv (default) or ndjson
+    - Filters: grade, class_id, role, start_date and end_date (YYYY-MM-DD, inclusive)
+    - Rows are read from a server-side cursor in batches, so any date range can be exported
+    """
+    query, params = report_query(grade, class_id, role, start_date, end_date)
+    batches = report_batches(query, params)
+    # Run the query before answering, so a database error is still a 500 and not a truncated file
+    try:
+        first = await run_in_threadpool(next, batches, [])
+    except Exception as e:
+        print(f"Error running attendance report: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Could not build attendance report")
+
+    filename = f"attendance_{start_date or 'all'}_{end_date or 'all'}.{report_format}"
+    return ReportResponse(
+        _report_chunks(first, batches, report_format),
+        media_type="text/csv" if report_format == "csv" else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
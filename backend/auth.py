@@ -1,13 +1,20 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel
 from typing import Optional
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import os
+import asyncio
+import threading
+import multiprocessing
 from dotenv import load_dotenv
-from database import get_db_connection
+from database import get_connection, register_statement, execute_prepared, ChangeListener
+from cache import TTLCache
+from metrics import span
 
 # Load environment variables
 load_dotenv()
@@ -17,15 +24,35 @@ SECRET_KEY = os.getenv("SECRET_KEY", "supersecretkey")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Where bcrypt runs: "thread" or "process" keeps the event loop free during
+# the ~100-250 ms verify; "inline" runs it on the event loop
+AUTH_HASH_MODE = os.getenv("AUTH_HASH_MODE", "thread")
+AUTH_HASH_WORKERS = int(os.getenv("AUTH_HASH_WORKERS", "0")) or (os.cpu_count() or 1)
+
+# Users looked up at login are cached by email; entries are dropped when the
+# row's email, password or role changes (see the User_notify_auth_change trigger)
+AUTH_USER_CACHE_TTL = float(os.getenv("AUTH_USER_CACHE_TTL", "60"))
+AUTH_USER_CACHE_SIZE = int(os.getenv("AUTH_USER_CACHE_SIZE", "10000"))
+USER_CHANNEL = "user_auth_changes"
+
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 # OAuth2 scheme
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
 # Create API router
 router = APIRouter()
 
+# Login looks users up by email on every cache miss
+register_statement("user_by_email", 'SELECT * FROM "User" WHERE email = $1')
+
+user_cache = TTLCache(AUTH_USER_CACHE_TTL, AUTH_USER_CACHE_SIZE)
+user_change_listener = ChangeListener(USER_CHANNEL)
+_user_changes_lock = threading.Lock()
+_hash_executor = None
+_hash_executor_lock = threading.Lock()
+
 # Models
 class Token(BaseModel):
     access_token: str
@@ -35,6 +62,8 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     username: Optional[str] = None
+    user_id: Optional[str] = None
+    role: Optional[str] = None
 
 class User(BaseModel):
     id: str
@@ -54,6 +83,40 @@ def get_password_hash(password):
     """Get hash for password"""
     return pwd_context.hash(password)
 
+def _get_hash_executor():
+    """Create the password hashing pool on first use"""
+    global _hash_executor
+    with _hash_executor_lock:
+        if _hash_executor is None:
+            if AUTH_HASH_MODE == "process":
+                _hash_executor = ProcessPoolExecutor(
+                    max_workers=AUTH_HASH_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            else:
+                _hash_executor = ThreadPoolExecutor(
+                    max_workers=AUTH_HASH_WORKERS,
+                    thread_name_prefix="auth-hash"
+                )
+        return _hash_executor
+
+async def verify_password_async(plain_password, hashed_password):
+    """Verify password against hash on the hashing pool"""
+    with span("password_verify"):
+        if AUTH_HASH_MODE == "inline":
+            return verify_password(plain_password, hashed_password)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_hash_executor(), verify_password, plain_password, hashed_password)
+
+def shutdown_auth():
+    """Stop the hashing pool and the user change listener"""
+    global _hash_executor
+    with _hash_executor_lock:
+        if _hash_executor is not None:
+            _hash_executor.shutdown(wait=True)
+            _hash_executor = None
+    user_change_listener.close()
+
 def create_access_token(data: dict):
     """Create JWT token"""
     to_encode = data.copy()
@@ -62,40 +125,78 @@ def create_access_token(data: dict):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def invalidate_user(email: Optional[str] = None):
+    """Drop one cached user, or every cached user when email is None"""
+    if email is None:
+        user_cache.clear()
+    else:
+        user_cache.pop(email)
+
+def _apply_user_changes():
+    """Evict users changed in the database since the last poll"""
+    with _user_changes_lock:
+        changed = user_change_listener.poll()
+    if changed is None:
+        # The listener reconnected and may have missed notifications
+        invalidate_user()
+        return
+    for email in changed:
+        invalidate_user(email)
+
 def get_user(email: str):
-    """Get user from database by email"""
-    conn = get_db_connection()
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM users WHERE email = %s", (email,))
-        user = cur.fetchone()
-        if user:
-            return {
-                "id": user["id"],
-                "email": user["email"],
-                "name": user["name"],
-                "role": user["role"],
-                "password": user["password"],
-                "disabled": False
-            }
-        return None
-    finally:
-        cur.close()
-        conn.close()
-
-def authenticate_user(email: str, password: str):
+    """Get user by email, from the cache when possible"""
+    _apply_user_changes()
+    cached = user_cache.get(email)
+    if cached is not None:
+        return dict(cached)
+
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            execute_prepared(cur, "user_by_email", (email,))
+            user = cur.fetchone()
+    if user:
+        user = {
+            "id": user["id"],
+            "email": user["email"],
+            "name": user["name"],
+            "role": user["role"],
+            "password": user["password"],
+            "disabled": False
+        }
+        user_cache.set(email, user)
+        return dict(user)
+    return None
+
+async def authenticate_user(email: str, password: str):
     """Authenticate user"""
-    user = get_user(email)
+    user = await run_in_threadpool(get_user, email)
     if not user:
         return False
-    if not verify_password(password, user["password"]):
+    if not await verify_password_async(password, user["password"]):
         return False
     return user
 
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> TokenData:
+    """Resolve the caller from the bearer token's signature and claims, without a database lookup"""
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise credentials_exception
+    email = payload.get("sub")
+    user_id = payload.get("user_id")
+    if email is None or user_id is None:
+        raise credentials_exception
+    return TokenData(username=email, user_id=user_id, role=payload.get("role"))
+
 @router.post("/login", response_model=Token)
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
     """Endpoint for user login"""
-    user = authenticate_user(form_data.username, form_data.password)
+    user = await authenticate_user(form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -110,4 +211,9 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
         "token_type": "bearer",
         "user_id": user["id"],
         "user_role": user["role"]
-    } 
\ No newline at end of file
+    } 
+
+@router.get("/me", response_model=TokenData)
+async def read_current_user(current_user: TokenData = Depends(get_current_user)):
+    """Return the caller's identity from their access token"""
+    return current_user
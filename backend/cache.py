@@ -0,0 +1,52 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+class TTLCache:
+    """Thread-safe dict whose entries expire after ttl seconds.
+
+    With max_size set, the least recently used entry is evicted once the
+    cache is full.
+    """
+
+    def __init__(self, ttl: float, max_size: Optional[int] = None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[Any, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Any) -> Any:
+        """Return the cached value, or None when missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: Any, value: Any):
+        now = time.monotonic()
+        with self._lock:
+            self._entries[key] = (now + self.ttl, value)
+            self._entries.move_to_end(key)
+            if self.max_size is not None:
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+            elif len(self._entries) > 10000:
+                # Unbounded caches still drop expired entries once they grow
+                self._entries = OrderedDict((k, v) for k, v in self._entries.items() if v[0] >= now)
+
+    def pop(self, key: Any):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -1,7 +1,16 @@
 import os
+import time
+import select
+import threading
 import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+from psycopg2.pool import ThreadedConnectionPool
 from psycopg2.extras import RealDictCursor
+from contextlib import contextmanager
 from dotenv import load_dotenv
+from typing import Dict, Optional, Sequence, Set, Any
+from metrics import span
 import urllib.parse as up
 
 # Load environment variables from .env file
@@ -10,6 +19,214 @@ load_dotenv()
 # Parse the DATABASE_URL
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Connection pool settings
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))  # seconds to wait for a free connection
+DB_POOL_HEALTHCHECK_INTERVAL = float(os.getenv("DB_POOL_HEALTHCHECK_INTERVAL", "30"))  # idle seconds before a ping
+
+# Server-side prepared statements for hot queries, keyed by name.
+# Modules register theirs at import time with register_statement().
+PREPARED_STATEMENTS: Dict[str, str] = {}
+
+class PooledConnection(psycopg2.extensions.connection):
+    """psycopg2 connection that remembers its prepared statements and last use"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.last_used = time.monotonic()
+
+class ConnectionPool:
+    """Thread-safe Postgres connection pool with blocking checkout and health checks"""
+
+    def __init__(self, minconn: int = DB_POOL_MIN, maxconn: int = DB_POOL_MAX):
+        self.maxconn = maxconn
+        self._pool = ThreadedConnectionPool(
+            minconn,
+            maxconn,
+            DATABASE_URL,
+            connection_factory=PooledConnection,
+            cursor_factory=RealDictCursor
+        )
+        # ThreadedConnectionPool raises instead of waiting when exhausted,
+        # so callers queue on this semaphore first.
+        self._slots = threading.BoundedSemaphore(maxconn)
+
+    def _is_healthy(self, conn: PooledConnection) -> bool:
+        """Ping connections that have been idle longer than the health-check interval"""
+        if conn.closed:
+            return False
+        if time.monotonic() - conn.last_used < DB_POOL_HEALTHCHECK_INTERVAL:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self, timeout: float = DB_POOL_TIMEOUT) -> PooledConnection:
+        """Check out a healthy connection, waiting up to timeout seconds for one"""
+        if not self._slots.acquire(timeout=timeout):
+            raise psycopg2.pool.PoolError("Timed out waiting for a database connection")
+        try:
+            for _ in range(self.maxconn + 1):
+                conn = self._pool.getconn()
+                if self._is_healthy(conn):
+                    return conn
+                self._pool.putconn(conn, close=True)
+            raise psycopg2.OperationalError("No healthy database connection available")
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn: PooledConnection, close: bool = False):
+        """Return a connection to the pool, ending any open transaction"""
+        try:
+            if not conn.closed and not close:
+                if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                conn.last_used = time.monotonic()
+        except psycopg2.Error:
+            close = True
+        finally:
+            self._pool.putconn(conn, close=close or bool(conn.closed))
+            self._slots.release()
+
+    def closeall(self):
+        """Close every pooled connection"""
+        self._pool.closeall()
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ConnectionPool:
+    """Return the process-wide connection pool, creating it on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+def close_pool():
+    """Close the process-wide connection pool (called on app shutdown)"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+@contextmanager
+def get_connection():
+    """Borrow a pooled connection for the duration of a with-block.
+
+    Uncommitted work is rolled back when the block exits, and connections
+    that failed at the protocol level are discarded instead of reused.
+    """
+    pool = get_pool()
+    with span("db_pool_wait"):
+        conn = pool.getconn()
+    broken = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        pool.putconn(conn, close=broken)
+
+def register_statement(name: str, sql: str):
+    """Register a query to be run as a server-side prepared statement.
+
+    Parameters are written as $1, $2, ... in the SQL.
+    """
+    PREPARED_STATEMENTS[name] = sql
+
+def execute_prepared(cursor, name: str, params: Sequence[Any] = ()):
+    """Execute a registered statement, preparing it on this connection first if needed"""
+    conn = cursor.connection
+    if name not in conn.prepared:
+        try:
+            cursor.execute(f"PREPARE {name} AS {PREPARED_STATEMENTS[name]}")
+        except psycopg2.errors.DuplicatePreparedStatement:
+            conn.prepared.add(name)
+            raise
+        conn.prepared.add(name)
+
+    placeholders = ", ".join(["%s"] * len(params))
+    try:
+        cursor.execute(f"EXECUTE {name} ({placeholders})" if params else f"EXECUTE {name}", params)
+    except psycopg2.errors.InvalidSqlStatementName:
+        conn.prepared.discard(name)
+        raise
+
+class ChangeListener:
+    """LISTENs on a NOTIFY channel over a dedicated connection.
+
+    Any object with the same ``poll()`` contract can stand in for this class
+    (e.g. a fake notifier in tests).
+    """
+
+    def __init__(self, channel: str, reconnect_interval: float = 5.0):
+        self.channel = channel
+        self.reconnect_interval = reconnect_interval
+        self.conn = None
+        self._was_connected = False
+        self._last_attempt = 0.0
+
+    def _listen(self) -> bool:
+        """Open the LISTEN connection, rate-limited between attempts"""
+        now = time.monotonic()
+        if now - self._last_attempt < self.reconnect_interval:
+            return False
+        self._last_attempt = now
+        try:
+            self.conn = psycopg2.connect(DATABASE_URL)
+            self.conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with self.conn.cursor() as cursor:
+                cursor.execute(f"LISTEN {self.channel}")
+            return True
+        except Exception as e:
+            print(f"Listener connection error: {e}")
+            self.close()
+            return False
+
+    def poll(self) -> Optional[Set[str]]:
+        """Drain pending notifications without blocking.
+
+        Returns the set of payloads received, or None when the connection was
+        re-established after a drop and notifications may have been missed.
+        """
+        if self.conn is None:
+            if not self._listen():
+                return set()
+            if self._was_connected:
+                return None
+            self._was_connected = True
+
+        try:
+            if select.select([self.conn], [], [], 0) != ([], [], []):
+                self.conn.poll()
+            changed = {notify.payload for notify in self.conn.notifies}
+            self.conn.notifies.clear()
+            return changed
+        except Exception as e:
+            print(f"Listener poll error: {e}")
+            self.close()
+            return set()
+
+    def close(self):
+        """Close the LISTEN connection"""
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+        self.conn = None
+
 def get_db_connection():
     """Establish and return a connection to the PostgreSQL database."""
     conn = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
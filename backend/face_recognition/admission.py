@@ -0,0 +1,255 @@
+import os
+import json
+import math
+import time
+import asyncio
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Sequence
+from fastapi import HTTPException, status
+import metrics
+
+# Most face requests admitted at once (running plus waiting for the inference
+# pool); further requests get 503 with Retry-After instead of queueing
+FACE_QUEUE_MAX_DEPTH = int(os.getenv("FACE_QUEUE_MAX_DEPTH", "32"))
+
+# Longest a face request may take, in milliseconds. Clients can ask for less
+# with an X-Request-Timeout-Ms header; a kiosk that gives up after 3 s should
+# say so, so that the server stops working on its request at that point too.
+FACE_REQUEST_TIMEOUT_MS = float(os.getenv("FACE_REQUEST_TIMEOUT_MS", "10000"))
+
+TIMEOUT_HEADER = b"x-request-timeout-ms"
+
+CLIENT_CLOSED_REQUEST = 499
+
+# Requests subject to admission control: the endpoints that run inference
+ADMITTED_PATHS = ("/api/face/", "/api/attendance/recognize")
+
+# Bulk enrollment (up to FACE_BULK_MAX_ITEMS images per request) is an admin
+# batch, not a kiosk request: no request deadline applies to it
+EXEMPT_PATHS = ("/api/face/register/bulk",)
+
+# Weight of the newest request in each route's moving average of pool time
+REQUEST_SECONDS_SMOOTHING = 0.2
+
+# Deadline (time.monotonic()) of the request being served in this context
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+# Inference pool seconds spent on the request being served, added to by the executor
+_work: ContextVar[Optional[List[float]]] = ContextVar("request_work", default=None)
+
+# Face requests admitted and not yet finished, in this worker process
+_depth = 0
+
+def queue_depth() -> int:
+    """Face requests currently admitted (running or waiting for the inference pool)"""
+    return _depth
+
+metrics.gauge(
+    "face_queue_depth",
+    "Face requests admitted and not yet finished in this worker",
+    queue_depth
+)
+
+SHED_REQUESTS = metrics.counter(
+    "face_requests_shed_total",
+    "Face requests refused or abandoned by admission control",
+    ["reason"]
+)
+
+class DeadlineExceeded(HTTPException):
+    """Raised instead of starting work for a request whose deadline has passed"""
+
+    def __init__(self):
+        super().__init__(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail="Request deadline exceeded")
+
+def deadline() -> float:
+    """Deadline of the current request; work outside one is due FACE_REQUEST_TIMEOUT_MS from now"""
+    current = _deadline.get()
+    return current if current is not None else time.monotonic() + FACE_REQUEST_TIMEOUT_MS / 1000.0
+
+def expired() -> bool:
+    """True if the current request's deadline has passed"""
+    deadline = _deadline.get()
+    return deadline is not None and time.monotonic() >= deadline
+
+def add_work(seconds: float):
+    """Charge inference pool time to the current request"""
+    work = _work.get()
+    if work is not None:
+        work[0] += seconds
+
+class AdmissionMiddleware:
+    """Bounds the number of face requests in flight and enforces their deadlines.
+
+    A request over FACE_QUEUE_MAX_DEPTH, or one that the inference pool's
+    backlog could not serve within its deadline, is answered 503 straight
+    away with a Retry-After estimate. Each route keeps a moving average of
+    the pool seconds its requests used; the backlog is the sum of those
+    expectations over the requests already admitted, spread over the pool's
+    workers. Counting admitted requests rather than queued jobs also covers
+    a burst that arrives before any of it reaches the pool. A route whose
+    own expectation exceeds the deadline has it decayed each time it is
+    shed, so one slow request cannot lock the route out for good.
+
+    Admitted requests are cancelled when their deadline passes (504) or
+    their client disconnects; cancelling drops their jobs still waiting in
+    the pool, and jobs that reach a worker after the deadline are skipped
+    (see InferenceExecutor._timed).
+    """
+
+    def __init__(
+        self,
+        app,
+        workers: int,
+        max_depth: int = FACE_QUEUE_MAX_DEPTH,
+        timeout_ms: float = FACE_REQUEST_TIMEOUT_MS,
+        paths: Sequence[str] = ADMITTED_PATHS,
+        exempt_paths: Sequence[str] = EXEMPT_PATHS
+    ):
+        self.app = app
+        self.workers = workers
+        self.max_depth = max_depth
+        self.timeout = timeout_ms / 1000.0
+        self.paths = tuple(paths)
+        self.exempt_paths = tuple(exempt_paths)
+        # Per route: moving average of the pool seconds a finished request used
+        self.route_seconds: Dict[str, float] = {}
+        # Sum of route_seconds over the requests currently admitted
+        self.backlog_seconds = 0.0
+
+    def estimated_wait(self) -> float:
+        """Seconds until the pool has served the requests already admitted"""
+        return self.backlog_seconds / self.workers
+
+    def _applies(self, scope) -> bool:
+        if scope["type"] != "http" or scope["method"] != "POST":
+            return False
+        path = scope["path"]
+        return path.startswith(self.paths) and not path.startswith(self.exempt_paths)
+
+    def _timeout(self, scope) -> float:
+        """The server timeout, shortened by the client's X-Request-Timeout-Ms"""
+        for name, value in scope["headers"]:
+            if name == TIMEOUT_HEADER:
+                try:
+                    requested = float(value) / 1000.0
+                except ValueError:
+                    break
+                if requested > 0:
+                    return min(requested, self.timeout)
+        return self.timeout
+
+    async def _reject(self, send, wait: float):
+        retry_after = max(1, math.ceil(wait))
+        body = json.dumps({
+            "success": False,
+            "message": f"Server busy, retry in {retry_after}s"
+        }).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status.HTTP_503_SERVICE_UNAVAILABLE,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(retry_after).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        global _depth
+        if not self._applies(scope):
+            await self.app(scope, receive, send)
+            return
+
+        route = scope["path"]
+        timeout = self._timeout(scope)
+        expected = self.route_seconds.get(route, 0.0)
+        wait = self.estimated_wait()
+        if _depth >= self.max_depth:
+            SHED_REQUESTS.inc(reason="queue_full")
+            await self._reject(send, wait)
+            return
+        if wait + expected > timeout:
+            SHED_REQUESTS.inc(reason="backlog")
+            if expected > timeout:
+                # Nothing on this route is admitted to correct the average, so let it decay
+                self.route_seconds[route] = expected * (1 - REQUEST_SECONDS_SMOOTHING)
+            await self._reject(send, wait)
+            return
+
+        _depth += 1
+        self.backlog_seconds += expected
+        work = [0.0]
+        deadline_token = _deadline.set(time.monotonic() + timeout)
+        work_token = _work.set(work)
+        try:
+            finished = await self._serve(scope, receive, send, timeout)
+        finally:
+            _work.reset(work_token)
+            _deadline.reset(deadline_token)
+            _depth -= 1
+            # Reset when idle so float rounding cannot accumulate
+            self.backlog_seconds = self.backlog_seconds - expected if _depth else 0.0
+        # Requests that never reached the pool (validation errors, ...) say nothing about its speed
+        if finished and work[0] > 0:
+            current = self.route_seconds.get(route, work[0])
+            self.route_seconds[route] = current + REQUEST_SECONDS_SMOOTHING * (work[0] - current)
+
+    async def _serve(self, scope, receive, send, timeout: float) -> bool:
+        """Run the app, cancelling it at the deadline or when the client goes away; True if it finished"""
+        body_read = asyncio.Event()
+        response = {"started": False, "complete": False}
+
+        async def receive_request() -> Any:
+            message = await receive()
+            if message["type"] == "http.request" and not message.get("more_body", False):
+                body_read.set()
+            return message
+
+        async def send_response(message):
+            # Marked only once sent: a send cancelled at the deadline may not have delivered it
+            await send(message)
+            if message["type"] == "http.response.start":
+                response["started"] = True
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                response["complete"] = True
+
+        async def wait_for_disconnect():
+            # Once the app has the whole body, the next message is the disconnect
+            await body_read.wait()
+            while (await receive())["type"] != "http.disconnect":
+                pass
+
+        handler = asyncio.ensure_future(self.app(scope, receive_request, send_response))
+        watcher = asyncio.ensure_future(wait_for_disconnect())
+        try:
+            done, _ = await asyncio.wait({handler, watcher}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            handler.cancel()
+            raise
+        finally:
+            watcher.cancel()
+        if handler in done or response["complete"]:
+            await handler
+            return True
+
+        handler.cancel()
+        await asyncio.gather(handler, return_exceptions=True)
+        if watcher in done:
+            # Nobody is left to read it, but outer middleware expects a response;
+            # 499 is the usual "client closed request" status in access logs
+            SHED_REQUESTS.inc(reason="disconnected")
+            status_code, detail = CLIENT_CLOSED_REQUEST, "Client closed request"
+        else:
+            SHED_REQUESTS.inc(reason="deadline")
+            status_code, detail = status.HTTP_504_GATEWAY_TIMEOUT, "Request deadline exceeded"
+        if not response["started"]:
+            body = json.dumps({"detail": detail}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": status_code,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+            })
+            await send({"type": "http.response.body", "body": body})
+        return False
@@ -0,0 +1,193 @@
+import os
+import numpy as np
+from typing import Optional
+
+# "exact" scans the whole gallery; "ivf" probes an inverted-file index
+FACE_SEARCH_BACKEND = os.getenv("FACE_SEARCH_BACKEND", "exact")
+
+# Number of IVF cells, cells probed per query, and the gallery size below
+# which the IVF index stays untrained and search is exact
+FACE_IVF_NLIST = int(os.getenv("FACE_IVF_NLIST", "256"))
+FACE_IVF_NPROBE = int(os.getenv("FACE_IVF_NPROBE", "8"))
+FACE_IVF_MIN_TRAIN = int(os.getenv("FACE_IVF_MIN_TRAIN", "10000"))
+
+class ExactSearch:
+    """Brute-force search: the gallery scans every row itself"""
+
+    ready = False
+
+    def reset(self):
+        pass
+
+    def needs_training(self, size: int) -> bool:
+        return False
+
+    def rebuild(self, matrix: np.ndarray, retrain: bool = True):
+        pass
+
+    def add(self, row: int, vector: np.ndarray):
+        pass
+
+    def update(self, row: int, vector: np.ndarray):
+        pass
+
+    def remove(self, row: int):
+        pass
+
+    def move(self, src: int, dst: int):
+        pass
+
+    def candidates(self, query: np.ndarray) -> Optional[np.ndarray]:
+        return None
+
+class IVFIndex:
+    """Inverted-file index over gallery rows, trained with spherical k-means.
+
+    Rows are bucketed by their nearest centroid; a query scores only the rows
+    in its nprobe nearest buckets. Inserts, deletes and the gallery's
+    swap-with-last row moves are O(1) per row. Until the gallery reaches
+    min_train rows the index is not trained and the gallery searches exactly.
+    """
+
+    def __init__(
+        self,
+        dim: int,
+        nlist: int = FACE_IVF_NLIST,
+        nprobe: int = FACE_IVF_NPROBE,
+        min_train: int = FACE_IVF_MIN_TRAIN,
+        train_iterations: int = 10,
+        seed: int = 0
+    ):
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train = max(min_train, nlist)
+        self.train_iterations = train_iterations
+        self._rng = np.random.default_rng(seed)
+        self.reset()
+
+    @property
+    def ready(self) -> bool:
+        return self.centroids is not None
+
+    def reset(self):
+        """Drop centroids and every bucket"""
+        self.centroids: Optional[np.ndarray] = None
+        self._lists = [np.empty(0, dtype=np.int64) for _ in range(self.nlist)]
+        self._sizes = np.zeros(self.nlist, dtype=np.int64)
+        self._assign = np.full(0, -1, dtype=np.int64)   # row -> bucket
+        self._pos = np.full(0, -1, dtype=np.int64)      # row -> position in bucket
+
+    def needs_training(self, size: int) -> bool:
+        return self.centroids is None and size >= self.min_train
+
+    def _train(self, matrix: np.ndarray) -> np.ndarray:
+        """Spherical k-means on a sample of at most 64 rows per centroid"""
+        sample_size = min(len(matrix), 64 * self.nlist)
+        sample = matrix[self._rng.choice(len(matrix), sample_size, replace=False)]
+        centroids = sample[self._rng.choice(sample_size, self.nlist, replace=False)].copy()
+        for _ in range(self.train_iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            counts = np.bincount(assignment, minlength=self.nlist)
+            empty = counts == 0
+            # Reseed empty cells with random sample rows
+            sums[empty] = sample[self._rng.choice(sample_size, int(empty.sum()))]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            centroids = sums / np.where(norms == 0, 1, norms)
+        return centroids.astype(np.float32)
+
+    def rebuild(self, matrix: np.ndarray, retrain: bool = True):
+        """Retrain centroids (when large enough) and re-bucket every row.
+
+        With retrain=False existing centroids are kept and only the buckets
+        are rebuilt, which is much cheaper for a gallery that changed a little.
+        """
+        centroids = None if retrain else self.centroids
+        self.reset()
+        if len(matrix) < self.min_train:
+            return
+        self.centroids = centroids if centroids is not None else self._train(matrix)
+        for start in range(0, len(matrix), 8192):
+            block = matrix[start:start + 8192]
+            buckets = np.argmax(block @ self.centroids.T, axis=1)
+            for offset, bucket in enumerate(buckets):
+                self._insert(start + offset, int(bucket))
+
+    def _ensure_row_capacity(self, row: int):
+        if row < len(self._assign):
+            return
+        capacity = max(1024, len(self._assign))
+        while capacity <= row:
+            capacity *= 2
+        self._assign = np.concatenate([self._assign, np.full(capacity - len(self._assign), -1, dtype=np.int64)])
+        self._pos = np.concatenate([self._pos, np.full(capacity - len(self._pos), -1, dtype=np.int64)])
+
+    def _insert(self, row: int, bucket: int):
+        self._ensure_row_capacity(row)
+        size = self._sizes[bucket]
+        rows = self._lists[bucket]
+        if size == len(rows):
+            grown = np.empty(max(16, 2 * len(rows)), dtype=np.int64)
+            grown[:size] = rows[:size]
+            rows = self._lists[bucket] = grown
+        rows[size] = row
+        self._sizes[bucket] = size + 1
+        self._assign[row] = bucket
+        self._pos[row] = size
+
+    def add(self, row: int, vector: np.ndarray):
+        if self.centroids is None:
+            return
+        self._insert(row, int(np.argmax(self.centroids @ vector)))
+
+    def update(self, row: int, vector: np.ndarray):
+        if self.centroids is None:
+            return
+        self.remove(row)
+        self.add(row, vector)
+
+    def remove(self, row: int):
+        """Take a row out of its bucket by moving the bucket's last entry into its slot"""
+        if self.centroids is None or row >= len(self._assign) or self._assign[row] < 0:
+            return
+        bucket = self._assign[row]
+        position = self._pos[row]
+        last = self._sizes[bucket] - 1
+        rows = self._lists[bucket]
+        moved = rows[last]
+        rows[position] = moved
+        self._pos[moved] = position
+        self._sizes[bucket] = last
+        self._assign[row] = -1
+        self._pos[row] = -1
+
+    def move(self, src: int, dst: int):
+        """Follow the gallery moving row src into slot dst"""
+        if self.centroids is None or self._assign[src] < 0:
+            return
+        self._ensure_row_capacity(dst)
+        bucket = self._assign[src]
+        position = self._pos[src]
+        self._lists[bucket][position] = dst
+        self._assign[dst] = bucket
+        self._pos[dst] = position
+        self._assign[src] = -1
+        self._pos[src] = -1
+
+    def candidates(self, query: np.ndarray) -> Optional[np.ndarray]:
+        """Rows in the nprobe buckets nearest to a normalized query"""
+        if self.centroids is None:
+            return None
+        nprobe = min(self.nprobe, self.nlist)
+        probes = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        return np.concatenate([self._lists[bucket][:self._sizes[bucket]] for bucket in probes])
+
+def create_search_backend(dim: int, backend: str = FACE_SEARCH_BACKEND):
+    """Build the configured search backend for a gallery"""
+    if backend == "ivf":
+        return IVFIndex(dim)
+    if backend == "exact":
+        return ExactSearch()
+    raise ValueError(f"Unknown FACE_SEARCH_BACKEND '{backend}', expected 'exact' or 'ivf'")
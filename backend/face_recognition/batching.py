@@ -0,0 +1,102 @@
+import os
+import time
+import queue
+import threading
+import numpy as np
+from concurrent.futures import Future
+from typing import Callable, List, Tuple
+from metrics import span
+
+# Largest batch sent to the recognition model (1 disables batching)
+FACE_BATCH_MAX_SIZE = int(os.getenv("FACE_BATCH_MAX_SIZE", "8"))
+
+# How long the first crop in a batch waits for others to arrive
+FACE_BATCH_MAX_WAIT_MS = float(os.getenv("FACE_BATCH_MAX_WAIT_MS", "5"))
+
+class EmbeddingBatcher:
+    """Collects aligned face crops from concurrent requests into batched forward passes.
+
+    Callers block in embed() until their crop has been processed; a single
+    background thread drains the queue, waiting at most max_wait_ms after the
+    first crop for up to max_batch_size crops, then fans the rows of the
+    batched output back out to the waiting callers.
+    """
+
+    def __init__(
+        self,
+        embed_batch: Callable[[List[np.ndarray]], np.ndarray],
+        max_batch_size: int = FACE_BATCH_MAX_SIZE,
+        max_wait_ms: float = FACE_BATCH_MAX_WAIT_MS
+    ):
+        self.embed_batch = embed_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: "queue.Queue[Tuple[np.ndarray, Future]]" = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def embed(self, crop: np.ndarray) -> np.ndarray:
+        """Return the embedding for one aligned crop"""
+        if self.max_batch_size <= 1:
+            return self.embed_batch([crop])[0]
+
+        future: Future = Future()
+        self._ensure_thread()
+        self._queue.put((crop, future))
+        return future.result()
+
+    def embed_many(self, crops: List[np.ndarray]) -> List[np.ndarray]:
+        """Return embeddings for several crops from one request, queued together"""
+        if self.max_batch_size <= 1:
+            return [self.embed_batch([crop])[0] for crop in crops]
+
+        futures = [Future() for _ in crops]
+        self._ensure_thread()
+        for crop, future in zip(crops, futures):
+            self._queue.put((crop, future))
+        return [future.result() for future in futures]
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="face-batcher", daemon=True)
+                self._thread.start()
+
+    def _collect(self) -> List[Tuple[np.ndarray, Future]]:
+        """Block for the first crop, then gather more until the batch is full or the wait expires"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            crops = [crop for crop, _ in batch]
+            try:
+                # Runs outside any request, so this only feeds the histogram
+                with span("embed_forward"):
+                    embeddings = self.embed_batch(crops)
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                    continue
+                # Models exported with a fixed batch dimension cannot run
+                # batched, so fall back to one crop at a time.
+                print(f"Batched embedding failed, retrying individually: {e}")
+                for crop, future in batch:
+                    try:
+                        future.set_result(self.embed_batch([crop])[0])
+                    except Exception as item_error:
+                        future.set_exception(item_error)
+                continue
+
+            for (_, future), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
@@ -1,143 +1,448 @@
 import os
 import json
+import time
+import threading
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import numpy as np
+from psycopg2.extras import RealDictCursor, execute_values
 from dotenv import load_dotenv
-from typing import List, Optional, Dict, Any
+from database import get_connection, register_statement, execute_prepared, ChangeListener
+from metrics import timed
+from datetime import datetime, timedelta
+from typing import List, Optional, Dict, Any, Iterable, Set, Sequence, Tuple
 
 # Load environment variables
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-class Database:
-    """Database connection class for face recognition"""
+# How embeddings are written: "json" (legacy text column only), "dual" (text
+# and binary, for rollout) or "binary" (bytea only). Reads always prefer the
+# binary column and fall back to the JSON text.
+EMBEDDING_STORAGE = os.getenv("FACE_EMBEDDING_STORAGE", "dual")
+
+# Element type of the binary column: "float32" or "float16"
+EMBEDDING_DTYPE = os.getenv("FACE_EMBEDDING_DTYPE", "float32")
+
+EMBEDDING_DTYPES = {
+    "float32": np.dtype("<f4"),
+    "float16": np.dtype("<f2"),
+}
+
+# Columns selected for an embedding; the binary ones only exist after the migration
+EMBEDDING_COLUMNS = (
+    'embedding' if EMBEDDING_STORAGE == "json"
+    else 'embedding, "embeddingData", "embeddingDtype"'
+)
+
+# Channel the FaceEmbedding trigger publishes changed userIds on
+EMBEDDING_CHANNEL = "face_embedding_changes"
+
+# Seconds between updatedAt watermark sweeps (safety net for lost notifications)
+SYNC_WATERMARK_INTERVAL = float(os.getenv("FACE_SYNC_WATERMARK_INTERVAL", "30"))
+
+# Overlap applied to the watermark so rows committed late are not skipped
+SYNC_WATERMARK_OVERLAP = timedelta(seconds=5)
+
+def encode_embedding(embedding: Any, dtype: str = EMBEDDING_DTYPE) -> bytes:
+    """Pack an embedding as little-endian float32/float16 bytes"""
+    return np.asarray(embedding, dtype=EMBEDDING_DTYPES[dtype]).ravel().tobytes()
+
+def decode_embedding(row: Dict[str, Any]) -> np.ndarray:
+    """Read an embedding from a FaceEmbedding row, preferring the binary column.
+
+    The binary column is wrapped with np.frombuffer, so no per-element parsing
+    or copying happens; rows not yet migrated fall back to the JSON text.
+    """
+    data = row.get("embeddingData")
+    if data is not None:
+        dtype = EMBEDDING_DTYPES[row.get("embeddingDtype") or "float32"]
+        return np.frombuffer(data, dtype=dtype)
+    return np.asarray(json.loads(row["embedding"]), dtype=np.float32)
+
+def embedding_columns_for_write(embedding: Any) -> Dict[str, Any]:
+    """Column values to store for an embedding under the configured storage mode.
 
-    def __init__(self):
-        self.conn = None
-        self.cursor = None
+    In "json" mode only the legacy text column is written, so the backend keeps
+    working against a database that has not been migrated yet.
+    """
+    embedding_json = json.dumps(np.asarray(embedding, dtype=np.float32).ravel().tolist())
+    if EMBEDDING_STORAGE == "json":
+        return {"embedding": embedding_json}
+    return {
+        "embedding": embedding_json if EMBEDDING_STORAGE == "dual" else None,
+        "embeddingData": psycopg2.Binary(encode_embedding(embedding)),
+        "embeddingDtype": EMBEDDING_DTYPE,
+    }
 
-    def connect(self):
-        """Connect to the PostgreSQL database using DATABASE_URL"""
+# Hot queries run as server-side prepared statements on pooled connections
+_WRITE_COLUMNS = ["embedding"] if EMBEDDING_STORAGE == "json" else ["embedding", "embeddingData", "embeddingDtype"]
+_INSERT_COLUMNS = ", ".join(f'"{name}"' for name in _WRITE_COLUMNS)
+_UPSERT_ASSIGNMENTS = ", ".join(f'"{name}" = EXCLUDED."{name}"' for name in _WRITE_COLUMNS)
+
+register_statement(
+    "embedding_by_user_id",
+    f'''SELECT {EMBEDDING_COLUMNS} FROM "FaceEmbedding" WHERE "userId" = $1'''
+)
+register_statement(
+    "user_by_qr_code",
+    '''
+    SELECT id FROM "User"
+    WHERE "qrCode" = ANY($1) OR id = ANY($2)
+    ORDER BY "qrCode" = ANY($1) DESC
+    LIMIT 1
+    '''
+)
+register_statement(
+    "upsert_embedding",
+    f'''
+    INSERT INTO "FaceEmbedding" (id, "userId", {_INSERT_COLUMNS}, "createdAt", "updatedAt")
+    VALUES (gen_random_uuid(), $1, {", ".join(f"${i + 2}" for i in range(len(_WRITE_COLUMNS)))}, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+    ON CONFLICT ("userId") DO UPDATE
+    SET {_UPSERT_ASSIGNMENTS}, "updatedAt" = CURRENT_TIMESTAMP
+    '''
+)
+
+def qr_code_lookup_keys(payload: str) -> Tuple[List[str], List[str]]:
+    """Candidate (qrCode values, user ids) for a scanned QR payload.
+
+    Current codes are the bare user id; older cards carry
+    vineyardacademy/<uuid>/<userId>, stored with hyphens in place of slashes.
+    """
+    payload = payload.strip()
+    qr_codes = [payload]
+    user_ids = [payload]
+    if "/" in payload:
+        qr_codes.append(payload.replace("/", "-"))
+        user_ids.append(payload.rstrip("/").rsplit("/", 1)[-1])
+    return qr_codes, user_ids
+
+class Database:
+    """Database access class for face recognition, backed by the shared connection pool"""
+
+    @timed("db_save_embedding")
+    def save_embedding(self, user_id: str, embedding: Any) -> bool:
+        """Save or update a face embedding for a user"""
         try:
-            self.conn = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
-            self.cursor = self.conn.cursor()
+            with get_connection() as conn:
+                with conn.cursor() as cursor:
+                    columns = embedding_columns_for_write(embedding)
+                    execute_prepared(cursor, "upsert_embedding", (user_id, *columns.values()))
+                conn.commit()
+                return True
+        except Exception as e:
+            print(f"Error saving embedding: {e}")
+            return False
+
+    @timed("db_save_embeddings")
+    def save_embeddings(self, embeddings: Sequence[Tuple[str, Any]]) -> bool:
+        """Save or update many (user_id, embedding) pairs with one batched upsert"""
+        if not embeddings:
             return True
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cursor:
+                    rows = [
+                        (user_id, *embedding_columns_for_write(embedding).values())
+                        for user_id, embedding in embeddings
+                    ]
+                    execute_values(
+                        cursor,
+                        f"""
+                        INSERT INTO "FaceEmbedding" (id, "userId", {_INSERT_COLUMNS}, "createdAt", "updatedAt")
+                        VALUES %s
+                        ON CONFLICT ("userId") DO UPDATE
+                        SET {_UPSERT_ASSIGNMENTS}, "updatedAt" = CURRENT_TIMESTAMP
+                        """,
+                        rows,
+                        template=f"(gen_random_uuid(), %s, {', '.join(['%s'] * len(_WRITE_COLUMNS))}, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)",
+                        page_size=500
+                    )
+                conn.commit()
+                return True
         except Exception as e:
-            print(f"Connection error: {e}")
+            print(f"Error saving embeddings: {e}")
             return False
 
-    def close(self):
-        """Close database connection"""
-        if self.cursor:
-            self.cursor.close()
-        if self.conn:
-            self.conn.close()
+    @timed("db_get_existing_user_ids")
+    def get_existing_user_ids(self, user_ids: Iterable[str]) -> Optional[Set[str]]:
+        """Return which of the given ids belong to existing users"""
+        user_ids = list(user_ids)
+        if not user_ids:
+            return set()
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute('SELECT id FROM "User" WHERE id = ANY(%s)', (user_ids,))
+                    return {row["id"] for row in cursor.fetchall()}
+        except Exception as e:
+            print(f"Error checking users: {e}")
+            return None
 
-    def save_embedding(self, user_id: str, embedding: List[float]) -> bool:
-        """Save or update a face embedding for a user"""
-        if self.connect():
-            try:
-                # Check if embedding already exists
-                self.cursor.execute(
-                    """
-                    SELECT "userId" FROM "FaceEmbedding" WHERE "userId" = %s
-                    """,
-                    (user_id,)
-                )
-                existing = self.cursor.fetchone()
-
-                embedding_json = json.dumps(embedding)
-
-                if existing:
-                    # Update existing embedding
-                    self.cursor.execute(
-                        """
-                        UPDATE "FaceEmbedding"
-                        SET embedding = %s, "updatedAt" = CURRENT_TIMESTAMP 
-                        WHERE "userId" = %s
+    @timed("db_get_all_embeddings")
+    def get_all_embeddings(self) -> Optional[List[Dict[str, Any]]]:
+        """Get all face embeddings; None on error, so an empty gallery is not mistaken for a failed load"""
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(f"""
+                        SELECT "userId", {EMBEDDING_COLUMNS} 
+                        FROM "FaceEmbedding"
+                    """)
+                    rows = cursor.fetchall()
+            return [
+                {"user_id": row["userId"], "embedding": decode_embedding(row)}
+                for row in rows
+            ]
+        except Exception as e:
+            print(f"Error getting embeddings: {e}")
+            return None
+
+    @timed("db_get_embedding_user_ids")
+    def get_embedding_user_ids(self) -> Optional[Set[str]]:
+        """Get the userId of every stored embedding, without the embeddings themselves"""
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute('SELECT "userId" FROM "FaceEmbedding"')
+                    return {row["userId"] for row in cursor.fetchall()}
+        except Exception as e:
+            print(f"Error getting embedding user ids: {e}")
+            return None
+
+    @timed("db_get_embeddings_for_users")
+    def get_embeddings_for_users(self, user_ids: Iterable[str]) -> Optional[Dict[str, Any]]:
+        """Get the current embeddings for a set of users, keyed by userId.
+
+        Users without a row are absent from the result. Returns None on error
+        so callers can tell "deleted" apart from "query failed".
+        """
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {}
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(
+                        f"""
+                        SELECT "userId", {EMBEDDING_COLUMNS} 
+                        FROM "FaceEmbedding" 
+                        WHERE "userId" = ANY(%s)
                         """,
-                        (embedding_json, user_id)
+                        (user_ids,)
                     )
-                else:
-                    # Create new embedding
-                    self.cursor.execute(
-                        """
-                        INSERT INTO "FaceEmbedding" (id, "userId", embedding, "createdAt", "updatedAt")
-                        VALUES (gen_random_uuid(), %s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+                    rows = cursor.fetchall()
+            return {row["userId"]: decode_embedding(row) for row in rows}
+        except Exception as e:
+            print(f"Error getting embeddings for users: {e}")
+            return None
+
+    @timed("db_get_embeddings_updated_since")
+    def get_embeddings_updated_since(self, since: datetime) -> Optional[List[Dict[str, Any]]]:
+        """Get embeddings whose updatedAt is newer than the given watermark"""
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(
+                        f"""
+                        SELECT "userId", {EMBEDDING_COLUMNS}, "updatedAt" 
+                        FROM "FaceEmbedding" 
+                        WHERE "updatedAt" > %s
                         """,
-                        (user_id, embedding_json)
+                        (since,)
                     )
-                self.conn.commit()
-                return True
-            except Exception as e:
-                print(f"Error saving embedding: {e}")
-                self.conn.rollback()
-                return False
-            finally:
-                self.close()
-        return False
-
-    def get_all_embeddings(self) -> List[Dict[str, Any]]:
-        """Get all face embeddings"""
-        if self.connect():
-            try:
-                self.cursor.execute("""
-                    SELECT "userId", embedding 
-                    FROM "FaceEmbedding"
-                """)
-                rows = self.cursor.fetchall()
-                return [
-                    {"user_id": row["userId"], "embedding": json.loads(row["embedding"])}
-                    for row in rows
-                ]
-            except Exception as e:
-                print(f"Error getting embeddings: {e}")
-                return []
-            finally:
-                self.close()
-        return []
+                    rows = cursor.fetchall()
+            return [
+                {
+                    "user_id": row["userId"],
+                    "embedding": decode_embedding(row),
+                    "updated_at": row["updatedAt"]
+                }
+                for row in rows
+            ]
+        except Exception as e:
+            print(f"Error getting updated embeddings: {e}")
+            return None
 
+    @timed("db_get_latest_update")
+    def get_latest_update(self) -> Optional[datetime]:
+        """Get the newest updatedAt in FaceEmbedding, used to seed the sync watermark"""
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute('SELECT MAX("updatedAt") AS latest FROM "FaceEmbedding"')
+                    result = cursor.fetchone()
+            return result["latest"] if result else None
+        except Exception as e:
+            print(f"Error getting latest embedding update: {e}")
+            return None
+
+    @timed("db_get_embedding_by_user_id")
     def get_embedding_by_user_id(self, user_id: str) -> Optional[Dict[str, Any]]:
         """Get a specific user's face embedding"""
-        if self.connect():
-            try:
-                self.cursor.execute(
-                    """
-                    SELECT embedding 
-                    FROM "FaceEmbedding" 
-                    WHERE "userId" = %s
-                    """,
-                    (user_id,)
-                )
-                result = self.cursor.fetchone()
-                if result:
-                    return {"user_id": user_id, "embedding": json.loads(result["embedding"])}
-                return None
-            except Exception as e:
-                print(f"Error retrieving embedding: {e}")
-                return None
-            finally:
-                self.close()
-        return None
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cursor:
+                    execute_prepared(cursor, "embedding_by_user_id", (user_id,))
+                    result = cursor.fetchone()
+            if result:
+                return {"user_id": user_id, "embedding": decode_embedding(result)}
+            return None
+        except Exception as e:
+            print(f"Error retrieving embedding: {e}")
+            return None
 
+    @timed("db_get_user_id_by_qr_code")
+    def get_user_id_by_qr_code(self, qr_code: str) -> Optional[str]:
+        """Resolve a scanned QR payload to the user it belongs to"""
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cursor:
+                    execute_prepared(cursor, "user_by_qr_code", qr_code_lookup_keys(qr_code))
+                    result = cursor.fetchone()
+            return result["id"] if result else None
+        except Exception as e:
+            print(f"Error resolving QR code: {e}")
+            return None
+
+    @timed("db_delete_embedding")
     def delete_embedding(self, user_id: str) -> bool:
         """Delete a user's face embedding"""
-        if self.connect():
-            try:
-                self.cursor.execute(
-                    """
-                    DELETE FROM "FaceEmbedding" 
-                    WHERE "userId" = %s
-                    """,
-                    (user_id,)
-                )
-                self.conn.commit()
-                return self.cursor.rowcount > 0
-            except Exception as e:
-                print(f"Error deleting embedding: {e}")
-                self.conn.rollback()
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(
+                        """
+                        DELETE FROM "FaceEmbedding" 
+                        WHERE "userId" = %s
+                        """,
+                        (user_id,)
+                    )
+                    deleted = cursor.rowcount > 0
+                conn.commit()
+                return deleted
+        except Exception as e:
+            print(f"Error deleting embedding: {e}")
+            return False
+
+
+class GallerySync:
+    """Keeps an in-process gallery index in step with FaceEmbedding.
+
+    The gallery is loaded in full once; after that only rows named by change
+    notifications are re-read, so staying fresh costs O(changes) per request
+    instead of O(gallery). Users whose re-read failed stay pending for the
+    next sync. In case a notification was lost, a periodic sweep re-reads rows
+    past the updatedAt watermark and compares the stored userIds with the
+    gallery's, which is the only way it can notice a delete.
+    """
+
+    def __init__(self, database: "Database", notifier=None, watermark_interval: float = SYNC_WATERMARK_INTERVAL):
+        self.database = database
+        self.notifier = notifier if notifier is not None else ChangeListener(EMBEDDING_CHANNEL)
+        self.watermark_interval = watermark_interval
+        self.watermark: Optional[datetime] = None
+        self._pending: Set[str] = set()
+        self._last_sweep = 0.0
+        self._lock = threading.Lock()
+
+    def close(self):
+        """Release the notification connection"""
+        self.notifier.close()
+
+    def reload(self, gallery) -> bool:
+        """Rebuild the gallery from every stored embedding.
+
+        Returns False if the query failed; the gallery and watermark are then
+        left as they were, so the next sync tries again.
+        """
+        watermark = self.database.get_latest_update()
+        embeddings = self.database.get_all_embeddings()
+        if embeddings is None:
+            return False
+        gallery.load(embeddings)
+        self.watermark = watermark
+        self._pending.clear()
+        self._last_sweep = time.monotonic()
+        return True
+
+    def catch_up(self, gallery, watermark: datetime) -> bool:
+        """Bring a gallery restored from a snapshot taken at watermark up to date.
+
+        Reads every userId but only the rows updated since the watermark, not
+        every embedding. Returns False if a query failed and the caller should
+        reload in full.
+        """
+        with self._lock:
+            # Start listening before reading, so later changes are not missed
+            self.notifier.poll()
+            user_ids = self.database.get_embedding_user_ids()
+            rows = self.database.get_embeddings_updated_since(watermark - SYNC_WATERMARK_OVERLAP)
+            if user_ids is None or rows is None:
                 return False
-            finally:
-                self.close()
-        return False
+
+            for user_id in set(gallery.user_ids()) - user_ids:
+                gallery.remove(user_id)
+            self.watermark = watermark
+            for row in rows:
+                gallery.upsert(row["user_id"], row["embedding"])
+                if row["updated_at"] > self.watermark:
+                    self.watermark = row["updated_at"]
+            self._last_sweep = time.monotonic()
+            return True
+
+    def sync(self, gallery):
+        """Bring the gallery up to date with changes made by other workers"""
+        with self._lock:
+            changed = self.notifier.poll()
+            if not gallery.loaded or changed is None:
+                self.reload(gallery)
+                return
+
+            if changed:
+                self._pending |= changed
+            if self._pending:
+                self._apply_changes(gallery)
+
+            if time.monotonic() - self._last_sweep >= self.watermark_interval:
+                self._sweep(gallery)
+
+    def _apply_changes(self, gallery):
+        """Re-read the pending users and upsert or drop them; on error they stay pending"""
+        user_ids = self._pending
+        rows = self.database.get_embeddings_for_users(user_ids)
+        if rows is None:
+            return
+        self._pending = set()
+        for user_id in user_ids:
+            if user_id in rows:
+                gallery.upsert(user_id, rows[user_id])
+            else:
+                gallery.remove(user_id)
+
+    def _sweep(self, gallery):
+        """Pick up changes whose notification was lost: updated rows, and users added or deleted"""
+        self._last_sweep = time.monotonic()
+        if self.watermark is None:
+            self.watermark = self.database.get_latest_update()
+        else:
+            rows = self.database.get_embeddings_updated_since(self.watermark - SYNC_WATERMARK_OVERLAP)
+            if rows is not None:
+                for row in rows:
+                    gallery.upsert(row["user_id"], row["embedding"])
+                    if row["updated_at"] > self.watermark:
+                        self.watermark = row["updated_at"]
+
+        # A deleted row leaves no updatedAt behind, so compare the userIds themselves.
+        # Listing the gallery first means a face registered meanwhile (saved, then
+        # indexed) is either in both sets or only in the database, never removed.
+        indexed = set(gallery.user_ids())
+        user_ids = self.database.get_embedding_user_ids()
+        if user_ids is None:
+            return
+        for user_id in indexed - user_ids:
+            gallery.remove(user_id)
+        # Rows missed by the watermark (e.g. committed with an older updatedAt) are re-read by id
+        self._pending |= user_ids - indexed
+        if self._pending:
+            self._apply_changes(gallery)
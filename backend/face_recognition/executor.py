@@ -0,0 +1,260 @@
+import os
+import time
+import heapq
+import asyncio
+import itertools
+import contextvars
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+import metrics
+from .admission import DeadlineExceeded, add_work, deadline, expired
+from .batching import FACE_BATCH_MAX_SIZE
+
+# "thread" runs inference on a thread pool inside the worker (ONNX Runtime
+# releases the GIL); "process" runs decode + embedding in separate processes
+# that each load their own model.
+FACE_EXECUTOR_MODE = os.getenv("FACE_EXECUTOR_MODE", "thread")
+
+def default_worker_count() -> int:
+    """Size the pool so workers x ONNX Runtime intra-op threads fits the cores"""
+    configured = int(os.getenv("FACE_EXECUTOR_WORKERS", "0"))
+    if configured > 0:
+        return configured
+    cores = os.cpu_count() or 1
+    ort_threads = int(os.getenv("FACE_ORT_INTRA_OP_THREADS", "0")) or cores
+    return max(1, cores // ort_threads)
+
+def default_inference_slots(workers: int) -> int:
+    """Embeds let into the thread pool at once.
+
+    Threads embedding in-process mostly wait on the shared EmbeddingBatcher,
+    so there must be enough of them in flight to fill a batch, whatever the
+    ONNX Runtime thread split.
+    """
+    configured = int(os.getenv("FACE_INFERENCE_SLOTS", "0"))
+    if configured > 0:
+        return configured
+    return max(workers, FACE_BATCH_MAX_SIZE)
+
+# Threads for database access and gallery matching, kept apart from inference
+# so they never hold a slot an embed could use to join a batch
+FACE_IO_WORKERS = int(os.getenv("FACE_IO_WORKERS", "4"))
+
+# Per-process service used by the process pool
+_worker_service = None
+
+def _init_worker():
+    """Load and warm up the model once in each pool process"""
+    global _worker_service
+    from .service import FaceRecognitionService, batcher, warmup_model
+    # A pool process embeds one request at a time, so waiting for a batch only adds latency
+    batcher.max_batch_size = 1
+    _worker_service = FaceRecognitionService()
+    warmup_model()
+
+def _ping_worker() -> int:
+    return os.getpid()
+
+def _embed(service, image: Union[str, bytes]) -> Dict[str, Any]:
+    """Embed a base64 string or raw encoded image bytes"""
+    if isinstance(image, (bytes, bytearray)):
+        return service.embed_image_bytes(image)
+    return service.embed_image(image)
+
+def _with_spans(fn: Callable[..., Dict[str, Any]], *args: Any) -> Dict[str, Any]:
+    """Run fn in a pool process and return its stage timings and run time with the result"""
+    spans = metrics.begin_spans()
+    start = time.perf_counter()
+    result = fn(*args)
+    result["spans"] = spans
+    result["elapsed"] = time.perf_counter() - start
+    return result
+
+def _embed_in_worker(image: Union[str, bytes]) -> Dict[str, Any]:
+    """Decode and embed an image inside a pool process"""
+    return _with_spans(_embed, _worker_service, image)
+
+def _embed_faces(service, image: Union[str, bytes]) -> Dict[str, Any]:
+    """Embed every face in a base64 string or raw encoded image bytes"""
+    if isinstance(image, (bytes, bytearray)):
+        return service.embed_image_faces_bytes(image)
+    return service.embed_image_faces(image)
+
+def _embed_faces_in_worker(image: Union[str, bytes]) -> Dict[str, Any]:
+    """Decode and embed every face of an image inside a pool process"""
+    return _with_spans(_embed_faces, _worker_service, image)
+
+def _embed_for_verification_in_worker(image: Union[str, bytes], qr_code: Optional[str]) -> Dict[str, Any]:
+    """Decode a frame, read its QR code and embed its face inside a pool process"""
+    return _with_spans(_worker_service.embed_for_verification, image, qr_code)
+
+def _track_frame_in_worker(frame: Union[str, bytes], tracker, now: float) -> Dict[str, Any]:
+    """Detect and embed a stream frame inside a pool process"""
+    return _with_spans(_worker_service.track_frame, frame, tracker, now)
+
+class DeadlineQueue:
+    """Hands a fixed number of pool slots to waiting jobs, earliest deadline first.
+
+    Jobs wait here instead of in the pool's FIFO queue, so the second step
+    of a request that is nearly due runs before the first step of one that
+    just arrived, and a cancelled job leaves without ever reaching the pool.
+    """
+
+    def __init__(self, slots: int):
+        self.slots = slots
+        self.running = 0
+        self._waiting: List[Tuple[float, int, asyncio.Future]] = []
+        self._order = itertools.count()
+
+    async def acquire(self, due: float):
+        # Waiters only exist while every slot is taken; release() hands slots over directly
+        if self.running < self.slots:
+            self.running += 1
+            return
+        turn = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (due, next(self._order), turn))
+        try:
+            await turn
+        except asyncio.CancelledError:
+            if turn.done() and not turn.cancelled():
+                # Cancelled just after being handed a slot: pass it on
+                self.release()
+            raise
+
+    def release(self):
+        while self._waiting:
+            _, _, turn = heapq.heappop(self._waiting)
+            if not turn.done():
+                turn.set_result(None)
+                return
+        self.running -= 1
+
+class InferenceExecutor:
+    """Bounded executors that keep blocking face work off the event loop.
+
+    Embeds run on the inference pool: threads (up to inference_slots at once,
+    enough to fill a recognition batch) or processes (one per worker).
+    Database access and gallery matching run on a separate small thread pool.
+    """
+
+    def __init__(
+        self,
+        mode: str = FACE_EXECUTOR_MODE,
+        workers: Optional[int] = None,
+        inference_slots: Optional[int] = None,
+        io_workers: int = FACE_IO_WORKERS
+    ):
+        self.mode = mode
+        self.workers = workers or default_worker_count()
+        self.inference_slots = inference_slots or default_inference_slots(self.workers)
+        self._thread_slots = DeadlineQueue(self.inference_slots)
+        self._process_slots = DeadlineQueue(self.workers)
+        self._io_slots = DeadlineQueue(io_workers)
+        self._threads = ThreadPoolExecutor(
+            max_workers=self.inference_slots,
+            thread_name_prefix="face-inference"
+        )
+        self._io = ThreadPoolExecutor(
+            max_workers=io_workers,
+            thread_name_prefix="face-io"
+        )
+        self._processes = None
+        if mode == "process":
+            self._processes = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker
+            )
+
+    def _timed(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Run fn on a pool thread unless its request's deadline passed while it was queued"""
+        if expired():
+            raise DeadlineExceeded()
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            add_work(time.perf_counter() - start)
+
+    async def _submit(self, pool, slots: DeadlineQueue, fn: Callable[..., Any], *args: Any) -> Any:
+        """Wait for a slot in deadline order, then run fn on the pool.
+
+        The slot is held until the pool finishes the job, even if the caller
+        is cancelled meanwhile (deadline or client disconnect), so the pool
+        never queues work behind a job nobody is waiting for.
+        """
+        loop = asyncio.get_running_loop()
+        await slots.acquire(deadline())
+        try:
+            job = pool.submit(fn, *args)
+        except BaseException:
+            slots.release()
+            raise
+        job.add_done_callback(lambda _: loop.call_soon_threadsafe(slots.release))
+        return await asyncio.wrap_future(job)
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Run blocking database or matching work on the I/O pool, in a copy of the caller's context"""
+        context = contextvars.copy_context()
+        return await self._submit(self._io, self._io_slots, context.run, self._timed, fn, *args)
+
+    async def _run_inference(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Run a blocking embed on the inference thread pool, in a copy of the caller's context"""
+        context = contextvars.copy_context()
+        return await self._submit(self._threads, self._thread_slots, context.run, self._timed, fn, *args)
+
+    async def _run_in_process(self, fn: Callable[..., Dict[str, Any]], *args: Any) -> Dict[str, Any]:
+        """Run a worker function on the process pool and record the stage timings it returns"""
+        if expired():
+            raise DeadlineExceeded()
+        result = await self._submit(self._processes, self._process_slots, fn, *args)
+        add_work(result.pop("elapsed"))
+        for stage, seconds in result.pop("spans", []):
+            metrics.record(stage, seconds)
+        return result
+
+    async def embed(self, service, image: Union[str, bytes]) -> Dict[str, Any]:
+        """Decode and embed a base64 or raw image on the configured pool"""
+        if self._processes is not None:
+            return await self._run_in_process(_embed_in_worker, image)
+        return await self._run_inference(_embed, service, image)
+
+    async def embed_faces(self, service, image: Union[str, bytes]) -> Dict[str, Any]:
+        """Decode and embed every face of a base64 or raw image on the configured pool"""
+        if self._processes is not None:
+            return await self._run_in_process(_embed_faces_in_worker, image)
+        return await self._run_inference(_embed_faces, service, image)
+
+    async def embed_for_verification(self, service, image: Union[str, bytes], qr_code: Optional[str] = None) -> Dict[str, Any]:
+        """Decode a frame, read its QR code unless given, and embed its face on the configured pool"""
+        if self._processes is not None:
+            return await self._run_in_process(_embed_for_verification_in_worker, image, qr_code)
+        return await self._run_inference(service.embed_for_verification, image, qr_code)
+
+    async def track_frame(self, service, frame: Union[str, bytes], tracker, now: float) -> Dict[str, Any]:
+        """Detect faces in a stream frame and embed new or stale tracks on the configured pool.
+
+        In process mode the tracker is pickled to the worker and the updated
+        copy comes back in the result.
+        """
+        if self._processes is not None:
+            return await self._run_in_process(_track_frame_in_worker, frame, tracker, now)
+        return await self._run_inference(service.track_frame, frame, tracker, now)
+
+    async def start(self):
+        """Spawn the pool processes (which load their models) before serving traffic"""
+        if self._processes is None:
+            return
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[
+            loop.run_in_executor(self._processes, _ping_worker)
+            for _ in range(self.workers)
+        ])
+
+    def shutdown(self):
+        """Stop accepting work and wait for running jobs to finish"""
+        self._threads.shutdown(wait=True)
+        self._io.shutdown(wait=True)
+        if self._processes is not None:
+            self._processes.shutdown(wait=True)
@@ -0,0 +1,246 @@
+import threading
+import numpy as np
+from typing import Iterable, List, Dict, Tuple, Optional, Any, Sequence
+
+from .ann import create_search_backend
+from .storage import EmbeddingStore, FACE_GALLERY_PRECISION, FACE_GALLERY_RERANK
+
+
+class GalleryIndex:
+    """In-memory index of enrolled face embeddings.
+
+    Embeddings are kept L2-normalized in one contiguous matrix with a
+    parallel array of user ids, so matching a probe against the whole gallery
+    is a single matrix-vector product. An optional ANN backend (see ann.py)
+    narrows large galleries to candidate rows, which are then scored exactly.
+
+    With a float16 or int8 precision (see storage.py) the scan runs over
+    compact codes and the best rerank candidates per probe are re-scored at
+    full precision, so returned similarities are exact float32 cosines.
+
+    attach() serves an external matrix such as a shared snapshot (see
+    shared.py) without copying it; the gallery is then read-only until the
+    next load(). version increases with every change, so writers can tell
+    when the contents need publishing.
+    """
+
+    def __init__(
+        self,
+        dim: int = 512,
+        initial_capacity: int = 1024,
+        backend: Any = None,
+        precision: str = FACE_GALLERY_PRECISION,
+        rerank: int = FACE_GALLERY_RERANK
+    ):
+        self.dim = dim
+        self.backend = backend if backend is not None else create_search_backend(dim)
+        self.store = EmbeddingStore(dim, initial_capacity, precision)
+        self.rerank = rerank
+        self.initial_capacity = initial_capacity
+        self._user_ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._lock = threading.RLock()
+        self.loaded = False
+        self.read_only = False
+        self.version = 0
+
+    def __len__(self) -> int:
+        return len(self._user_ids)
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._rows
+
+    @staticmethod
+    def _normalize(embedding: Any) -> Optional[np.ndarray]:
+        """Flatten and L2-normalize an embedding, or None if it has zero norm"""
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return None
+        return vector / norm
+
+    def accepts(self, embedding: Any) -> bool:
+        """True if embedding can be indexed: dim values with a non-zero norm"""
+        vector = self._normalize(embedding)
+        return vector is not None and vector.shape[0] == self.dim
+
+    def load(self, embeddings: Iterable[Dict[str, Any]]):
+        """Replace the index contents with rows from Database.get_all_embeddings()"""
+        with self._lock:
+            self._user_ids = []
+            self._rows = {}
+            if self.read_only:
+                self.store.clear(self.initial_capacity)
+                self.read_only = False
+            self.backend.reset()
+            for stored_embedding in embeddings:
+                self._upsert(stored_embedding["user_id"], stored_embedding["embedding"])
+            self.backend.rebuild(self.store.dense(len(self._user_ids)))
+            self.loaded = True
+            self.version += 1
+
+    def attach(self, user_ids: Sequence[str], matrix: np.ndarray):
+        """Serve an external read-only matrix of normalized rows, one per user id, without copying it"""
+        with self._lock:
+            self._user_ids = list(user_ids)
+            self._rows = {user_id: row for row, user_id in enumerate(self._user_ids)}
+            self.store.attach(matrix)
+            # Keep trained IVF centroids; the snapshot only changed by a few rows
+            self.backend.rebuild(self.store.dense(len(self._user_ids)), retrain=False)
+            self.read_only = True
+            self.loaded = True
+            self.version += 1
+
+    def export(self) -> Tuple[List[str], np.ndarray, int]:
+        """Copy out (user ids, normalized float32 rows, version) for publishing"""
+        with self._lock:
+            size = len(self._user_ids)
+            return list(self._user_ids), np.array(self.store.dense(size), dtype=np.float32), self.version
+
+    def upsert(self, user_id: str, embedding: Any) -> bool:
+        """Insert or replace a user's embedding in place; False if invalid or read-only"""
+        with self._lock:
+            if self.read_only:
+                return False
+            return self._upsert(user_id, embedding)
+
+    def _upsert(self, user_id: str, embedding: Any) -> bool:
+        vector = self._normalize(embedding)
+        if vector is None or vector.shape[0] != self.dim:
+            print(f"Ignoring embedding for user {user_id}: expected {self.dim} values with a non-zero norm, got {np.size(embedding)}")
+            return False
+
+        row = self._rows.get(user_id)
+        if row is None:
+            row = len(self._user_ids)
+            self.store.reserve(row + 1, row)
+            self._user_ids.append(user_id)
+            self._rows[user_id] = row
+            self.store.set(row, vector)
+            self.backend.add(row, vector)
+        else:
+            self.store.set(row, vector)
+            self.backend.update(row, vector)
+        self.version += 1
+        return True
+
+    def remove(self, user_id: str) -> bool:
+        """Remove a user's embedding by moving the last row into its slot; a no-op while read-only"""
+        with self._lock:
+            if self.read_only:
+                return False
+            row = self._rows.pop(user_id, None)
+            if row is None:
+                return False
+
+            last = len(self._user_ids) - 1
+            self.backend.remove(row)
+            if row != last:
+                self.backend.move(last, row)
+                moved_user_id = self._user_ids[last]
+                self.store.copy(last, row)
+                self._user_ids[row] = moved_user_id
+                self._rows[moved_user_id] = row
+            self._user_ids.pop()
+            self.version += 1
+            return True
+
+    def user_ids(self) -> List[str]:
+        """Copy of the enrolled user ids, in row order"""
+        with self._lock:
+            return list(self._user_ids)
+
+    def get(self, user_id: str) -> Optional[np.ndarray]:
+        """Return a copy of a user's normalized embedding"""
+        with self._lock:
+            row = self._rows.get(user_id)
+            if row is None:
+                return None
+            return self.store.get(row)
+
+    def search(
+        self,
+        embedding: Any,
+        top_k: int = 1,
+        exclude_user_id: Optional[str] = None,
+        exact: bool = False
+    ) -> List[Tuple[str, float]]:
+        """Return the top_k (user_id, cosine similarity) pairs, best first"""
+        return self.search_many([embedding], top_k, [exclude_user_id], exact)[0]
+
+    def search_many(
+        self,
+        embeddings: Sequence[Any],
+        top_k: int = 1,
+        exclude_user_ids: Optional[Sequence[Optional[str]]] = None,
+        exact: bool = False
+    ) -> List[List[Tuple[str, float]]]:
+        """Match several probes with one matrix product; one result list per probe.
+
+        exclude_user_ids[i], if given, is ignored when matching probe i (used
+        so a user re-registering does not collide with their own old face).
+        exact=True skips the ANN backend and scans every row.
+        """
+        queries = [self._normalize(embedding) for embedding in embeddings]
+        results: List[List[Tuple[str, float]]] = [[] for _ in queries]
+        valid = [i for i, query in enumerate(queries) if query is not None and query.shape[0] == self.dim]
+
+        with self._lock:
+            size = len(self._user_ids)
+            if size == 0 or not valid:
+                return results
+
+            if self.backend.needs_training(size):
+                self.backend.rebuild(self.store.dense(size))
+            if not exact and self.backend.ready:
+                for i in valid:
+                    excluded = exclude_user_ids[i] if exclude_user_ids is not None else None
+                    results[i] = self._search_rows(queries[i], self.backend.candidates(queries[i]), top_k, excluded)
+                return results
+
+            scores = self.store.scan(np.stack([queries[i] for i in valid]), size)
+            if exclude_user_ids is not None:
+                for row, i in enumerate(valid):
+                    excluded = self._rows.get(exclude_user_ids[i]) if exclude_user_ids[i] else None
+                    if excluded is not None:
+                        scores[row, excluded] = -np.inf
+
+            rows = np.arange(size)
+            for row, i in enumerate(valid):
+                results[i] = self._select(queries[i], rows, scores[row], top_k)
+            return results
+
+    def _search_rows(
+        self,
+        query: np.ndarray,
+        rows: np.ndarray,
+        top_k: int,
+        exclude_user_id: Optional[str]
+    ) -> List[Tuple[str, float]]:
+        """Score one probe against a subset of rows proposed by the ANN backend"""
+        if exclude_user_id is not None and exclude_user_id in self._rows:
+            rows = rows[rows != self._rows[exclude_user_id]]
+        if len(rows) == 0:
+            return []
+        return self._select(query, rows, self.store.score_rows(query, rows), top_k)
+
+    def _select(
+        self,
+        query: np.ndarray,
+        rows: np.ndarray,
+        scores: np.ndarray,
+        top_k: int
+    ) -> List[Tuple[str, float]]:
+        """Take the top_k rows by score, re-scoring approximate scores at full precision first"""
+        keep = max(top_k, self.rerank) if self.store.approximate else top_k
+        keep = min(keep, len(rows))
+        if keep == 1:
+            best = np.argmax(scores)[None]
+        else:
+            best = np.argpartition(-scores, keep - 1)[:keep]
+        best = best[np.isfinite(scores[best])]
+        candidates, scores = rows[best], scores[best]
+        if self.store.approximate and len(candidates):
+            scores = self.store.exact_rows(candidates) @ query
+        order = np.argsort(-scores, kind="stable")[:top_k]
+        return [(self._user_ids[candidates[column]], float(scores[column])) for column in order]
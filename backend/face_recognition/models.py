@@ -19,6 +19,36 @@ class FaceRecognitionResponse(BaseModel):
     user_id: Optional[str] = None
     confidence: Optional[float] = None
     message: Optional[str] = None
+    reason: Optional[str] = None  # quality gate rejection, e.g. "blurry"
+
+class FaceVerificationRequest(BaseModel):
+    """Model for QR-scoped face verification request"""
+    image: str  # Base64 encoded image
+    qr_code: Optional[str] = None  # QR payload; read from the image when omitted
+
+class FaceVerificationResponse(BaseModel):
+    """Model for QR-scoped face verification response"""
+    success: bool
+    user_id: Optional[str] = None  # set only when the face matches the QR code's user
+    confidence: Optional[float] = None
+    message: Optional[str] = None
+    reason: Optional[str] = None  # quality gate rejection, e.g. "blurry"
+
+class GroupFaceResult(BaseModel):
+    """One detected face in a group recognition response"""
+    bbox: List[float]  # x1, y1, x2, y2 in image pixels
+    det_score: float
+    success: bool
+    user_id: Optional[str] = None
+    confidence: Optional[float] = None
+    reason: Optional[str] = None  # quality gate rejection; the face was not embedded
+
+class GroupRecognitionResponse(BaseModel):
+    """Model for group photo recognition response"""
+    success: bool
+    recognized: int
+    faces: List[GroupFaceResult]
+    message: Optional[str] = None
 
 class FaceRegistrationRequest(BaseModel):
     """Model for face registration request"""
@@ -28,4 +58,27 @@ class FaceRegistrationRequest(BaseModel):
 class FaceRegistrationResponse(BaseModel):
     """Model for face registration response"""
     success: bool
-    message: str 
\ No newline at end of file
+    message: str
+
+class BulkFaceRegistrationItem(BaseModel):
+    """One user's image in a bulk registration request"""
+    user_id: str
+    image: str  # Base64 encoded image
+
+class BulkFaceRegistrationRequest(BaseModel):
+    """Model for bulk face registration request"""
+    items: List[BulkFaceRegistrationItem]
+
+class BulkFaceRegistrationResult(BaseModel):
+    """Outcome for one item of a bulk registration"""
+    user_id: str
+    success: bool
+    message: str
+    reason: Optional[str] = None  # quality gate rejection, e.g. "face_too_small"
+
+class BulkFaceRegistrationResponse(BaseModel):
+    """Model for bulk face registration response"""
+    success: bool
+    registered: int
+    failed: int
+    results: List[BulkFaceRegistrationResult]
@@ -0,0 +1,97 @@
+import os
+import cv2
+import numpy as np
+from typing import Any, Dict, Optional, Tuple
+
+# Reject faces that would only fail matching before the recognition model
+# runs on them; set FACE_QUALITY_GATE=0 to embed every detected face
+FACE_QUALITY_GATE = os.getenv("FACE_QUALITY_GATE", "1") != "0"
+
+# Detector confidence and the shorter bounding box side in pixels
+FACE_QUALITY_MIN_DET_SCORE = float(os.getenv("FACE_QUALITY_MIN_DET_SCORE", "0.6"))
+FACE_QUALITY_MIN_FACE_SIZE = float(os.getenv("FACE_QUALITY_MIN_FACE_SIZE", "40"))
+
+# Fraction of the bounding box allowed to fall outside the frame
+FACE_QUALITY_MAX_OUTSIDE = float(os.getenv("FACE_QUALITY_MAX_OUTSIDE", "0.1"))
+
+# Variance of the Laplacian of the aligned 112x112 grayscale crop. A sharp
+# frontal crop scores in the hundreds; a 7x7 Gaussian blur brings it below 20.
+FACE_QUALITY_MIN_SHARPNESS = float(os.getenv("FACE_QUALITY_MIN_SHARPNESS", "20"))
+
+# Pose limits from the five landmarks: yaw is the nose's sideways offset from
+# the eye midpoint and pitch its vertical offset from halfway between eyes and
+# mouth, both as fractions of that span; roll is the eye line angle in degrees
+FACE_QUALITY_MAX_YAW = float(os.getenv("FACE_QUALITY_MAX_YAW", "0.35"))
+FACE_QUALITY_MAX_PITCH = float(os.getenv("FACE_QUALITY_MAX_PITCH", "0.25"))
+FACE_QUALITY_MAX_ROLL = float(os.getenv("FACE_QUALITY_MAX_ROLL", "30"))
+
+# Machine-readable rejection reasons and the message shown for each
+QUALITY_MESSAGES = {
+    "low_confidence": "Face detection is not confident; face the camera in good light",
+    "face_too_small": "Face is too small; move closer to the camera",
+    "face_cut_off": "Face is partly outside the frame; center your face",
+    "extreme_pose": "Face is turned away; look straight at the camera",
+    "blurry": "Image is too blurry; hold still",
+}
+
+def estimate_pose(kps: np.ndarray) -> Tuple[float, float, float]:
+    """Return (yaw, pitch, roll) from the detector's 5 landmarks; all near 0 for a frontal face"""
+    left_eye, right_eye, nose, left_mouth, right_mouth = np.asarray(kps, dtype=np.float64)[:5]
+    axis = right_eye - left_eye
+    eye_distance = np.linalg.norm(axis)
+    if eye_distance == 0:
+        return float("inf"), float("inf"), 0.0
+    unit = axis / eye_distance
+    normal = np.array([-unit[1], unit[0]])
+
+    eye_mid = (left_eye + right_eye) / 2
+    mouth_mid = (left_mouth + right_mouth) / 2
+    face_height = np.dot(mouth_mid - eye_mid, normal)
+    if face_height <= 0:
+        return float("inf"), float("inf"), 0.0
+
+    yaw = np.dot(nose - eye_mid, unit) / eye_distance
+    pitch = np.dot(nose - eye_mid, normal) / face_height - 0.5
+    roll = np.degrees(np.arctan2(axis[1], axis[0]))
+    return float(yaw), float(pitch), float(roll)
+
+def sharpness(crop: np.ndarray) -> float:
+    """Variance of the Laplacian of an aligned face crop; lower is blurrier"""
+    gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY) if crop.ndim == 3 else crop
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+def check_detection(face: Any, image_shape: Tuple[int, ...]) -> Optional[str]:
+    """Checks that need only the detector output; returns a rejection reason or None"""
+    if not FACE_QUALITY_GATE:
+        return None
+    if float(face.det_score) < FACE_QUALITY_MIN_DET_SCORE:
+        return "low_confidence"
+
+    x1, y1, x2, y2 = (float(v) for v in face.bbox[:4])
+    width, height = x2 - x1, y2 - y1
+    if min(width, height) < FACE_QUALITY_MIN_FACE_SIZE:
+        return "face_too_small"
+
+    frame_height, frame_width = image_shape[:2]
+    visible_width = min(x2, frame_width) - max(x1, 0)
+    visible_height = min(y2, frame_height) - max(y1, 0)
+    if visible_width * visible_height < (1 - FACE_QUALITY_MAX_OUTSIDE) * width * height:
+        return "face_cut_off"
+
+    if face.kps is not None:
+        yaw, pitch, roll = estimate_pose(face.kps)
+        if abs(yaw) > FACE_QUALITY_MAX_YAW or abs(pitch) > FACE_QUALITY_MAX_PITCH or abs(roll) > FACE_QUALITY_MAX_ROLL:
+            return "extreme_pose"
+    return None
+
+def check_crop(crop: np.ndarray) -> Optional[str]:
+    """Checks on the aligned crop, run just before embedding; returns a rejection reason or None"""
+    if not FACE_QUALITY_GATE:
+        return None
+    if sharpness(crop) < FACE_QUALITY_MIN_SHARPNESS:
+        return "blurry"
+    return None
+
+def rejection(reason: str) -> Dict[str, Any]:
+    """Failure result for a face that did not pass the quality gate"""
+    return {"success": False, "reason": reason, "message": QUALITY_MESSAGES[reason]}
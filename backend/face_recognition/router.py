@@ -1,12 +1,25 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+import io
+import os
+import time
+import asyncio
+import zipfile
+from fastapi import APIRouter, Depends, HTTPException, Request, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import JSONResponse
 from .models import (
     FaceRecognitionRequest, 
     FaceRecognitionResponse, 
+    FaceVerificationRequest,
+    FaceVerificationResponse,
+    GroupRecognitionResponse,
     FaceRegistrationRequest, 
-    FaceRegistrationResponse
+    FaceRegistrationResponse,
+    BulkFaceRegistrationRequest,
+    BulkFaceRegistrationResponse
 )
 from .service import FaceRecognitionService
-from typing import Dict, Any
+from .executor import InferenceExecutor
+from .tracking import FaceTracker
+from typing import Dict, Any, Optional, Tuple, List, Union
 
 # Create API router
 router = APIRouter()
@@ -14,6 +27,35 @@ router = APIRouter()
 # Initialize face recognition service
 face_service = FaceRecognitionService()
 
+# Blocking inference and database work runs here instead of on the event loop
+inference_executor = InferenceExecutor()
+
+# Upper bound on images accepted by one bulk registration request
+FACE_BULK_MAX_ITEMS = int(os.getenv("FACE_BULK_MAX_ITEMS", "500"))
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+def _registration_error(result: Dict[str, Any]) -> JSONResponse:
+    """400 with the message as detail, plus the quality gate reason (if any) for clients to branch on"""
+    return JSONResponse(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        content={"detail": result["message"], "reason": result.get("reason")}
+    )
+
+async def _read_image_upload(request: Request) -> Tuple[bytes, Dict[str, Any]]:
+    """Read image bytes from a multipart upload ("file" field) or a raw request body"""
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("file") or form.get("image")
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Multipart upload must include a 'file' field"
+            )
+        return await upload.read(), dict(form)
+    return await request.body(), {}
+
 @router.post("/register", response_model=FaceRegistrationResponse)
 async def register_face(request: FaceRegistrationRequest) -> Dict[str, Any]:
     """
@@ -21,16 +63,115 @@ async def register_face(request: FaceRegistrationRequest) -> Dict[str, Any]:
     - One user can only have one face registered
     - Image should be a base64 encoded string
     """
-    result = face_service.register_face(request.user_id, request.image)
+    result = await inference_executor.embed(face_service, request.image)
+    if result["success"]:
+        result = await inference_executor.run(
+            face_service.register_embedding, request.user_id, result["embedding"]
+        )
     
     if not result["success"]:
+        return _registration_error(result)
+    
+    return result
+
+@router.post("/register/upload", response_model=FaceRegistrationResponse)
+async def register_face_upload(request: Request, user_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Register a face from raw image bytes.
+    - Send JPEG/PNG bytes as the body with ?user_id=..., or
+    - a multipart form with 'file' and 'user_id' fields
+    """
+    image, form = await _read_image_upload(request)
+    user_id = form.get("user_id") or user_id
+    if not user_id:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail=result["message"]
+            detail="user_id is required"
         )
     
+    result = await inference_executor.embed(face_service, image)
+    if result["success"]:
+        result = await inference_executor.run(
+            face_service.register_embedding, user_id, result["embedding"]
+        )
+    
+    if not result["success"]:
+        return _registration_error(result)
+    
     return result
 
+async def _register_bulk(items: List[Tuple[str, Union[str, bytes]]]) -> Dict[str, Any]:
+    """Embed all images in parallel, then register the batch in one pass"""
+    if len(items) > FACE_BULK_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {FACE_BULK_MAX_ITEMS} images per request"
+        )
+    
+    extracted = await asyncio.gather(*[
+        inference_executor.embed(face_service, image) for _, image in items
+    ])
+    results = [
+        {"user_id": user_id, "success": False, "message": result.get("message", ""), "reason": result.get("reason")}
+        for (user_id, _), result in zip(items, extracted)
+    ]
+    
+    embedded = [i for i, result in enumerate(extracted) if result["success"]]
+    registered = await inference_executor.run(
+        face_service.register_embeddings,
+        [items[i][0] for i in embedded],
+        [extracted[i]["embedding"] for i in embedded]
+    )
+    for i, result in zip(embedded, registered):
+        results[i] = {"user_id": items[i][0], **result}
+    
+    registered_count = sum(1 for result in results if result["success"])
+    return {
+        "success": registered_count == len(results),
+        "registered": registered_count,
+        "failed": len(results) - registered_count,
+        "results": results
+    }
+
+@router.post("/register/bulk", response_model=BulkFaceRegistrationResponse)
+async def register_faces_bulk(request: BulkFaceRegistrationRequest) -> Dict[str, Any]:
+    """
+    Register faces for many users at once.
+    - Body is a list of {user_id, image} with base64 encoded images
+    - Returns a per-item result report
+    """
+    return await _register_bulk([(item.user_id, item.image) for item in request.items])
+
+@router.post("/register/bulk/upload", response_model=BulkFaceRegistrationResponse)
+async def register_faces_bulk_upload(request: Request) -> Dict[str, Any]:
+    """
+    Register faces from a zip archive.
+    - Upload the archive as the raw body or a multipart 'file' field
+    - Each image is named after its user: <user_id>.jpg
+    """
+    archive, _ = await _read_image_upload(request)
+    try:
+        with zipfile.ZipFile(io.BytesIO(archive)) as bundle:
+            items = []
+            for entry in bundle.infolist():
+                name = os.path.basename(entry.filename)
+                user_id, extension = os.path.splitext(name)
+                if entry.is_dir() or name.startswith(".") or extension.lower() not in IMAGE_EXTENSIONS:
+                    continue
+                if len(items) >= FACE_BULK_MAX_ITEMS:
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        detail=f"At most {FACE_BULK_MAX_ITEMS} images per request"
+                    )
+                items.append((user_id, bundle.read(entry)))
+    except zipfile.BadZipFile:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Upload must be a zip archive of <user_id>.jpg images"
+        )
+    
+    return await _register_bulk(items)
+
 @router.post("/recognize", response_model=FaceRecognitionResponse)
 async def recognize_face(request: FaceRecognitionRequest) -> Dict[str, Any]:
     """
@@ -38,18 +179,124 @@ async def recognize_face(request: FaceRecognitionRequest) -> Dict[str, Any]:
     - Returns user_id if a match is found
     - Image should be a base64 encoded string
     """
-    result = face_service.recognize_face(request.image)
+    result = await inference_executor.embed(face_service, request.image)
+    if result["success"]:
+        result = await inference_executor.run(face_service.recognize_embedding, result["embedding"])
     
     # Still return the result even if recognition fails
     # Just with success=False and no user_id
     return result
 
+@router.post("/recognize/upload", response_model=FaceRecognitionResponse)
+async def recognize_face_upload(request: Request) -> Dict[str, Any]:
+    """
+    Recognize a face from raw image bytes.
+    - Send JPEG/PNG bytes as the body, or a multipart form with a 'file' field
+    """
+    image, _ = await _read_image_upload(request)
+    result = await inference_executor.embed(face_service, image)
+    if result["success"]:
+        result = await inference_executor.run(face_service.recognize_embedding, result["embedding"])
+    
+    return result
+
+async def _verify(image: Union[str, bytes], qr_code: Optional[str]) -> Dict[str, Any]:
+    result = await inference_executor.embed_for_verification(face_service, image, qr_code)
+    if result["success"]:
+        result = await inference_executor.run(face_service.verify_embedding, result["qr_code"], result["embedding"])
+    return result
+
+@router.post("/verify", response_model=FaceVerificationResponse)
+async def verify_face(request: FaceVerificationRequest) -> Dict[str, Any]:
+    """
+    Verify a face against the user a QR code belongs to (1:1, no gallery scan).
+    - Image should be a base64 encoded string
+    - Pass qr_code, or leave it out to read the QR code from the same image
+    - Returns user_id only when the face matches that user
+    """
+    return await _verify(request.image, request.qr_code)
+
+@router.post("/verify/upload", response_model=FaceVerificationResponse)
+async def verify_face_upload(request: Request, qr_code: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Verify a face against a QR code's user from raw image bytes.
+    - Send JPEG/PNG bytes as the body (optionally with ?qr_code=...), or
+    - a multipart form with 'file' and optional 'qr_code' fields
+    """
+    image, form = await _read_image_upload(request)
+    return await _verify(image, form.get("qr_code") or qr_code)
+
+async def _recognize_group(image: Union[str, bytes]) -> Dict[str, Any]:
+    extracted = await inference_executor.embed_faces(face_service, image)
+    if not extracted["success"]:
+        return {"success": False, "recognized": 0, "faces": [], "message": extracted["message"]}
+    return await inference_executor.run(
+        face_service.recognize_group, extracted["faces"], extracted["embeddings"]
+    )
+
+@router.post("/recognize/group", response_model=GroupRecognitionResponse)
+async def recognize_group(request: FaceRecognitionRequest) -> Dict[str, Any]:
+    """
+    Recognize every face in a group photo.
+    - Image should be a base64 encoded string
+    - Returns a bounding box, user_id and confidence per face
+    - Each student is assigned to at most one face
+    """
+    return await _recognize_group(request.image)
+
+@router.post("/recognize/group/upload", response_model=GroupRecognitionResponse)
+async def recognize_group_upload(request: Request) -> Dict[str, Any]:
+    """
+    Recognize every face in a group photo sent as raw image bytes.
+    - Send JPEG/PNG bytes as the body, or a multipart form with a 'file' field
+    """
+    image, _ = await _read_image_upload(request)
+    return await _recognize_group(image)
+
+@router.websocket("/stream")
+async def recognize_stream(websocket: WebSocket):
+    """
+    Recognize faces in a continuous frame stream.
+    - Send each frame as a binary JPEG/PNG message (or base64 text)
+    - Faces are tracked across frames; only new or stale tracks are re-embedded
+    - One JSON reply per frame; send the next frame after the reply
+    """
+    await websocket.accept()
+    tracker = FaceTracker()
+    frame_count = 0
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            frame = message.get("bytes") or message.get("text")
+            if not frame:
+                continue
+            frame_count += 1
+            
+            now = time.monotonic()
+            result = await inference_executor.track_frame(face_service, frame, tracker, now)
+            tracker = result["tracker"]
+            if not result["success"]:
+                await websocket.send_json({"frame": frame_count, "success": False, "message": result["message"]})
+                continue
+            
+            faces = await inference_executor.run(face_service.match_tracks, tracker, result["embeddings"], now)
+            await websocket.send_json({
+                "frame": frame_count,
+                "success": True,
+                "faces": faces,
+                "embedded": len(result["embeddings"])
+            })
+    except WebSocketDisconnect:
+        pass
+
 @router.delete("/delete/{user_id}")
 async def delete_face(user_id: str) -> Dict[str, Any]:
     """
     Delete a face for a user.
     """
-    result = face_service.delete_face(user_id)
+    result = await inference_executor.run(face_service.delete_face, user_id)
     
     if not result["success"]:
         raise HTTPException(
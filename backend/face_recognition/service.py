@@ -3,22 +3,264 @@ import cv2
 import base64
 import numpy as np
 import insightface
+import onnxruntime
 from insightface.app import FaceAnalysis
+from insightface.app.common import Face
 from insightface.data import get_image as ins_get_image
-from typing import List, Dict, Tuple, Optional, Any
+from insightface.utils import face_align
+from typing import List, Dict, Tuple, Optional, Any, Union
 import time
+import threading
 from .database import Database
+from .gallery import GalleryIndex
+from .shared import create_gallery_sync
+from .batching import EmbeddingBatcher
+from .tracking import FaceTracker
+from . import quality
+from metrics import span
 
-# Initialize face recognition
-app = FaceAnalysis(name='buffalo_l')
-app.prepare(ctx_id=0, det_size=(640, 640))
+# ONNX Runtime intra-op threads per inference (0 = runtime default, one per core).
+# Keep threads x executor workers at or below the core count.
+ORT_INTRA_OP_THREADS = int(os.getenv("FACE_ORT_INTRA_OP_THREADS", "0"))
+
+# Threads running independent graph branches; only used in "parallel" execution
+# mode, which rarely helps these mostly sequential conv nets
+ORT_INTER_OP_THREADS = int(os.getenv("FACE_ORT_INTER_OP_THREADS", "1"))
+ORT_EXECUTION_MODE = os.getenv("FACE_ORT_EXECUTION_MODE", "sequential")
+
+# Graph optimization level: "disable", "basic", "extended" or "all"
+ORT_OPTIMIZATION_LEVEL = os.getenv("FACE_ORT_OPTIMIZATION_LEVEL", "all")
+
+# The CPU memory arena and memory pattern planning trade resident memory for
+# fewer allocations; turning them off shrinks idle workers at some latency cost
+ORT_CPU_MEM_ARENA = os.getenv("FACE_ORT_CPU_MEM_ARENA", "1") != "0"
+ORT_MEM_PATTERN = os.getenv("FACE_ORT_MEM_PATTERN", "1") != "0"
+
+# Idle intra-op threads spin briefly waiting for work; with several workers
+# per host that burns cores other workers could use, so set 0 to disable
+ORT_ALLOW_SPINNING = os.getenv("FACE_ORT_ALLOW_SPINNING", "1") != "0"
+
+ORT_OPTIMIZATION_LEVELS = {
+    "disable": onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+ORT_EXECUTION_MODES = {
+    "sequential": onnxruntime.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": onnxruntime.ExecutionMode.ORT_PARALLEL,
+}
+
+def session_options() -> onnxruntime.SessionOptions:
+    """SessionOptions for the detection and recognition models from the FACE_ORT_* settings"""
+    if ORT_OPTIMIZATION_LEVEL not in ORT_OPTIMIZATION_LEVELS:
+        raise ValueError(f"Unknown FACE_ORT_OPTIMIZATION_LEVEL '{ORT_OPTIMIZATION_LEVEL}', expected one of {sorted(ORT_OPTIMIZATION_LEVELS)}")
+    if ORT_EXECUTION_MODE not in ORT_EXECUTION_MODES:
+        raise ValueError(f"Unknown FACE_ORT_EXECUTION_MODE '{ORT_EXECUTION_MODE}', expected one of {sorted(ORT_EXECUTION_MODES)}")
+    options = onnxruntime.SessionOptions()
+    if ORT_INTRA_OP_THREADS > 0:
+        options.intra_op_num_threads = ORT_INTRA_OP_THREADS
+    if ORT_INTER_OP_THREADS > 0:
+        options.inter_op_num_threads = ORT_INTER_OP_THREADS
+    options.execution_mode = ORT_EXECUTION_MODES[ORT_EXECUTION_MODE]
+    options.graph_optimization_level = ORT_OPTIMIZATION_LEVELS[ORT_OPTIMIZATION_LEVEL]
+    options.enable_cpu_mem_arena = ORT_CPU_MEM_ARENA
+    options.enable_mem_pattern = ORT_MEM_PATTERN
+    if not ORT_ALLOW_SPINNING:
+        options.add_session_config_entry("session.intra_op.allow_spinning", "0")
+    return options
+
+# Directory InsightFace keeps its model packs under (<root>/models/<pack>)
+MODEL_ROOT = os.path.expanduser("~/.insightface")
+
+# "fp32" loads the pack as downloaded; "int8" loads the dynamically quantized
+# copy written by scripts/quantize_models.py as <pack>_int8
+FACE_MODEL_PRECISION = os.getenv("FACE_MODEL_PRECISION", "fp32")
+
+MODEL_PRECISIONS = ("fp32", "int8")
+
+def quantized_pack_name(name: str) -> str:
+    """Pack name of the INT8 copy of a model pack"""
+    return f"{name}_int8"
+
+# Model profiles: which InsightFace pack to load, which of its modules, and
+# the detector input size. We only use detection + recognition, so "lean"
+# skips the landmark and gender/age models that "full" loads.
+MODEL_PROFILES = {
+    "full": {"name": "buffalo_l", "allowed_modules": None, "det_size": 640},
+    "lean": {"name": "buffalo_l", "allowed_modules": ["detection", "recognition"], "det_size": 640},
+    "fast": {"name": "buffalo_s", "allowed_modules": ["detection", "recognition"], "det_size": 320},
+}
+
+def model_settings(profile: Optional[str] = None, precision: Optional[str] = None) -> Dict[str, Any]:
+    """Resolve a profile plus FACE_MODEL_PACK / FACE_DET_SIZE / FACE_MODEL_PRECISION overrides"""
+    profile = profile or os.getenv("FACE_MODEL_PROFILE", "lean")
+    if profile not in MODEL_PROFILES:
+        raise ValueError(f"Unknown FACE_MODEL_PROFILE '{profile}', expected one of {sorted(MODEL_PROFILES)}")
+    precision = precision or FACE_MODEL_PRECISION
+    if precision not in MODEL_PRECISIONS:
+        raise ValueError(f"Unknown FACE_MODEL_PRECISION '{precision}', expected one of {list(MODEL_PRECISIONS)}")
+    settings = dict(MODEL_PROFILES[profile], profile=profile, precision=precision)
+    settings["name"] = os.getenv("FACE_MODEL_PACK", settings["name"])
+    if precision == "int8":
+        settings["name"] = quantized_pack_name(settings["name"])
+    settings["det_size"] = int(os.getenv("FACE_DET_SIZE", settings["det_size"]))
+    return settings
+
+def load_model(settings: Dict[str, Any]) -> FaceAnalysis:
+    """Build and prepare a FaceAnalysis for the given settings"""
+    if settings.get("precision") == "int8" and not os.path.isdir(os.path.join(MODEL_ROOT, "models", settings["name"])):
+        # InsightFace would try to download the unknown pack name instead
+        raise RuntimeError(
+            f"INT8 model pack '{settings['name']}' not found under {MODEL_ROOT}/models; "
+            f"create it with: python -m scripts.quantize_models"
+        )
+    model = FaceAnalysis(
+        name=settings["name"],
+        root=MODEL_ROOT,
+        allowed_modules=settings["allowed_modules"],
+        sess_options=session_options()
+    )
+    model.prepare(ctx_id=0, det_size=(settings["det_size"], settings["det_size"]))
+    return model
+
+MODEL_SETTINGS = model_settings()
+
+# Face recognition model, built by get_model() on first use or during app
+# startup rather than as an import side effect
+app: Optional[FaceAnalysis] = None
+_model_lock = threading.Lock()
+
+def get_model() -> FaceAnalysis:
+    """Return the process-wide model, loading it on first call"""
+    global app
+    if app is None:
+        with _model_lock:
+            if app is None:
+                app = load_model(MODEL_SETTINGS)
+    return app
+
+def warmup_model(runs: int = 2) -> float:
+    """Run detection and recognition on a synthetic frame so ONNX Runtime's
+    first-run graph optimization happens before real traffic; returns seconds"""
+    model = get_model()
+    size = MODEL_SETTINGS["det_size"]
+    image = np.full((size, size, 3), 127, dtype=np.uint8)
+    crop = np.full((112, 112, 3), 127, dtype=np.uint8)
+    start = time.perf_counter()
+    for _ in range(runs):
+        model.det_model.detect(image, max_num=0, metric='default')
+        model.models['recognition'].get_feat([crop])
+    return time.perf_counter() - start
+
+def _embed_crops(crops: List[np.ndarray]) -> np.ndarray:
+    """Run the recognition model on a batch of aligned face crops"""
+    return get_model().models['recognition'].get_feat(crops)
+
+# Shared by every service instance so concurrent requests batch together
+batcher = EmbeddingBatcher(_embed_crops)
+
+# Most faces embedded from one group photo (largest first), and how many
+# gallery candidates each face brings to the one-to-one assignment
+FACE_GROUP_MAX_FACES = int(os.getenv("FACE_GROUP_MAX_FACES", "60"))
+GROUP_CANDIDATES = 3
+
+# Smallest side, in pixels, that frames are kept at when decoding. Larger
+# JPEGs are decoded at 1/2, 1/4 or 1/8 scale directly by libjpeg.
+DECODE_TARGET_SIZE = int(os.getenv("FACE_DECODE_TARGET_SIZE", MODEL_SETTINGS["det_size"]))
+
+_REDUCED_DECODE_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+]
+
+def _encoded_image_size(data: bytes) -> Optional[Tuple[int, int]]:
+    """Read (width, height) from JPEG or PNG headers without decoding pixels"""
+    if data[:8] == b"\x89PNG\r\n\x1a\n" and len(data) >= 24:
+        return int.from_bytes(data[16:20], "big"), int.from_bytes(data[20:24], "big")
+    if data[:2] != b"\xff\xd8":
+        return None
+
+    # Walk JPEG segments until the start-of-frame marker
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            i += 2
+            continue
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = int.from_bytes(data[i + 5:i + 7], "big")
+            width = int.from_bytes(data[i + 7:i + 9], "big")
+            return width, height
+        i += 2 + int.from_bytes(data[i + 2:i + 4], "big")
+    return None
+
+def _reduced_decode_flag(size: Optional[Tuple[int, int]]) -> int:
+    """Pick the largest decode-time reduction that keeps the short side >= DECODE_TARGET_SIZE"""
+    if size is None:
+        return cv2.IMREAD_COLOR
+    short_side = min(size)
+    for factor, flag in _REDUCED_DECODE_FLAGS:
+        if short_side // factor >= DECODE_TARGET_SIZE:
+            return flag
+    return cv2.IMREAD_COLOR
+
+# QRCodeDetector keeps state between calls, so each thread gets its own
+_qr_detectors = threading.local()
+
+def _qr_detector() -> cv2.QRCodeDetector:
+    detector = getattr(_qr_detectors, "detector", None)
+    if detector is None:
+        detector = _qr_detectors.detector = cv2.QRCodeDetector()
+    return detector
 
 class FaceRecognitionService:
     """Service for face recognition using InsightFace"""
     
     def __init__(self):
         self.database = Database()
+        self.gallery = GalleryIndex()
+        self.gallery_sync = create_gallery_sync(self.database)
         self.recognition_threshold = 0.5  # Similarity threshold for recognition
+        self.ready = False
+    
+    def startup(self, with_model: bool = True):
+        """Load and warm up the model, then load the gallery; called from the app lifespan.
+
+        with_model is False when pool processes own the model and this
+        process only does matching.
+        """
+        start = time.perf_counter()
+        warmup_seconds = 0.0
+        if with_model:
+            get_model()
+            warmup_seconds = warmup_model()
+        loaded = time.perf_counter()
+        self._ensure_gallery()
+        print(
+            f"Face service ready: model + warmup {loaded - start:.2f}s "
+            f"(warmup {warmup_seconds:.2f}s), gallery "
+            f"{f'{len(self.gallery)} faces' if self.gallery.loaded else 'not loaded yet'}"
+        )
+        self.ready = True
+    
+    def gallery_ready(self) -> bool:
+        """Retry a gallery load that failed (e.g. database down at startup); True once loaded"""
+        if not self.gallery.loaded:
+            self._ensure_gallery()
+        return self.gallery.loaded
+    
+    def _ensure_gallery(self):
+        """Load the gallery index on first use, then apply changes from other workers"""
+        with span("gallery_sync"):
+            self.gallery_sync.sync(self.gallery)
     
     def _decode_image(self, base64_image: str) -> np.ndarray:
         """Decode base64 image to OpenCV format"""
@@ -28,93 +270,288 @@ class FaceRecognitionService:
                 base64_image = base64_image.split(',')[1]
             
             # Decode base64 string to image
-            img_data = base64.b64decode(base64_image)
-            np_arr = np.frombuffer(img_data, np.uint8)
-            img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+            with span("decode_base64"):
+                img_data = base64.b64decode(base64_image)
+            return self._decode_image_bytes(img_data)
+        except Exception as e:
+            print(f"Error decoding image: {e}")
+            return None
+    
+    def _decode_image_bytes(self, img_data: bytes) -> np.ndarray:
+        """Decode encoded image bytes, downsampling during decode when the frame is large"""
+        try:
+            with span("imdecode"):
+                np_arr = np.frombuffer(img_data, np.uint8)
+                img = cv2.imdecode(np_arr, _reduced_decode_flag(_encoded_image_size(img_data)))
             return img
         except Exception as e:
             print(f"Error decoding image: {e}")
             return None
     
+    def _detect_faces(self, image: np.ndarray) -> List[Face]:
+        """Run face detection only, without the per-face models"""
+        with span("detect"):
+            bboxes, kpss = get_model().det_model.detect(image, max_num=0, metric='default')
+        faces = []
+        for i in range(bboxes.shape[0]):
+            kps = kpss[i] if kpss is not None else None
+            faces.append(Face(bbox=bboxes[i, 0:4], kps=kps, det_score=bboxes[i, 4]))
+        return faces
+    
+    def _align_face(self, image: np.ndarray, face: Face) -> np.ndarray:
+        """Crop and align a detected face to the recognition model's input size"""
+        input_size = get_model().models['recognition'].input_size[0]
+        with span("align"):
+            return face_align.norm_crop(image, landmark=face.kps, image_size=input_size)
+    
+    @staticmethod
+    def _by_size(faces: List[Face]) -> List[Face]:
+        """Sort faces by bounding box area, largest first"""
+        return sorted(faces, key=lambda x: (x.bbox[2] - x.bbox[0]) * (x.bbox[3] - x.bbox[1]), reverse=True)
+    
+    def _check_quality(self, image: np.ndarray, face: Face) -> Tuple[Optional[np.ndarray], Optional[str]]:
+        """Run the quality gate around alignment; returns (aligned crop, None) or (None, reason)"""
+        with span("quality"):
+            reason = quality.check_detection(face, image.shape)
+        if reason is not None:
+            return None, reason
+        crop = self._align_face(image, face)
+        with span("quality"):
+            reason = quality.check_crop(crop)
+        if reason is not None:
+            return None, reason
+        return crop, None
+    
     def _get_face_embedding(self, image: np.ndarray) -> Optional[np.ndarray]:
         """Extract face embedding from an image"""
         if image is None:
             return None
-        
+        return self._embed_largest_face(image).get("embedding")
+    
+    def _embed_largest_face(self, image: np.ndarray) -> Dict[str, Any]:
+        """Embed the most prominent face, unless the quality gate rejects it"""
         try:
             # Detect faces
-            faces = app.get(image)
+            faces = self._detect_faces(image)
             
             if not faces or len(faces) == 0:
-                return None
+                return {"success": False, "message": "No face detected in the image"}
             
             # Only use the first face (largest or most prominent)
             if len(faces) > 1:
                 # Sort by face size (area of bounding box)
-                faces = sorted(faces, key=lambda x: (x.bbox[2] - x.bbox[0]) * (x.bbox[3] - x.bbox[1]), reverse=True)
+                faces = self._by_size(faces)
             
-            # Get embedding from the first face
-            embedding = faces[0].embedding
-            return embedding
+            # Skip the recognition model for faces that would not match anyway
+            crop, reason = self._check_quality(image, faces[0])
+            if reason is not None:
+                return quality.rejection(reason)
+            
+            # Get embedding from the first face, batched with concurrent requests
+            with span("embed"):
+                embedding = batcher.embed(crop)
+            return {"success": True, "embedding": embedding}
         except Exception as e:
             print(f"Error extracting face embedding: {e}")
-            return None
+            return {"success": False, "message": "No face detected in the image"}
     
-    def register_face(self, user_id: str, base64_image: str) -> Dict[str, Any]:
-        """Register a face for a user"""
-        # Decode image
-        image = self._decode_image(base64_image)
+    def embed_image(self, base64_image: str) -> Dict[str, Any]:
+        """Decode a base64 image and extract the embedding of its most prominent face"""
+        return self._embed_decoded(self._decode_image(base64_image))
+    
+    def embed_image_bytes(self, img_data: bytes) -> Dict[str, Any]:
+        """Decode raw image bytes and extract the embedding of its most prominent face"""
+        return self._embed_decoded(self._decode_image_bytes(img_data))
+    
+    def _embed_decoded(self, image: Optional[np.ndarray]) -> Dict[str, Any]:
         if image is None:
             return {"success": False, "message": "Invalid image data"}
         
         # Get face embedding
-        embedding = self._get_face_embedding(image)
-        if embedding is None:
+        return self._embed_largest_face(image)
+    
+    def _decode_qr(self, image: np.ndarray) -> Optional[str]:
+        """Read a QR code visible in the frame, e.g. an ID card held up next to the face"""
+        with span("qr_decode"):
+            try:
+                payload, _, _ = _qr_detector().detectAndDecode(image)
+            except cv2.error as e:
+                print(f"Error decoding QR code: {e}")
+                return None
+        return payload or None
+    
+    def embed_for_verification(self, image: Union[str, bytes], qr_code: Optional[str] = None) -> Dict[str, Any]:
+        """Decode a frame, read its QR code unless one was given, and embed the most prominent face.
+
+        A frame without a readable QR code fails before the models run.
+        """
+        if isinstance(image, (bytes, bytearray)):
+            decoded = self._decode_image_bytes(image)
+        else:
+            decoded = self._decode_image(image)
+        if decoded is None:
+            return {"success": False, "message": "Invalid image data"}
+        
+        if not qr_code:
+            qr_code = self._decode_qr(decoded)
+            if qr_code is None:
+                return {"success": False, "message": "No QR code found in the image"}
+        return {**self._embed_largest_face(decoded), "qr_code": qr_code}
+    
+    def embed_image_faces(self, base64_image: str) -> Dict[str, Any]:
+        """Decode a base64 image and extract embeddings for every detected face"""
+        return self._embed_faces_decoded(self._decode_image(base64_image))
+    
+    def embed_image_faces_bytes(self, img_data: bytes) -> Dict[str, Any]:
+        """Decode raw image bytes and extract embeddings for every detected face"""
+        return self._embed_faces_decoded(self._decode_image_bytes(img_data))
+    
+    def _embed_faces_decoded(self, image: Optional[np.ndarray]) -> Dict[str, Any]:
+        """Detect once, then embed all faces (up to FACE_GROUP_MAX_FACES) as batched crops.
+
+        Faces rejected by the quality gate carry a "reason" and get None in
+        place of an embedding.
+        """
+        if image is None:
+            return {"success": False, "message": "Invalid image data"}
+        
+        try:
+            faces = self._by_size(self._detect_faces(image))[:FACE_GROUP_MAX_FACES]
+            if not faces:
+                return {"success": False, "message": "No face detected in the image"}
+            checked = [self._check_quality(image, face) for face in faces]
+            crops = [crop for crop, _ in checked if crop is not None]
+            with span("embed"):
+                embedded = iter(batcher.embed_many(crops) if crops else [])
+            embeddings = [next(embedded) if crop is not None else None for crop, _ in checked]
+        except Exception as e:
+            print(f"Error extracting face embeddings: {e}")
             return {"success": False, "message": "No face detected in the image"}
         
-        # Check if this is a duplicate of another user (to prevent spoofing)
-        embeddings = self.database.get_all_embeddings()
-        for stored_embedding in embeddings:
-            if stored_embedding["user_id"] != user_id:
-                similarity = self._calculate_similarity(embedding, np.array(stored_embedding["embedding"]))
-                if similarity > self.recognition_threshold:
-                    return {
-                        "success": False, 
-                        "message": f"This face is already registered to another user"
-                    }
+        return {
+            "success": True,
+            "faces": [
+                {"bbox": [float(v) for v in face.bbox], "det_score": float(face.det_score), "reason": reason}
+                for face, (_, reason) in zip(faces, checked)
+            ],
+            "embeddings": embeddings
+        }
+    
+    def register_face(self, user_id: str, base64_image: str) -> Dict[str, Any]:
+        """Register a face for a user"""
+        extracted = self.embed_image(base64_image)
+        if not extracted["success"]:
+            return extracted
+        return self.register_embedding(user_id, extracted["embedding"])
+    
+    def register_embedding(self, user_id: str, embedding: np.ndarray) -> Dict[str, Any]:
+        """Register an already extracted face embedding for a user"""
+        if not self.gallery.accepts(embedding):
+            return {
+                "success": False,
+                "message": f"Face embedding must have {self.gallery.dim} values"
+            }
+        
+        # Check if this is a duplicate of another user (to prevent spoofing);
+        # enrollment is rare, so it always scans the full gallery
+        self._ensure_gallery()
+        with span("match"):
+            matches = self.gallery.search(embedding, exclude_user_id=user_id, exact=True)
+        if matches and matches[0][1] > self.recognition_threshold:
+            return {
+                "success": False, 
+                "message": f"This face is already registered to another user"
+            }
         
         # Save embedding to database
-        if self.database.save_embedding(user_id, embedding.tolist()):
+        if self.database.save_embedding(user_id, embedding):
+            # A read-only shared gallery gets the face from the owner's next snapshot
+            if not self.gallery.upsert(user_id, embedding) and not self.gallery.read_only:
+                return {"success": False, "message": "Failed to index face data"}
             return {"success": True, "message": "Face registered successfully"}
         else:
             return {"success": False, "message": "Failed to save face data"}
     
-    def recognize_face(self, base64_image: str) -> Dict[str, Any]:
-        """Recognize a face from an image"""
-        # Decode image
-        image = self._decode_image(base64_image)
-        if image is None:
-            return {"success": False, "message": "Invalid image data"}
+    def register_embeddings(self, user_ids: List[str], embeddings: List[np.ndarray]) -> List[Dict[str, Any]]:
+        """Register many extracted embeddings at once; returns one result per item.
+
+        Duplicate checks run as two matrix products, batch x gallery and
+        batch x batch, and accepted rows are written with one batched upsert.
+        Items are accepted in order, so a later face that matches an earlier
+        item for a different user is the one rejected.
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(user_ids)
+        if not user_ids:
+            return []
         
-        # Get face embedding
-        embedding = self._get_face_embedding(image)
-        if embedding is None:
-            return {"success": False, "message": "No face detected in the image"}
+        existing_users = self.database.get_existing_user_ids(set(user_ids))
+        if existing_users is None:
+            return [{"success": False, "message": "Failed to save face data"} for _ in user_ids]
+        
+        self._ensure_gallery()
+        with span("match"):
+            gallery_matches = self.gallery.search_many(embeddings, exclude_user_ids=user_ids, exact=True)
+        
+        valid = [self.gallery.accepts(embedding) for embedding in embeddings]
+        batch = np.zeros((len(embeddings), self.gallery.dim), dtype=np.float32)
+        for i, embedding in enumerate(embeddings):
+            if valid[i]:
+                batch[i] = np.asarray(embedding, dtype=np.float32).ravel()
+        norms = np.linalg.norm(batch, axis=1, keepdims=True)
+        batch = batch / np.where(norms == 0, 1, norms)
+        batch_similarity = batch @ batch.T
+        
+        accepted: List[int] = []
+        seen_user_ids = set()
+        for i, user_id in enumerate(user_ids):
+            earlier = np.array([j for j in accepted if user_ids[j] != user_id], dtype=int)
+            if not valid[i]:
+                results[i] = {"success": False, "message": f"Face embedding must have {self.gallery.dim} values"}
+            elif user_id in seen_user_ids:
+                results[i] = {"success": False, "message": "Duplicate user_id in this request"}
+            elif user_id not in existing_users:
+                results[i] = {"success": False, "message": "User not found"}
+            elif gallery_matches[i] and gallery_matches[i][0][1] > self.recognition_threshold:
+                results[i] = {"success": False, "message": "This face is already registered to another user"}
+            elif earlier.size and np.any(batch_similarity[i, earlier] > self.recognition_threshold):
+                results[i] = {"success": False, "message": "This face matches another user in this request"}
+            else:
+                accepted.append(i)
+            seen_user_ids.add(user_id)
+        
+        if self.database.save_embeddings([(user_ids[i], embeddings[i]) for i in accepted]):
+            for i in accepted:
+                if self.gallery.upsert(user_ids[i], embeddings[i]) or self.gallery.read_only:
+                    results[i] = {"success": True, "message": "Face registered successfully"}
+                else:
+                    results[i] = {"success": False, "message": "Failed to index face data"}
+        else:
+            for i in accepted:
+                results[i] = {"success": False, "message": "Failed to save face data"}
         
-        # Get all stored embeddings
-        stored_embeddings = self.database.get_all_embeddings()
-        if not stored_embeddings:
+        return results
+    
+    def recognize_face(self, base64_image: str) -> Dict[str, Any]:
+        """Recognize a face from an image"""
+        extracted = self.embed_image(base64_image)
+        if not extracted["success"]:
+            return extracted
+        return self.recognize_embedding(extracted["embedding"])
+    
+    def recognize_embedding(self, embedding: np.ndarray) -> Dict[str, Any]:
+        """Match an already extracted face embedding against the gallery"""
+        # Match against the in-memory gallery
+        self._ensure_gallery()
+        if len(self.gallery) == 0:
             return {"success": False, "message": "No registered faces found"}
         
         # Find the best match
-        best_match = None
-        best_similarity = -1
-        
-        for stored_embedding in stored_embeddings:
-            similarity = self._calculate_similarity(embedding, np.array(stored_embedding["embedding"]))
-            if similarity > best_similarity:
-                best_similarity = similarity
-                best_match = stored_embedding["user_id"]
+        with span("match"):
+            matches = self.gallery.search(embedding)
+        if matches:
+            best_match, best_similarity = matches[0]
+        else:
+            best_match, best_similarity = None, -1
         
         # Check if the similarity is above the threshold
         if best_similarity > self.recognition_threshold:
@@ -131,6 +568,157 @@ class FaceRecognitionService:
                 "message": "Face not recognized"
             }
     
+    def verify_embedding(self, qr_code: str, embedding: np.ndarray) -> Dict[str, Any]:
+        """Compare an extracted embedding with the QR code's user only (1:1), without a gallery scan"""
+        user_id = self.database.get_user_id_by_qr_code(qr_code)
+        if user_id is None:
+            return {"success": False, "message": "QR code not recognized"}
+        
+        self._ensure_gallery()
+        enrolled = self.gallery.get(user_id)
+        if enrolled is None:
+            # Registered moments ago and not synced into this worker's gallery yet
+            stored = self.database.get_embedding_by_user_id(user_id)
+            enrolled = stored["embedding"] if stored else None
+        if enrolled is None:
+            return {"success": False, "message": "No face registered for this user"}
+        
+        with span("match"):
+            similarity = float(self._calculate_similarity(
+                np.asarray(embedding, dtype=np.float32), np.asarray(enrolled, dtype=np.float32)
+            ))
+        if similarity > self.recognition_threshold:
+            return {
+                "success": True,
+                "user_id": user_id,
+                "confidence": similarity,
+                "message": "Face verified successfully"
+            }
+        return {
+            "success": False,
+            "confidence": max(similarity, 0),
+            "message": "Face does not match the QR code"
+        }
+    
+    def track_frame(self, frame: Union[str, bytes], tracker: FaceTracker, now: float) -> Dict[str, Any]:
+        """Detect faces in one stream frame and embed only new or stale tracks.
+
+        Returns the (possibly pickled and returned) tracker together with
+        embeddings keyed by track id; match_tracks() applies them.
+        """
+        if isinstance(frame, (bytes, bytearray)):
+            image = self._decode_image_bytes(frame)
+        else:
+            image = self._decode_image(frame)
+        if image is None:
+            return {"success": False, "message": "Invalid image data", "tracker": tracker}
+        
+        try:
+            faces = self._detect_faces(image)
+            tracks = tracker.update([(face.bbox, float(face.det_score)) for face in faces])
+            stale, crops = [], []
+            for i, track in enumerate(tracks):
+                if not tracker.needs_embedding(track, now):
+                    continue
+                # Rejected tracks keep their last result and are checked again next frame
+                crop, track.reason = self._check_quality(image, faces[i])
+                if crop is not None:
+                    stale.append(i)
+                    crops.append(crop)
+            with span("embed"):
+                embeddings = batcher.embed_many(crops) if crops else []
+        except Exception as e:
+            print(f"Error processing stream frame: {e}")
+            return {"success": False, "message": "Failed to process frame", "tracker": tracker}
+        
+        return {
+            "success": True,
+            "tracker": tracker,
+            "embeddings": {tracks[i].track_id: embedding for i, embedding in zip(stale, embeddings)}
+        }
+    
+    def match_tracks(self, tracker: FaceTracker, embeddings: Dict[int, np.ndarray], now: float) -> List[Dict[str, Any]]:
+        """Match freshly embedded tracks against the gallery and report every visible track"""
+        if embeddings:
+            self._ensure_gallery()
+            with span("match"):
+                matches = self.gallery.search_many(list(embeddings.values()))
+            by_id = {track.track_id: track for track in tracker.visible}
+            for track_id, candidates in zip(embeddings, matches):
+                track = by_id[track_id]
+                best_match, best_similarity = candidates[0] if candidates else (None, 0)
+                recognized = best_similarity > self.recognition_threshold
+                track.user_id = best_match if recognized else None
+                track.confidence = max(float(best_similarity), 0)
+                track.embedded_at = now
+        
+        return [
+            {
+                "track_id": track.track_id,
+                "bbox": [float(v) for v in track.bbox],
+                "success": track.user_id is not None,
+                "user_id": track.user_id,
+                "confidence": track.confidence,
+                "embedded": track.track_id in embeddings,
+                "reason": track.reason
+            }
+            for track in tracker.visible
+        ]
+    
+    def recognize_group(self, faces: List[Dict[str, Any]], embeddings: List[np.ndarray]) -> Dict[str, Any]:
+        """Match every face of a group photo, assigning each student to at most one face.
+
+        All faces are searched in one batched gallery query. Candidate
+        (face, student) pairs above the threshold are then taken greedily from
+        the most similar down, so when two faces match the same student the
+        closer one keeps it and the other falls back to its next candidate.
+        """
+        self._ensure_gallery()
+        if len(self.gallery) == 0:
+            return {"success": False, "recognized": 0, "faces": [], "message": "No registered faces found"}
+        
+        # Faces the quality gate rejected have no embedding and stay unmatched
+        usable = [i for i, embedding in enumerate(embeddings) if embedding is not None]
+        matches: List[List[Tuple[str, float]]] = [[] for _ in embeddings]
+        if usable:
+            with span("match"):
+                found = self.gallery.search_many([embeddings[i] for i in usable], top_k=GROUP_CANDIDATES)
+            for i, candidates in zip(usable, found):
+                matches[i] = candidates
+        pairs = sorted(
+            (
+                (similarity, i, user_id)
+                for i, candidates in enumerate(matches)
+                for user_id, similarity in candidates
+                if similarity > self.recognition_threshold
+            ),
+            reverse=True
+        )
+        
+        assigned: Dict[int, Tuple[str, float]] = {}
+        claimed = set()
+        for similarity, i, user_id in pairs:
+            if i in assigned or user_id in claimed:
+                continue
+            assigned[i] = (user_id, similarity)
+            claimed.add(user_id)
+        
+        results = []
+        for i, face in enumerate(faces):
+            if i in assigned:
+                user_id, similarity = assigned[i]
+                results.append({**face, "success": True, "user_id": user_id, "confidence": float(similarity)})
+            else:
+                best_similarity = matches[i][0][1] if matches[i] else 0
+                results.append({**face, "success": False, "user_id": None, "confidence": max(float(best_similarity), 0)})
+        
+        return {
+            "success": len(assigned) > 0,
+            "recognized": len(assigned),
+            "faces": results,
+            "message": f"Recognized {len(assigned)} of {len(faces)} faces"
+        }
+    
     def _calculate_similarity(self, embedding1: np.ndarray, embedding2: np.ndarray) -> float:
         """Calculate cosine similarity between two embeddings"""
         embedding1 = embedding1.flatten()
@@ -149,6 +737,7 @@ class FaceRecognitionService:
     def delete_face(self, user_id: str) -> Dict[str, Any]:
         """Delete a face from the database"""
         if self.database.delete_embedding(user_id):
+            self.gallery.remove(user_id)
             return {"success": True, "message": "Face deleted successfully"}
         else:
             return {"success": False, "message": "Failed to delete face or user not found"} 
\ No newline at end of file
@@ -0,0 +1,297 @@
+import os
+import json
+import time
+import struct
+import threading
+import numpy as np
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: shared mode is unavailable
+    fcntl = None
+
+from .database import GallerySync
+
+# Snapshot file shared by the worker processes of one host. When set, one
+# worker owns the gallery (keeping it in step with Postgres and publishing
+# snapshots) and the others search a read-only memory map of the latest one.
+FACE_GALLERY_SHARED_PATH = os.getenv("FACE_GALLERY_SHARED_PATH") or None
+
+# Seconds between publishes by the owner, and between the other workers'
+# checks for a newer snapshot (or for a vacant owner lock)
+FACE_GALLERY_PUBLISH_INTERVAL = float(os.getenv("FACE_GALLERY_PUBLISH_INTERVAL", "1.0"))
+FACE_GALLERY_CHECK_INTERVAL = float(os.getenv("FACE_GALLERY_CHECK_INTERVAL", "0.5"))
+
+# Seconds a worker waits at startup for a snapshot before loading from Postgres itself
+FACE_GALLERY_SHARED_WAIT = float(os.getenv("FACE_GALLERY_SHARED_WAIT", "10"))
+
+SNAPSHOT_MAGIC = b"VFGALLRY"
+SNAPSHOT_VERSION = 1
+
+# The matrix starts on a page boundary so it can be mapped directly
+SNAPSHOT_ALIGNMENT = 4096
+
+def _matrix_offset(header_length: int) -> int:
+    prefix = len(SNAPSHOT_MAGIC) + 4 + header_length
+    return -(-prefix // SNAPSHOT_ALIGNMENT) * SNAPSHOT_ALIGNMENT
+
+def write_snapshot(
+    path: str,
+    user_ids: List[str],
+    matrix: np.ndarray,
+    generation: int,
+    watermark: Optional[datetime]
+):
+    """Atomically replace the snapshot at path.
+
+    Layout: magic, little-endian u32 header length, JSON header (format
+    version, dim, count, generation, sync watermark, user ids), zero padding
+    to a page boundary, then count x dim little-endian float32 rows. The file
+    is written aside and renamed over the old one, so readers that still map
+    the old snapshot keep a consistent view.
+    """
+    header = json.dumps({
+        "version": SNAPSHOT_VERSION,
+        "dim": int(matrix.shape[1]),
+        "count": len(user_ids),
+        "generation": generation,
+        "watermark": watermark.isoformat() if watermark is not None else None,
+        "user_ids": user_ids,
+    }).encode()
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(SNAPSHOT_MAGIC + struct.pack("<I", len(header)) + header)
+        f.write(b"\0" * (_matrix_offset(len(header)) - f.tell()))
+        np.ascontiguousarray(matrix, dtype="<f4").tofile(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+def read_snapshot(path: str, dim: int) -> Optional[Dict[str, Any]]:
+    """Map a snapshot read-only; None if it is missing, truncated or in another format"""
+    try:
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            prefix = f.read(len(SNAPSHOT_MAGIC) + 4)
+            if len(prefix) < len(SNAPSHOT_MAGIC) + 4 or not prefix.startswith(SNAPSHOT_MAGIC):
+                return None
+            (header_length,) = struct.unpack("<I", prefix[len(SNAPSHOT_MAGIC):])
+            header = json.loads(f.read(header_length))
+            if header.get("version") != SNAPSHOT_VERSION or header.get("dim") != dim:
+                return None
+
+            count = header["count"]
+            offset = _matrix_offset(header_length)
+            if stat.st_size < offset + count * dim * 4:
+                return None
+            if count:
+                matrix = np.memmap(f, dtype="<f4", mode="r", offset=offset, shape=(count, dim))
+            else:
+                matrix = np.zeros((0, dim), dtype=np.float32)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Error reading gallery snapshot {path}: {e}")
+        return None
+
+    watermark = header.get("watermark")
+    return {
+        "user_ids": header["user_ids"],
+        "matrix": matrix,
+        "generation": header.get("generation", 0),
+        "watermark": datetime.fromisoformat(watermark) if watermark else None,
+        "key": (stat.st_ino, stat.st_mtime_ns),
+    }
+
+def _snapshot_rows(user_ids: List[str], matrix: np.ndarray):
+    """Rows in the shape GalleryIndex.load() takes"""
+    return ({"user_id": user_id, "embedding": row} for user_id, row in zip(user_ids, matrix))
+
+class SharedGallerySync:
+    """Shares one gallery between the worker processes of a host through a snapshot file.
+
+    The process holding an exclusive lock on <path>.lock is the owner. It
+    keeps a private gallery in step with Postgres through GallerySync, and a
+    background thread publishes it as a new snapshot whenever it changed.
+    The other processes attach their gallery to a read-only memory map of the
+    latest snapshot, so the rows sit once in the page cache however many
+    workers run. Their own registrations and deletions show up in their view
+    with the owner's next publish. If the owner exits, the next worker to take
+    the lock loads the snapshot, catches up from Postgres and carries on; a
+    restart likewise loads the snapshot instead of every embedding.
+
+    Drop-in for GallerySync: the service calls sync(gallery) per request.
+    """
+
+    def __init__(
+        self,
+        database,
+        path: str,
+        notifier=None,
+        publish_interval: float = FACE_GALLERY_PUBLISH_INTERVAL,
+        check_interval: float = FACE_GALLERY_CHECK_INTERVAL,
+        startup_wait: float = FACE_GALLERY_SHARED_WAIT
+    ):
+        self.path = path
+        self.database_sync = GallerySync(database, notifier)
+        self.publish_interval = publish_interval
+        self.check_interval = check_interval
+        self.startup_wait = startup_wait
+        self.owner = False
+        self.generation = 0
+        self._gallery = None
+        self._lock_file = None
+        self._snapshot_key = None
+        self._attached_watermark: Optional[datetime] = None
+        self._published_version: Optional[int] = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self._publish_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._publisher: Optional[threading.Thread] = None
+
+    @property
+    def notifier(self):
+        return self.database_sync.notifier
+
+    def sync(self, gallery):
+        """Keep the owner's gallery current, or point a reader's gallery at the latest snapshot"""
+        with self._lock:
+            if self.owner:
+                self.database_sync.sync(gallery)
+                return
+
+            now = time.monotonic()
+            if gallery.loaded and now - self._last_check < self.check_interval:
+                return
+            self._last_check = now
+
+            if self._try_own():
+                self._become_owner(gallery)
+            elif gallery.loaded:
+                self._attach_latest(gallery)
+            else:
+                self._wait_for_snapshot(gallery)
+
+    def _try_own(self) -> bool:
+        """Take the owner lock without blocking"""
+        try:
+            if self._lock_file is None:
+                self._lock_file = open(f"{self.path}.lock", "a")
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def _become_owner(self, gallery):
+        """Load the last snapshot (or Postgres), publish, and start the publisher thread"""
+        self.owner = True
+        self._gallery = gallery
+        try:
+            snapshot = read_snapshot(self.path, gallery.dim)
+            restored = False
+            if snapshot is not None and snapshot["watermark"] is not None:
+                gallery.load(_snapshot_rows(snapshot["user_ids"], snapshot["matrix"]))
+                self.generation = snapshot["generation"]
+                # Until Postgres answers, the gallery is as current as the snapshot
+                self.database_sync.watermark = snapshot["watermark"]
+                restored = self.database_sync.catch_up(gallery, snapshot["watermark"])
+            if not restored and not self.database_sync.reload(gallery):
+                if gallery.read_only:
+                    # Keep serving the snapshot attached as a reader, from private rows the owner can change
+                    user_ids, matrix, _ = gallery.export()
+                    gallery.load(_snapshot_rows(user_ids, matrix))
+                    self.database_sync.watermark = self._attached_watermark
+                # A loaded gallery catches up from the watermark on the first sweep;
+                # otherwise nothing is published until the publisher thread's sync manages a load
+                print(f"Gallery owner (pid {os.getpid()}): could not read the database, retrying")
+            else:
+                print(
+                    f"Gallery owner (pid {os.getpid()}): {len(gallery)} faces from "
+                    f"{'snapshot' if restored else 'database'}, publishing to {self.path}"
+                )
+
+            self.publish(gallery)
+        finally:
+            self._publisher = threading.Thread(target=self._publish_loop, name="gallery-publisher", daemon=True)
+            self._publisher.start()
+
+    def _attach_latest(self, gallery) -> bool:
+        """Attach the gallery to the snapshot on disk if it is newer than the one attached"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        if (stat.st_ino, stat.st_mtime_ns) == self._snapshot_key:
+            return True
+        snapshot = read_snapshot(self.path, gallery.dim)
+        if snapshot is None:
+            return False
+        gallery.attach(snapshot["user_ids"], snapshot["matrix"])
+        self._snapshot_key = snapshot["key"]
+        self._attached_watermark = snapshot["watermark"]
+        return True
+
+    def _wait_for_snapshot(self, gallery):
+        """First load of a reader: use the snapshot, waiting briefly for the owner to write one"""
+        deadline = time.monotonic() + self.startup_wait
+        while not self._attach_latest(gallery):
+            if self._try_own():
+                self._become_owner(gallery)
+                return
+            if time.monotonic() >= deadline:
+                # No snapshot yet; serve a private copy until one is published
+                print(f"No gallery snapshot at {self.path} after {self.startup_wait:.0f}s, loading from the database")
+                self.database_sync.reload(gallery)
+                return
+            time.sleep(0.1)
+
+    def _publish_loop(self):
+        # The owner syncs here too, so changes reach the snapshot even when
+        # requests are going to other workers
+        while not self._closed.wait(self.publish_interval):
+            try:
+                with self._lock:
+                    self.database_sync.sync(self._gallery)
+                self.publish(self._gallery)
+            except Exception as e:
+                print(f"Error publishing gallery snapshot: {e}")
+
+    def publish(self, gallery):
+        """Write the gallery as the next snapshot generation if it changed since the last one"""
+        with self._publish_lock:
+            if not gallery.loaded or gallery.version == self._published_version:
+                return
+            # Read the watermark first: rows applied after it are re-read on restart, never skipped
+            watermark = self.database_sync.watermark
+            user_ids, matrix, version = gallery.export()
+            write_snapshot(self.path, user_ids, matrix, self.generation + 1, watermark)
+            self.generation += 1
+            self._published_version = version
+
+    def close(self):
+        """Publish any last changes, then release the notification connection and the owner lock"""
+        self._closed.set()
+        if self._publisher is not None:
+            self._publisher.join()
+        if self.owner:
+            try:
+                self.publish(self._gallery)
+            except OSError as e:
+                print(f"Error publishing gallery snapshot: {e}")
+        self.database_sync.close()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+        self.owner = False
+
+def create_gallery_sync(database, path: Optional[str] = FACE_GALLERY_SHARED_PATH):
+    """Shared snapshot sync when FACE_GALLERY_SHARED_PATH is set, otherwise a per-process GallerySync"""
+    if path is None:
+        return GallerySync(database)
+    if fcntl is None:
+        print("FACE_GALLERY_SHARED_PATH needs file locking, which this platform lacks; using a per-process gallery")
+        return GallerySync(database)
+    return SharedGallerySync(database, path)
@@ -0,0 +1,154 @@
+import os
+import tempfile
+import numpy as np
+from typing import Optional
+
+# How the gallery keeps embeddings in memory: "float32" scans the full
+# precision matrix; "float16" and "int8" scan a compact copy and re-score the
+# best candidates against full precision rows spilled to a file
+FACE_GALLERY_PRECISION = os.getenv("FACE_GALLERY_PRECISION", "float32")
+
+# Candidates per probe re-scored at full precision after a quantized scan
+FACE_GALLERY_RERANK = int(os.getenv("FACE_GALLERY_RERANK", "16"))
+
+# Directory for the full precision spill file (default: the system temp
+# directory); it should be on disk, not tmpfs, for the savings to be real
+FACE_GALLERY_SPILL_DIR = os.getenv("FACE_GALLERY_SPILL_DIR") or None
+
+PRECISIONS = ("float32", "float16", "int8")
+
+# Rows dequantized at a time during a full scan; small enough that the
+# float32 scratch block stays in cache for the matrix product that reads it
+SCAN_CHUNK_ROWS = 512
+
+class EmbeddingStore:
+    """Row storage for GalleryIndex.
+
+    With float32 precision this is a plain in-memory matrix that is scanned
+    directly. With float16 or int8 the scan runs over a compact code matrix
+    (int8 codes carry a per-row scale), and approximate scores are refined by
+    reading the candidate rows from a float32 memory-mapped spill file, which
+    the OS pages in on demand instead of each worker holding it on the heap.
+    """
+
+    def __init__(
+        self,
+        dim: int,
+        capacity: int,
+        precision: str = FACE_GALLERY_PRECISION,
+        spill_dir: Optional[str] = FACE_GALLERY_SPILL_DIR
+    ):
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown gallery precision {precision!r}, expected one of {PRECISIONS}")
+        self.dim = dim
+        self.precision = precision
+        self.spill_dir = spill_dir
+        self.capacity = 0
+        self._full = None
+        self._codes = None
+        self._scales = None
+        self._allocate(capacity, 0)
+
+    @property
+    def approximate(self) -> bool:
+        """True when scan scores must be refined with exact_rows()"""
+        return self.precision != "float32"
+
+    def _allocate(self, capacity: int, used: int):
+        """Resize every array to capacity rows, keeping the first used rows"""
+        if self.approximate:
+            spill = tempfile.TemporaryFile(dir=self.spill_dir)
+            full = np.memmap(spill, dtype=np.float32, mode="w+", shape=(capacity, self.dim))
+            codes = np.zeros((capacity, self.dim), dtype=np.int8 if self.precision == "int8" else np.float16)
+            scales = np.zeros(capacity, dtype=np.float32)
+            if used:
+                codes[:used] = self._codes[:used]
+                scales[:used] = self._scales[:used]
+            self._codes, self._scales = codes, scales
+        else:
+            full = np.zeros((capacity, self.dim), dtype=np.float32)
+        if used:
+            full[:used] = self._full[:used]
+        self._full = full
+        self.capacity = capacity
+
+    def reserve(self, size: int, used: int):
+        """Grow geometrically to hold size rows so inserts stay amortized O(dim)"""
+        if size <= self.capacity:
+            return
+        capacity = max(self.capacity, 1)
+        while capacity < size:
+            capacity *= 2
+        self._allocate(capacity, used)
+
+    def clear(self, capacity: int):
+        """Drop every row and go back to private arrays of the given capacity"""
+        self._allocate(capacity, 0)
+
+    def attach(self, matrix: np.ndarray):
+        """Use an external read-only float32 matrix (e.g. a shared snapshot) as the
+        full precision rows without copying it; codes, if any, are built privately"""
+        size = matrix.shape[0]
+        self._full = matrix
+        self.capacity = size
+        if self.approximate:
+            self._codes = np.zeros((size, self.dim), dtype=np.int8 if self.precision == "int8" else np.float16)
+            self._scales = np.zeros(size, dtype=np.float32)
+            for start in range(0, size, SCAN_CHUNK_ROWS):
+                self._encode(start, np.asarray(matrix[start:start + SCAN_CHUNK_ROWS], dtype=np.float32))
+
+    def _encode(self, start: int, vectors: np.ndarray):
+        """Write compact codes for consecutive rows starting at start"""
+        end = start + len(vectors)
+        if self.precision == "int8":
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            self._codes[start:end] = np.rint(vectors / scales[:, None])
+            self._scales[start:end] = scales
+        elif self.precision == "float16":
+            self._codes[start:end] = vectors
+            self._scales[start:end] = 1.0
+
+    def set(self, row: int, vector: np.ndarray):
+        self._full[row] = vector
+        self._encode(row, vector[None])
+
+    def copy(self, src: int, dst: int):
+        self._full[dst] = self._full[src]
+        if self.approximate:
+            self._codes[dst] = self._codes[src]
+            self._scales[dst] = self._scales[src]
+
+    def get(self, row: int) -> np.ndarray:
+        return np.array(self._full[row], dtype=np.float32)
+
+    def dense(self, size: int) -> np.ndarray:
+        """Full precision rows 0..size, for training ANN backends"""
+        return self._full[:size]
+
+    def scan(self, queries: np.ndarray, size: int) -> np.ndarray:
+        """Scores of each query against rows 0..size (approximate unless float32)"""
+        if not self.approximate:
+            return queries @ self._full[:size].T
+        scores = np.empty((queries.shape[0], size), dtype=np.float32)
+        for start in range(0, size, SCAN_CHUNK_ROWS):
+            end = min(start + SCAN_CHUNK_ROWS, size)
+            scores[:, start:end] = queries @ self._codes[start:end].astype(np.float32).T
+            scores[:, start:end] *= self._scales[start:end]
+        return scores
+
+    def score_rows(self, query: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """Scores of one query against selected rows (approximate unless float32)"""
+        if not self.approximate:
+            return self._full[rows] @ query
+        return (self._codes[rows].astype(np.float32) @ query) * self._scales[rows]
+
+    def exact_rows(self, rows: np.ndarray) -> np.ndarray:
+        """Full precision rows, for re-scoring candidates"""
+        return np.asarray(self._full[rows], dtype=np.float32)
+
+    def resident_bytes(self) -> int:
+        """Bytes held on the heap, excluding the memory-mapped spill file"""
+        if self.approximate:
+            return self._codes.nbytes + self._scales.nbytes
+        return self._full.nbytes
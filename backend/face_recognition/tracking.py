@@ -0,0 +1,108 @@
+import os
+import numpy as np
+from typing import List, Optional, Sequence, Tuple
+
+# Minimum IoU between a detection and a track's last box to continue the track
+FACE_TRACK_IOU = float(os.getenv("FACE_TRACK_IOU", "0.4"))
+
+# Seconds before a recognized track is re-embedded to confirm its identity,
+# and before an unrecognized track is retried (e.g. after the student turns
+# towards the camera)
+FACE_TRACK_REFRESH_SECONDS = float(os.getenv("FACE_TRACK_REFRESH_SECONDS", "2.0"))
+FACE_TRACK_RETRY_SECONDS = float(os.getenv("FACE_TRACK_RETRY_SECONDS", "0.5"))
+
+# Frames a track may go undetected before it is dropped
+FACE_TRACK_MAX_MISSES = int(os.getenv("FACE_TRACK_MAX_MISSES", "5"))
+
+def iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Pairwise IoU between (N, 4) and (M, 4) arrays of x1, y1, x2, y2 boxes"""
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return intersection / np.where(union <= 0, 1, union)
+
+class Track:
+    """A face followed across frames, with its last recognition result"""
+
+    def __init__(self, track_id: int, bbox: np.ndarray, det_score: float):
+        self.track_id = track_id
+        self.bbox = bbox
+        self.det_score = det_score
+        self.user_id: Optional[str] = None
+        self.confidence = 0.0
+        self.embedded_at: Optional[float] = None
+        self.reason: Optional[str] = None  # quality gate rejection on the last attempt
+        self.misses = 0
+
+class FaceTracker:
+    """Associates detections with tracks by IoU so faces are embedded only when needed.
+
+    One tracker belongs to one frame stream. update() is called with each
+    frame's detections; needs_embedding() says whether a visible track is new
+    or its recognition result is stale.
+    """
+
+    def __init__(
+        self,
+        iou_threshold: float = FACE_TRACK_IOU,
+        refresh_seconds: float = FACE_TRACK_REFRESH_SECONDS,
+        retry_seconds: float = FACE_TRACK_RETRY_SECONDS,
+        max_misses: int = FACE_TRACK_MAX_MISSES
+    ):
+        self.iou_threshold = iou_threshold
+        self.refresh_seconds = refresh_seconds
+        self.retry_seconds = retry_seconds
+        self.max_misses = max_misses
+        self.tracks: List[Track] = []
+        self.visible: List[Track] = []
+        self._next_id = 1
+
+    def update(self, detections: Sequence[Tuple[np.ndarray, float]]) -> List[Track]:
+        """Match (bbox, det_score) detections to tracks; returns one track per detection, in order"""
+        matched: List[Optional[Track]] = [None] * len(detections)
+        if self.tracks and detections:
+            overlaps = iou(
+                np.array([track.bbox for track in self.tracks], dtype=np.float32),
+                np.array([bbox for bbox, _ in detections], dtype=np.float32)
+            )
+            # Greedy assignment, highest overlap first
+            taken = set()
+            for flat in np.argsort(-overlaps, axis=None):
+                t, d = np.unravel_index(flat, overlaps.shape)
+                if overlaps[t, d] < self.iou_threshold:
+                    break
+                if t in taken or matched[d] is not None:
+                    continue
+                taken.add(t)
+                matched[d] = self.tracks[t]
+
+        for d, (bbox, det_score) in enumerate(detections):
+            track = matched[d]
+            if track is None:
+                track = Track(self._next_id, bbox, det_score)
+                self._next_id += 1
+                self.tracks.append(track)
+                matched[d] = track
+            track.bbox = bbox
+            track.det_score = det_score
+            track.misses = 0
+
+        seen = {id(track) for track in matched}
+        for track in self.tracks:
+            if id(track) not in seen:
+                track.misses += 1
+        self.tracks = [track for track in self.tracks if track.misses <= self.max_misses]
+        self.visible = matched
+        return matched
+
+    def needs_embedding(self, track: Track, now: float) -> bool:
+        """True for new tracks and tracks whose last recognition has gone stale"""
+        if track.embedded_at is None:
+            return True
+        interval = self.refresh_seconds if track.user_id else self.retry_seconds
+        return now - track.embedded_at >= interval
@@ -1,4 +1,4 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Request
+from fastapi import FastAPI, Depends, HTTPException, status, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
@@ -6,18 +6,44 @@ from passlib.context import CryptContext
 from datetime import datetime, timedelta
 from typing import Union, Optional
 import os
+import time
 from dotenv import load_dotenv
 from pydantic import BaseModel
+from contextlib import asynccontextmanager
 
 # Import routers
-from face_recognition.router import router as face_router
-from auth import router as auth_router
+from face_recognition.router import router as face_router, face_service, inference_executor
+from face_recognition.admission import AdmissionMiddleware, queue_depth
+from auth import router as auth_router, shutdown_auth
+from attendance import router as attendance_router, attendance_writer
+from database import close_pool
+import metrics
 
 # Load environment variables
 load_dotenv()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Application startup and shutdown"""
+    # Load and warm up the model and gallery before reporting ready
+    await inference_executor.start()
+    await inference_executor.run(face_service.startup, inference_executor.mode != "process")
+    yield
+    # Drain inference work and buffered attendance, publish the shared gallery,
+    # then release pooled and listener connections
+    inference_executor.shutdown()
+    attendance_writer.close()
+    shutdown_auth()
+    face_service.gallery_sync.close()
+    close_pool()
+
 # Initialize FastAPI app
-app = FastAPI(title="Vineyard Academy API")
+app = FastAPI(title="Vineyard Academy API", lifespan=lifespan)
+
+# Bound the face requests in flight; shed the rest with 503 + Retry-After
+# and abandon requests past their deadline or whose client disconnected.
+# Added first so it runs inside CORS and shed responses stay readable.
+app.add_middleware(AdmissionMiddleware, workers=inference_executor.workers)
 
 # Configure CORS
 origins = [
@@ -33,6 +59,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],      # Allow all methods
     allow_headers=["*"],      # Allow all headers
+    expose_headers=["Server-Timing", "Retry-After"],  # Let the frontend read stage timings and back off
 )
 
 # Security
@@ -85,15 +112,51 @@ def create_access_token(data: dict, expires_delta: Union[timedelta, None] = None
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+# Time each request, expose its stage spans as a Server-Timing header and
+# record the total in the request latency histogram
+@app.middleware("http")
+async def record_timings(request: Request, call_next):
+    spans = metrics.begin_spans()
+    start = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - start
+    route = request.scope.get("route")
+    metrics.REQUEST_SECONDS.observe(
+        elapsed,
+        method=request.method,
+        route=route.path if route is not None else "unmatched",
+        status=response.status_code
+    )
+    response.headers["Server-Timing"] = ", ".join(
+        part for part in (metrics.server_timing(spans), f"total;dur={elapsed * 1000:.2f}") if part
+    )
+    response.headers["Timing-Allow-Origin"] = "*"
+    return response
+
 # Include routers
 app.include_router(face_router, prefix="/api/face", tags=["face"])
 app.include_router(auth_router, prefix="/api/auth", tags=["auth"])
+app.include_router(attendance_router, prefix="/api/attendance", tags=["attendance"])
 
 # Root endpoint
 @app.get("/")
 async def root():
     return {"message": "Welcome to Vineyard Academy API"}
 
+# Readiness probe: fails until the face model and gallery are loaded, and
+# retries the gallery load if the database was unreachable
+@app.get("/ready")
+async def ready(response: Response):
+    if not face_service.ready or not await inference_executor.run(face_service.gallery_ready):
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        return {"status": "starting"}
+    return {"status": "ready", "gallery_size": len(face_service.gallery), "queue_depth": queue_depth()}
+
+# Prometheus scrape endpoint; each worker process reports its own series
+@app.get("/metrics")
+async def prometheus_metrics():
+    return Response(metrics.render_metrics(), media_type="text/plain; version=0.0.4")
+
 # Run with: uvicorn main:app --reload
 if __name__ == "__main__":
     import uvicorn
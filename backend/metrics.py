@@ -0,0 +1,177 @@
+import time
+import bisect
+import functools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+# Latency buckets in seconds, from sub-millisecond matching up to slow uploads
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+class Histogram:
+    """Prometheus-style cumulative histogram with labels, safe to observe from any thread"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str], buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket counts (last slot is +Inf), sum, count
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def _labels(self, key: Tuple[str, ...], extra: str = "") -> str:
+        pairs = [f'{name}="{value}"' for name, value in zip(self.labelnames, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        for key, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append("%s_bucket%s %d" % (self.name, self._labels(key, 'le="%s"' % bound), cumulative))
+            lines.append("%s_bucket%s %d" % (self.name, self._labels(key, 'le="+Inf"'), count))
+            lines.append("%s_sum%s %s" % (self.name, self._labels(key), total))
+            lines.append("%s_count%s %d" % (self.name, self._labels(key), count))
+        return lines
+
+class Counter:
+    """Prometheus-style monotonic counter with labels, safe to increment from any thread"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            series = dict(self._series)
+        for key, value in sorted(series.items()):
+            pairs = ",".join(f'{name}="{label}"' for name, label in zip(self.labelnames, key))
+            lines.append("%s%s %s" % (self.name, "{" + pairs + "}" if pairs else "", value))
+        return lines
+
+class Gauge:
+    """Prometheus-style gauge whose value is read from a callback at scrape time"""
+
+    def __init__(self, name: str, documentation: str, read: Callable[[], float]):
+        self.name = name
+        self.documentation = documentation
+        self.read = read
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} gauge",
+            f"{self.name} {self.read()}",
+        ]
+
+REGISTRY: List[Union[Histogram, Counter, Gauge]] = []
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str], buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    """Create a histogram and include it in /metrics"""
+    metric = Histogram(name, documentation, labelnames, buckets)
+    REGISTRY.append(metric)
+    return metric
+
+def counter(name: str, documentation: str, labelnames: Sequence[str]) -> Counter:
+    """Create a counter and include it in /metrics"""
+    metric = Counter(name, documentation, labelnames)
+    REGISTRY.append(metric)
+    return metric
+
+def gauge(name: str, documentation: str, read: Callable[[], float]) -> Gauge:
+    """Create a gauge reporting read() and include it in /metrics"""
+    metric = Gauge(name, documentation, read)
+    REGISTRY.append(metric)
+    return metric
+
+STAGE_SECONDS = histogram(
+    "face_stage_duration_seconds",
+    "Time spent in each face pipeline stage, including database and pool wait",
+    ["stage"]
+)
+REQUEST_SECONDS = histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route",
+    ["method", "route", "status"]
+)
+
+# Spans recorded during the current request, for the Server-Timing header.
+# Executor threads run with a copy of the request's context, so they append
+# to the same list.
+_request_spans: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("request_spans", default=None)
+
+def begin_spans() -> List[Tuple[str, float]]:
+    """Start collecting spans in the current context and return the list they go into"""
+    spans: List[Tuple[str, float]] = []
+    _request_spans.set(spans)
+    return spans
+
+def record(stage: str, seconds: float):
+    """Observe a stage duration and attach it to the current request, if any"""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    spans = _request_spans.get()
+    if spans is not None:
+        spans.append((stage, seconds))
+
+@contextmanager
+def span(stage: str):
+    """Time the enclosed block as one pipeline stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+def timed(stage: str):
+    """Decorator form of span()"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def server_timing(spans: List[Tuple[str, float]]) -> str:
+    """Format spans as a Server-Timing header value, summing repeated stages"""
+    totals: Dict[str, float] = {}
+    for stage, seconds in spans:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    return ", ".join(f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in totals.items())
+
+def render_metrics() -> str:
+    """Prometheus text exposition of every registered metric"""
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1 @@
+# Backend maintenance scripts
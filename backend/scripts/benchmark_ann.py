@@ -0,0 +1,86 @@
+"""
+Measure recall and latency of the IVF gallery index against exact search.
+
+Uses synthetic 512-d embeddings: identities are drawn around a set of shared
+cluster centers (so the gallery has the coarse structure real face embeddings
+have), and each probe is its identity's embedding plus noise. Recall@1 is the
+fraction of probes whose IVF top match equals the exact top match. Run from
+the backend directory:
+
+    python -m scripts.benchmark_ann
+    python -m scripts.benchmark_ann --sizes 10000 100000 --nprobe 4 8 16 32
+"""
+import argparse
+import json
+import time
+import numpy as np
+
+from face_recognition.ann import ExactSearch, IVFIndex
+from face_recognition.gallery import GalleryIndex
+
+
+def synthetic_embeddings(size: int, queries: int, dim: int, clusters: int, seed: int):
+    """Return (gallery, probes, probe identity rows) as float32 arrays"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    gallery = centers[rng.integers(0, clusters, size)] + 1.5 * rng.standard_normal((size, dim)).astype(np.float32)
+    identities = rng.integers(0, size, queries)
+    probes = gallery[identities] + 1.2 * rng.standard_normal((queries, dim)).astype(np.float32)
+    return gallery, probes, identities
+
+
+def _timed_search(gallery: GalleryIndex, probes: np.ndarray):
+    latencies, matches = [], []
+    for probe in probes:
+        start = time.perf_counter()
+        result = gallery.search(probe)
+        latencies.append(time.perf_counter() - start)
+        matches.append(result[0][0] if result else None)
+    values = np.array(latencies) * 1000
+    return matches, {
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+    }
+
+
+def benchmark(size: int, args) -> dict:
+    embeddings, probes, identities = synthetic_embeddings(size, args.queries, args.dim, args.clusters, args.seed)
+    rows = [{"user_id": str(i), "embedding": embedding} for i, embedding in enumerate(embeddings)]
+
+    exact = GalleryIndex(dim=args.dim, backend=ExactSearch())
+    exact.load(rows)
+    exact_matches, exact_latency = _timed_search(exact, probes)
+    result = {
+        "gallery_size": size,
+        "exact": dict(exact_latency, identity_accuracy=round(
+            float(np.mean([m == str(i) for m, i in zip(exact_matches, identities)])), 4)),
+    }
+
+    index = IVFIndex(args.dim, nlist=args.nlist, min_train=0, seed=args.seed)
+    ivf = GalleryIndex(dim=args.dim, backend=index)
+    start = time.perf_counter()
+    ivf.load(rows)
+    result["ivf_build_seconds"] = round(time.perf_counter() - start, 2)
+    result["ivf"] = []
+
+    for nprobe in args.nprobe:
+        index.nprobe = nprobe
+        ivf_matches, ivf_latency = _timed_search(ivf, probes)
+        recall = np.mean([a == b for a, b in zip(ivf_matches, exact_matches)])
+        result["ivf"].append(dict(ivf_latency, nlist=args.nlist, nprobe=nprobe, recall_at_1=round(float(recall), 4)))
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark IVF gallery search against exact search")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--clusters", type=int, default=64, help="synthetic cluster centers")
+    parser.add_argument("--nlist", type=int, default=256)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(json.dumps([benchmark(size, args) for size in args.sizes], indent=2))
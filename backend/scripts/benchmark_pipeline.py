@@ -0,0 +1,276 @@
+"""
+Offline microbenchmarks for each stage of the face pipeline.
+
+Covers image decode across sizes, single-face embedding through
+FaceRecognitionService._get_face_embedding, exact gallery matching at
+1k/10k/100k embeddings, and JSON vs binary embedding deserialization.
+Needs no network, GPU or database: embedding uses a small randomly
+initialized ONNX network with the recognition model's input/output shapes,
+run by ONNX Runtime through InsightFace's ArcFaceONNX wrapper, and a
+detector stub that returns one centered face (pass --real-model to use the
+configured InsightFace pack instead).
+
+Results are written as JSON so runs can be compared for regressions. Run
+from the backend directory:
+
+    python -m scripts.benchmark_pipeline --output bench.json
+    python -m scripts.benchmark_pipeline --compare bench.json
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import cv2
+import numpy as np
+import onnxruntime
+
+from face_recognition import service
+from face_recognition.database import decode_embedding, encode_embedding
+from face_recognition.gallery import GalleryIndex
+from face_recognition.ann import ExactSearch
+
+DECODE_SIZES = [(640, 480), (1280, 720), (1920, 1080), (4000, 3000)]
+GALLERY_SIZES = [1000, 10000, 100000]
+
+
+def _summary(samples):
+    values = np.array(samples) * 1000
+    return {
+        "mean_ms": round(float(values.mean()), 4),
+        "p50_ms": round(float(np.percentile(values, 50)), 4),
+        "p95_ms": round(float(np.percentile(values, 95)), 4),
+        "runs": len(samples),
+    }
+
+
+def _time(fn, runs: int, warmup: int = 1):
+    """Time fn() runs times after warmup calls"""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return _summary(samples)
+
+
+def synthetic_photo(width: int, height: int, seed: int = 0) -> np.ndarray:
+    """Smooth gradients plus mild noise, so JPEG sizes resemble camera frames"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    image = np.stack([
+        127 + 100 * np.sin(x / (width / 6) + c) * np.cos(y / (height / 4) - c)
+        for c in range(3)
+    ], axis=-1)
+    image += rng.normal(0, 6, image.shape)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def build_tiny_recognition_model(path: str, seed: int = 0):
+    """Write a 4-layer conv net taking Nx3x112x112 and returning Nx512"""
+    import onnx
+    from onnx import helper, numpy_helper, TensorProto
+
+    rng = np.random.default_rng(seed)
+    nodes, initializers = [], []
+    previous, channels = "input.1", 3
+    for i, width in enumerate([32, 64, 128, 128]):
+        weight = (rng.normal(size=(width, channels, 3, 3)) * 0.1).astype(np.float32)
+        initializers.append(numpy_helper.from_array(weight, f"conv{i}.weight"))
+        nodes.append(helper.make_node("Conv", [previous, f"conv{i}.weight"], [f"conv{i}"], pads=[1, 1, 1, 1], strides=[2, 2]))
+        nodes.append(helper.make_node("Relu", [f"conv{i}"], [f"relu{i}"]))
+        previous, channels = f"relu{i}", width
+    nodes.append(helper.make_node("GlobalAveragePool", [previous], ["pool"]))
+    nodes.append(helper.make_node("Flatten", ["pool"], ["flat"]))
+    initializers.append(numpy_helper.from_array(rng.normal(size=(channels, 512)).astype(np.float32), "fc.weight"))
+    nodes.append(helper.make_node("MatMul", ["flat", "fc.weight"], ["embedding"]))
+
+    graph = helper.make_graph(
+        nodes, "tiny_recognition",
+        [helper.make_tensor_value_info("input.1", TensorProto.FLOAT, ["N", 3, 112, 112])],
+        [helper.make_tensor_value_info("embedding", TensorProto.FLOAT, ["N", 512])],
+        initializers
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    onnx.save(model, path)
+
+
+class CenteredFaceDetector:
+    """Detector stub: one face filling the middle of the frame, with canonical landmarks"""
+
+    def detect(self, image, max_num=0, metric='default'):
+        from insightface.utils.face_align import arcface_dst
+        height, width = image.shape[:2]
+        side = min(height, width) * 0.5
+        x0, y0 = (width - side) / 2, (height - side) / 2
+        kps = arcface_dst * (side / 112.0) + [x0, y0]
+        bboxes = np.array([[x0, y0, x0 + side, y0 + side, 0.99]], dtype=np.float32)
+        return bboxes, kps[None].astype(np.float32)
+
+
+class OfflineModel:
+    """Stands in for FaceAnalysis with the stub detector and a recognition model"""
+
+    def __init__(self, recognition):
+        self.det_model = CenteredFaceDetector()
+        self.models = {"detection": self.det_model, "recognition": recognition}
+
+
+def install_offline_model(workdir: str):
+    from insightface.model_zoo.arcface_onnx import ArcFaceONNX
+
+    path = os.path.join(workdir, "tiny_recognition.onnx")
+    build_tiny_recognition_model(path)
+    session = onnxruntime.InferenceSession(path, sess_options=service.session_options(), providers=["CPUExecutionProvider"])
+    recognition = ArcFaceONNX(model_file=path, session=session)
+    recognition.prepare(ctx_id=-1)
+    service.app = OfflineModel(recognition)
+
+
+def bench_decode(face_service, runs: int) -> dict:
+    results = {}
+    for width, height in DECODE_SIZES:
+        encoded = cv2.imencode(".jpg", synthetic_photo(width, height), [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+        b64 = base64.b64encode(encoded).decode()
+        results[f"decode.bytes.{width}x{height}"] = _time(lambda: face_service._decode_image_bytes(encoded), runs)
+        results[f"decode.base64.{width}x{height}"] = _time(lambda: face_service._decode_image(b64), runs)
+    return results
+
+
+def bench_embedding(face_service, runs: int) -> dict:
+    # Time the pipeline itself, not the batcher's wait for concurrent requests
+    service.batcher.max_batch_size = 1
+    results = {}
+    for width, height in [(640, 480), (1280, 720)]:
+        image = synthetic_photo(width, height, seed=1)
+        faces = face_service._detect_faces(image)
+        crop = face_service._align_face(image, faces[0])
+        results[f"embedding.detect.{width}x{height}"] = _time(lambda: face_service._detect_faces(image), runs)
+        results[f"embedding.align.{width}x{height}"] = _time(lambda: face_service._align_face(image, faces[0]), runs)
+        results[f"embedding.get_feat.{width}x{height}"] = _time(lambda: service._embed_crops([crop]), runs)
+        results[f"embedding.get_face_embedding.{width}x{height}"] = _time(
+            lambda: face_service._get_face_embedding(image), runs
+        )
+    crops = [crop] * 8
+    results["embedding.get_feat.batch8"] = _time(lambda: service._embed_crops(crops), runs)
+    return results
+
+
+def bench_matching(runs: int, sizes) -> dict:
+    rng = np.random.default_rng(2)
+    results = {}
+    for size in sizes:
+        gallery = GalleryIndex(backend=ExactSearch())
+        embeddings = rng.standard_normal((size, 512)).astype(np.float32)
+        gallery.load({"user_id": str(i), "embedding": embedding} for i, embedding in enumerate(embeddings))
+        probe = embeddings[size // 2] + 0.3 * rng.standard_normal(512).astype(np.float32)
+        probes = [embeddings[i] for i in rng.integers(0, size, 32)]
+        results[f"matching.search.{size}"] = _time(lambda: gallery.search(probe), runs)
+        results[f"matching.search_many32.{size}"] = _time(lambda: gallery.search_many(probes), max(1, runs // 4))
+    return results
+
+
+def bench_deserialization(runs: int, rows: int = 1000) -> dict:
+    rng = np.random.default_rng(3)
+    embeddings = rng.standard_normal((rows, 512)).astype(np.float32)
+    formats = {
+        "json": [{"embedding": json.dumps(embedding.tolist()), "embeddingData": None} for embedding in embeddings],
+        "float32": [{"embeddingData": encode_embedding(embedding, "float32"), "embeddingDtype": "float32"} for embedding in embeddings],
+        "float16": [{"embeddingData": encode_embedding(embedding, "float16"), "embeddingDtype": "float16"} for embedding in embeddings],
+    }
+    results = {}
+    for name, stored in formats.items():
+        results[f"deserialize.{name}.{rows}rows"] = _time(
+            lambda: [decode_embedding(row) for row in stored], max(1, runs // 4)
+        )
+    return results
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "onnxruntime": onnxruntime.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "ort_intra_op_threads": service.ORT_INTRA_OP_THREADS,
+        "ort_inter_op_threads": service.ORT_INTER_OP_THREADS,
+        "ort_optimization_level": service.ORT_OPTIMIZATION_LEVEL,
+        "ort_cpu_mem_arena": service.ORT_CPU_MEM_ARENA,
+        "model_precision": service.FACE_MODEL_PRECISION,
+    }
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> bool:
+    """Print p50 changes against a baseline run; returns False if any stage regressed"""
+    ok = True
+    for name, result in sorted(current["results"].items()):
+        before = baseline.get("results", {}).get(name)
+        if before is None or before["p50_ms"] == 0:
+            continue
+        ratio = result["p50_ms"] / before["p50_ms"]
+        flag = ""
+        if ratio > 1 + tolerance:
+            flag = "  REGRESSION"
+            ok = False
+        print(f"{name:48s} {before['p50_ms']:10.3f} -> {result['p50_ms']:10.3f} ms  x{ratio:.2f}{flag}", file=sys.stderr)
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark face pipeline stages offline")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--stages", nargs="+", default=["decode", "embedding", "matching", "deserialization"])
+    parser.add_argument("--gallery-sizes", type=int, nargs="+", default=GALLERY_SIZES)
+    parser.add_argument("--real-model", action="store_true", help="use the configured InsightFace pack")
+    parser.add_argument("--output", help="write results JSON here (default: stdout)")
+    parser.add_argument("--compare", help="baseline results JSON to compare p50 latencies against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed p50 slowdown before flagging")
+    args = parser.parse_args()
+
+    face_service = service.FaceRecognitionService()
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        if "embedding" in args.stages:
+            if args.real_model:
+                service.get_model()
+            else:
+                install_offline_model(workdir)
+            results.update(bench_embedding(face_service, args.runs))
+        if "decode" in args.stages:
+            results.update(bench_decode(face_service, args.runs))
+        if "matching" in args.stages:
+            results.update(bench_matching(args.runs, args.gallery_sizes))
+        if "deserialization" in args.stages:
+            results.update(bench_deserialization(args.runs))
+
+    report = {
+        "environment": dict(environment(), model="configured pack" if args.real_model else "offline tiny model"),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(report, baseline, args.tolerance):
+            sys.exit(1)
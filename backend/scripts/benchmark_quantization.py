@@ -0,0 +1,93 @@
+"""
+Compare quantized gallery precisions against the float32 gallery.
+
+For each gallery size and precision (float16, int8) this reports the heap
+memory held by the gallery matrix, search latency, and how often the
+quantized search disagrees with float32: different top-1 user, different
+accept/reject decision at the recognition threshold, and the largest
+difference in the returned similarity. max_scan_error is the largest error
+of the quantized first-pass scores before re-ranking. Each precision is run
+with the configured re-rank depth and with rerank=1, where only the scan's
+single best row is re-scored. Uses the synthetic embeddings from
+benchmark_ann. Run from the backend directory:
+
+    python -m scripts.benchmark_quantization
+    python -m scripts.benchmark_quantization --sizes 10000 100000 --rerank 8 16 32
+"""
+import argparse
+import json
+import time
+import numpy as np
+
+from face_recognition.ann import ExactSearch
+from face_recognition.gallery import GalleryIndex
+from scripts.benchmark_ann import synthetic_embeddings
+
+
+def _run(gallery: GalleryIndex, probes: np.ndarray):
+    latencies, matches = [], []
+    for probe in probes:
+        start = time.perf_counter()
+        result = gallery.search(probe)
+        latencies.append(time.perf_counter() - start)
+        matches.append(result[0] if result else (None, float("-inf")))
+    values = np.array(latencies) * 1000
+    return matches, {
+        "mean_ms": round(float(values.mean()), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+    }
+
+
+def benchmark(size: int, args) -> dict:
+    embeddings, probes, _ = synthetic_embeddings(size, args.queries, args.dim, args.clusters, args.seed)
+    rows = [{"user_id": str(i), "embedding": embedding} for i, embedding in enumerate(embeddings)]
+
+    reference = GalleryIndex(dim=args.dim, backend=ExactSearch(), precision="float32")
+    reference.load(rows)
+    reference_matches, latency = _run(reference, probes)
+    result = {
+        "gallery_size": size,
+        # What np.array() over JSON-decoded lists would hold: one float64 row per user
+        "float64_list_bytes": size * args.dim * 8,
+        "float32": dict(latency, resident_bytes=reference.store.resident_bytes()),
+        "quantized": [],
+    }
+
+    for precision in args.precisions:
+        for rerank in [1] + args.rerank:
+            gallery = GalleryIndex(dim=args.dim, backend=ExactSearch(), precision=precision, rerank=rerank)
+            gallery.load(rows)
+            matches, latency = _run(gallery, probes)
+            same_user = np.mean([a[0] == b[0] for a, b in zip(matches, reference_matches)])
+            same_decision = np.mean([
+                (a[1] > args.threshold) == (b[1] > args.threshold) for a, b in zip(matches, reference_matches)
+            ])
+            max_delta = max(abs(a[1] - b[1]) for a, b in zip(matches, reference_matches))
+            queries = probes / np.linalg.norm(probes, axis=1, keepdims=True)
+            scan_error = np.abs(gallery.store.scan(queries, size) - reference.store.scan(queries, size)).max()
+            result["quantized"].append(dict(
+                latency,
+                precision=precision,
+                rerank=rerank,
+                resident_bytes=gallery.store.resident_bytes(),
+                top1_agreement=round(float(same_user), 4),
+                threshold_agreement=round(float(same_decision), 4),
+                max_similarity_delta=round(float(max_delta), 6),
+                max_scan_error=round(float(scan_error), 6),
+            ))
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark quantized gallery precision against float32")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--clusters", type=int, default=64, help="synthetic cluster centers")
+    parser.add_argument("--precisions", nargs="+", default=["float16", "int8"])
+    parser.add_argument("--rerank", type=int, nargs="+", default=[16])
+    parser.add_argument("--threshold", type=float, default=0.5, help="recognition threshold to compare decisions at")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(json.dumps([benchmark(size, args) for size in args.sizes], indent=2))
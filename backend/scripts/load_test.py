@@ -0,0 +1,451 @@
+"""
+Replay a mix of kiosk and login traffic against the API under load.
+
+Each request is one of:
+- recognize: POST /api/face/recognize
+- attendance: POST /api/attendance/recognize
+- register: POST /api/face/register
+- login: POST /api/auth/login
+
+Requests are drawn at random in the proportions given by --mix. With
+--rate, arrivals are open-loop: Poisson at that many requests per second,
+at most --concurrency in flight. Latency is measured from each request's
+scheduled arrival, so time spent waiting behind a slow server is counted
+instead of hidden. With --rate 0, --concurrency clients send back to back,
+each waiting out the Retry-After of a 503 like a kiosk would.
+A request only counts as successful if its response body shows it did
+its job: the sent user recognized (and, for attendance, marked), the face
+registered, a token issued. The report gives per-scenario and overall
+throughput, HTTP status counts, the outcomes of 2xx responses, error rates,
+the recognition rate, and latency percentiles and histogram buckets of the
+successful requests.
+
+By default the app runs in this process through httpx's ASGI transport,
+with the offline recognition model of scripts/benchmark_pipeline (a small
+random network and a centered-face detector stub), whitened over the test
+users' frames so they do not all match each other. This needs no network
+and no GPU. Client and server then share one event loop and CPU, so treat
+absolute numbers as a lower bound on capacity and compare runs with each
+other. Pass --url to load a running server instead. Pass --real-model to
+serve in-process with the configured InsightFace pack.
+
+Either way, DATABASE_URL must point at the database the app uses. The
+harness creates users with ids starting "loadtest-" there and enrolls
+faces for some of them. It deletes them and their attendance afterwards,
+unless --keep-users is given. A throwaway Postgres is enough. --migrate
+applies the Prisma migrations to an empty database first, so it does not
+need Node. Run from the backend directory:
+
+    python -m scripts.load_test --rate 40 --duration 30
+    python -m scripts.load_test --mix recognize=50,attendance=30,login=20 --concurrency 16 --rate 0
+    python -m scripts.load_test --url http://localhost:8000 --rate 20 --deadline-ms 3000 --output run.json
+"""
+import argparse
+import asyncio
+import base64
+import functools
+import glob
+import json
+import os
+import random
+import sys
+import tempfile
+from contextlib import AsyncExitStack
+import cv2
+import httpx
+import numpy as np
+
+from database import close_pool, get_connection
+from face_recognition import service
+from scripts.benchmark_pipeline import install_offline_model, synthetic_photo
+
+SCENARIOS = ("recognize", "attendance", "register", "login")
+DEFAULT_MIX = "recognize=70,register=10,login=20"
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+USER_PREFIX = "loadtest-"
+USER_PASSWORD = "loadtest-password"
+IMAGE_SIZE = (640, 480)
+
+# Principal directions of the users' frames kept by the offline model; the
+# rest of the 512 embedding values are zero
+WHITENED_DIMENSIONS = 96
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "frontend", "prisma", "migrations")
+
+
+def parse_mix(text: str) -> dict:
+    """"recognize=70,login=30" -> {"recognize": 0.7, "login": 0.3}"""
+    weights = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"unknown scenario {name!r}, expected one of {', '.join(SCENARIOS)}")
+        weights[name] = float(weight or 1)
+    total = sum(weights.values())
+    if total <= 0:
+        raise argparse.ArgumentTypeError("the mix needs a positive weight")
+    return {name: weight / total for name, weight in weights.items() if weight > 0}
+
+
+@functools.lru_cache(maxsize=1)
+def _base_frame() -> np.ndarray:
+    width, height = IMAGE_SIZE
+    return synthetic_photo(width, height).astype(np.float32)
+
+
+def user_frame(index: int) -> np.ndarray:
+    """A camera-like frame with fine detail of its own, so each user embeds differently"""
+    rng = np.random.default_rng(index)
+    width, height = IMAGE_SIZE
+    detail = cv2.resize(rng.normal(0, 50, (height // 10, width // 10, 3)).astype(np.float32), IMAGE_SIZE, interpolation=cv2.INTER_CUBIC)
+    noise = rng.normal(0, 6, (height, width, 3)).astype(np.float32)
+    return np.clip(_base_frame() + detail + noise, 0, 255).astype(np.uint8)
+
+
+def user_photo(index: int) -> bytes:
+    return cv2.imencode(".jpg", user_frame(index), [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+
+class WhitenedRecognition:
+    """Offline recognition model with its output whitened over the users' frames.
+
+    The random network maps every frame close to a few directions, so
+    synthetic users would match each other and registration would reject
+    them as duplicates. Projecting onto the principal directions of the
+    users' own frames, each scaled to unit variance, leaves embeddings that
+    tell them apart while re-encodings of one frame still match. The result
+    is padded with zeros to the model's output size (which leaves cosine
+    similarities unchanged), as the gallery only indexes full-size embeddings.
+    """
+
+    def __init__(self, model, det_model, frames: list):
+        from insightface.utils import face_align
+
+        self.model = model
+        crops = []
+        for frame in frames:
+            _, kpss = det_model.detect(frame)
+            crops.append(face_align.norm_crop(frame, landmark=kpss[0], image_size=112))
+        features = model.get_feat(crops)
+        self.mean = features.mean(axis=0)
+        _, scales, directions = np.linalg.svd(features - self.mean, full_matrices=False)
+        keep = max(1, min(WHITENED_DIMENSIONS, len(frames) - 1))
+        self.projection = np.zeros((features.shape[1], features.shape[1]), dtype=np.float32)
+        self.projection[:, :keep] = directions[:keep].T / scales[:keep]
+
+    def get_feat(self, imgs):
+        return (self.model.get_feat(imgs) - self.mean) @ self.projection
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+
+def install_load_test_model(workdir: str, users: list):
+    """Install the benchmark's offline model, whitened so the users are distinguishable"""
+    install_offline_model(workdir)
+    model = service.app
+    frames = [cv2.imdecode(np.frombuffer(user["photo"], np.uint8), cv2.IMREAD_COLOR) for user in users]
+    model.models["recognition"] = WhitenedRecognition(model.models["recognition"], model.det_model, frames)
+
+
+def apply_migrations():
+    """Create the schema in an empty database from the Prisma migration files"""
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT to_regclass('\"User\"') AS existing")
+            if cursor.fetchone()["existing"] is not None:
+                print("Schema already present, skipping migrations")
+                return
+            for path in sorted(glob.glob(os.path.join(MIGRATIONS_DIR, "*", "migration.sql"))):
+                with open(path) as f:
+                    cursor.execute(f.read())
+        conn.commit()
+
+
+def seed_users(count: int) -> list:
+    """Create the load-test users (or reuse those from a --keep-users run)"""
+    from auth import get_password_hash
+
+    password = get_password_hash(USER_PASSWORD)
+    users = [
+        {"id": f"{USER_PREFIX}{i}", "email": f"{USER_PREFIX}{i}@example.com", "photo": user_photo(i)}
+        for i in range(count)
+    ]
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            for user in users:
+                cursor.execute(
+                    """
+                    INSERT INTO "User" ("id", "email", "name", "password", "role", "createdAt", "updatedAt")
+                    VALUES (%s, %s, %s, %s, 'STUDENT', now(), now())
+                    ON CONFLICT ("id") DO NOTHING
+                    """,
+                    (user["id"], user["email"], f"Load Test {user['id']}", password)
+                )
+        conn.commit()
+    return users
+
+
+def remove_users():
+    """Delete the load-test users with their faces and attendance"""
+    pattern = f"{USER_PREFIX}%"
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute('DELETE FROM "Attendance" WHERE "userId" LIKE %s', (pattern,))
+            cursor.execute('DELETE FROM "FaceEmbedding" WHERE "userId" LIKE %s', (pattern,))
+            cursor.execute('DELETE FROM "User" WHERE "id" LIKE %s', (pattern,))
+        conn.commit()
+
+
+class Traffic:
+    """Builds the HTTP request for each scenario from the seeded users"""
+
+    def __init__(self, users: list, enrolled: int, deadline_ms: float = 0):
+        self.users = users
+        self.enrolled = users[:enrolled]
+        self.images = {user["id"]: base64.b64encode(user["photo"]).decode() for user in users}
+        self.headers = {"X-Request-Timeout-Ms": str(int(deadline_ms))} if deadline_ms > 0 else {}
+
+    def request(self, kind: str, rng: random.Random) -> tuple:
+        """(method, path, httpx keyword arguments, id of the user the request is for)"""
+        if kind == "login":
+            user = rng.choice(self.users)
+            return "POST", "/api/auth/login", {"data": {"username": user["email"], "password": USER_PASSWORD}}, user["id"]
+        if kind == "register":
+            user = rng.choice(self.users)
+            return "POST", "/api/face/register", {
+                "json": {"user_id": user["id"], "image": self.images[user["id"]]},
+                "headers": self.headers,
+            }, user["id"]
+        user = rng.choice(self.enrolled or self.users)
+        path = "/api/attendance/recognize" if kind == "attendance" else "/api/face/recognize"
+        return "POST", path, {"json": {"image": self.images[user["id"]]}, "headers": self.headers}, user["id"]
+
+
+def outcome(kind: str, user_id: str, body: dict) -> str:
+    """"ok" if a 2xx response body shows the request did its job, otherwise what went wrong"""
+    if kind == "login":
+        return "ok" if body.get("access_token") else "no_token"
+    if kind == "register":
+        return "ok" if body.get("success") else "not_registered"
+    if not body.get("success"):
+        return "not_recognized"
+    if body.get("user_id") != user_id:
+        return "wrong_user"
+    if kind == "attendance" and not body.get("status"):
+        return "not_marked"
+    return "ok"
+
+
+async def enroll(client: httpx.AsyncClient, traffic: Traffic):
+    """Register the enrolled users' faces before the measured run"""
+    for user in traffic.enrolled:
+        response = await client.post("/api/face/register", json={"user_id": user["id"], "image": traffic.images[user["id"]]})
+        if response.status_code != 200 or not response.json().get("success"):
+            raise SystemExit(f"Enrolling {user['id']} failed: {response.status_code} {response.text}")
+    # Registration reporting success is not enough: the faces must be searchable
+    ready = (await client.get("/ready")).json()
+    if ready.get("gallery_size", 0) < len(traffic.enrolled):
+        raise SystemExit(f"Enrolled {len(traffic.enrolled)} faces but the gallery holds {ready.get('gallery_size')}")
+
+
+async def run_load(
+    client: httpx.AsyncClient,
+    traffic: Traffic,
+    mix: dict,
+    rate: float,
+    concurrency: int,
+    duration: float,
+    timeout: float,
+    seed: int
+) -> tuple:
+    """Send traffic for duration seconds; returns ([(scenario, status, outcome, seconds)], elapsed)"""
+    loop = asyncio.get_running_loop()
+    rng = random.Random(seed)
+    kinds, weights = list(mix), list(mix.values())
+    slots = asyncio.Semaphore(concurrency)
+    samples = []
+
+    async def send(kind: str, scheduled: float) -> float:
+        """Send one request; returns its Retry-After in seconds (0 if none)"""
+        retry_after = 0.0
+        async with slots:
+            method, path, kwargs, user_id = traffic.request(kind, rng)
+            result = None
+            try:
+                response = await asyncio.wait_for(client.request(method, path, **kwargs), timeout)
+                status = str(response.status_code)
+                retry_after = float(response.headers.get("Retry-After", 0))
+                if response.is_success:
+                    result = outcome(kind, user_id, response.json())
+            except asyncio.TimeoutError:
+                status = "timeout"
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+        samples.append((kind, status, result, loop.time() - scheduled))
+        return retry_after
+
+    start = loop.time()
+    if rate > 0:
+        tasks = []
+        arrival = start
+        while True:
+            arrival += rng.expovariate(rate)
+            if arrival - start >= duration:
+                break
+            await asyncio.sleep(max(0.0, arrival - loop.time()))
+            tasks.append(asyncio.ensure_future(send(rng.choices(kinds, weights)[0], arrival)))
+        await asyncio.gather(*tasks)
+    else:
+        async def client_loop():
+            # Like a kiosk, a shed client waits out Retry-After instead of retrying at once
+            while loop.time() - start < duration:
+                retry_after = await send(rng.choices(kinds, weights)[0], loop.time())
+                await asyncio.sleep(min(retry_after, max(0.0, duration - (loop.time() - start))))
+        await asyncio.gather(*[client_loop() for _ in range(concurrency)])
+    return samples, loop.time() - start
+
+
+def _latency(seconds: list) -> dict:
+    if not seconds:
+        return None
+    values = np.array(seconds) * 1000
+    counts = np.histogram(values, bins=[0, *LATENCY_BUCKETS_MS, np.inf])[0]
+    labels = [f"<={bound}" for bound in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}"]
+    return {
+        "mean_ms": round(float(values.mean()), 2),
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+        "max_ms": round(float(values.max()), 2),
+        "histogram": dict(zip(labels, (int(count) for count in counts))),
+    }
+
+
+def summarize(samples: list, elapsed: float) -> dict:
+    """Throughput, status counts, outcomes, error and recognition rates, and latency of the successful requests"""
+    status = {}
+    outcomes = {}
+    ok = []
+    recognitions = recognized = 0
+    for kind, code, result, seconds in samples:
+        status[code] = status.get(code, 0) + 1
+        if result is None:
+            continue
+        outcomes[result] = outcomes.get(result, 0) + 1
+        if result == "ok":
+            ok.append(seconds)
+        if kind in ("recognize", "attendance"):
+            recognitions += 1
+            recognized += result == "ok"
+    total = len(samples)
+    return {
+        "requests": total,
+        "throughput_rps": round(total / elapsed, 2) if elapsed else None,
+        "ok_rps": round(len(ok) / elapsed, 2) if elapsed else None,
+        "error_rate": round(1 - len(ok) / total, 4) if total else None,
+        # Share of answered recognize/attendance requests that identified the sent user
+        "recognition_rate": round(recognized / recognitions, 4) if recognitions else None,
+        # 503 = shed by admission control, 504 = deadline passed, timeout = client gave up
+        "status": dict(sorted(status.items())),
+        # What the 2xx responses said: ok, not_recognized, wrong_user, not_marked, ...
+        "outcomes": dict(sorted(outcomes.items())),
+        "latency": _latency(ok),
+    }
+
+
+def report(samples: list, elapsed: float, args) -> dict:
+    return {
+        "settings": {
+            "target": args.url or ("in-process, configured model" if args.real_model else "in-process, offline model"),
+            "mix": args.mix,
+            "rate": args.rate,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "deadline_ms": args.deadline_ms or None,
+            "users": args.users,
+            "enrolled": args.enrolled,
+        },
+        "elapsed_s": round(elapsed, 2),
+        "overall": summarize(samples, elapsed),
+        "scenarios": {
+            kind: summarize([sample for sample in samples if sample[0] == kind], elapsed)
+            for kind in args.mix
+        },
+    }
+
+
+async def main(args) -> dict:
+    if args.migrate:
+        apply_migrations()
+    users = seed_users(args.users)
+    traffic = Traffic(users, args.enrolled, args.deadline_ms)
+
+    async with AsyncExitStack() as stack:
+        if args.url:
+            client = httpx.AsyncClient(
+                base_url=args.url,
+                timeout=None,
+                limits=httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+            )
+        else:
+            workdir = stack.enter_context(tempfile.TemporaryDirectory())
+            if not args.real_model:
+                install_load_test_model(workdir, users)
+            import main as server
+            # The app's startup and shutdown (model, gallery, attendance writer) run around the load
+            await stack.enter_async_context(server.app.router.lifespan_context(server.app))
+            client = httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://load-test")
+        await stack.enter_async_context(client)
+
+        await enroll(client, traffic)
+        samples, elapsed = await run_load(
+            client, traffic, args.mix, args.rate, args.concurrency, args.duration, args.timeout, args.seed
+        )
+    return report(samples, elapsed, args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the API with a mix of recognize, register and login traffic")
+    parser.add_argument("--url", help="base URL of a running server (default: serve the app in this process)")
+    parser.add_argument("--real-model", action="store_true", help="in-process: use the configured InsightFace pack")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"scenario weights, from {', '.join(SCENARIOS)} (default: {DEFAULT_MIX})")
+    parser.add_argument("--rate", type=float, default=20, help="arrivals per second; 0 = closed loop")
+    parser.add_argument("--concurrency", type=int, default=32, help="most requests in flight")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of traffic")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds before the client gives up on a request")
+    parser.add_argument("--deadline-ms", type=float, default=0, help="send X-Request-Timeout-Ms with face requests")
+    parser.add_argument("--users", type=int, default=200, help="load-test users to create")
+    parser.add_argument("--enrolled", type=int, default=150, help="users whose faces are registered before the run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--migrate", action="store_true", help="apply the Prisma migrations to an empty database first")
+    parser.add_argument("--keep-users", action="store_true", help="leave the load-test users in the database")
+    parser.add_argument("--output", help="write the report JSON here (default: stdout)")
+    parser.add_argument("--max-error-rate", type=float, help="exit 1 if the overall error rate is higher")
+    args = parser.parse_args()
+    if not os.getenv("DATABASE_URL"):
+        parser.error("DATABASE_URL must point at the database the app uses")
+    if not args.url and not args.real_model:
+        # Pool processes would load the configured pack instead of the offline model
+        os.environ["FACE_EXECUTOR_MODE"] = "thread"
+
+    try:
+        results = asyncio.run(main(args))
+    finally:
+        if not args.keep_users:
+            remove_users()
+        close_pool()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.max_error_rate is not None and (results["overall"]["error_rate"] or 0) > args.max_error_rate:
+        sys.exit(1)
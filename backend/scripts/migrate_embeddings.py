@@ -0,0 +1,126 @@
+"""
+Backfill and report on binary FaceEmbedding storage.
+
+Apply the Prisma migration that adds "embeddingData"/"embeddingDtype" first,
+then run from the backend directory:
+
+    python -m scripts.migrate_embeddings --report
+    python -m scripts.migrate_embeddings --backfill [--dtype float16]
+    python -m scripts.migrate_embeddings --drop-json
+
+Rollout order: deploy with FACE_EMBEDDING_STORAGE=dual, backfill, switch
+every worker to FACE_EMBEDDING_STORAGE=binary, then --drop-json.
+"""
+import argparse
+import json
+import time
+import numpy as np
+import psycopg2
+from psycopg2.extras import RealDictCursor, execute_values
+
+from face_recognition.database import DATABASE_URL, EMBEDDING_DTYPES, encode_embedding
+
+
+def report(conn):
+    """Print on-disk size and full-gallery load time for both formats"""
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT COUNT(*) AS rows,
+                   COUNT("embeddingData") AS binary_rows,
+                   COALESCE(SUM(pg_column_size(embedding)), 0) AS json_bytes,
+                   COALESCE(SUM(pg_column_size("embeddingData")), 0) AS binary_bytes,
+                   pg_total_relation_size('"FaceEmbedding"') AS table_bytes
+            FROM "FaceEmbedding"
+        """)
+        sizes = cursor.fetchone()
+
+        start = time.perf_counter()
+        cursor.execute('SELECT embedding FROM "FaceEmbedding" WHERE embedding IS NOT NULL')
+        json_rows = [np.asarray(json.loads(row["embedding"]), dtype=np.float32) for row in cursor.fetchall()]
+        json_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        cursor.execute('SELECT "embeddingData", "embeddingDtype" FROM "FaceEmbedding" WHERE "embeddingData" IS NOT NULL')
+        binary_rows = [
+            np.frombuffer(row["embeddingData"], dtype=EMBEDDING_DTYPES[row["embeddingDtype"] or "float32"])
+            for row in cursor.fetchall()
+        ]
+        binary_seconds = time.perf_counter() - start
+
+    print(f"Rows: {sizes['rows']} ({sizes['binary_rows']} with binary data)")
+    print(f"Table size (incl. indexes/TOAST): {sizes['table_bytes'] / 1024:.1f} KiB")
+    print(f"JSON column:   {sizes['json_bytes'] / 1024:.1f} KiB, load {json_seconds * 1000:.1f} ms for {len(json_rows)} rows")
+    print(f"Binary column: {sizes['binary_bytes'] / 1024:.1f} KiB, load {binary_seconds * 1000:.1f} ms for {len(binary_rows)} rows")
+
+
+def backfill(conn, dtype: str, batch_size: int):
+    """Encode every JSON-only row into the binary column, one batch per transaction"""
+    migrated = 0
+    last_user_id = ""
+    while True:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT "userId", embedding
+                FROM "FaceEmbedding"
+                WHERE "userId" > %s AND "embeddingData" IS NULL AND embedding IS NOT NULL
+                ORDER BY "userId"
+                LIMIT %s
+                """,
+                (last_user_id, batch_size)
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+
+            values = [
+                (row["userId"], psycopg2.Binary(encode_embedding(json.loads(row["embedding"]), dtype)), dtype)
+                for row in rows
+            ]
+            execute_values(
+                cursor,
+                """
+                UPDATE "FaceEmbedding" AS f
+                SET "embeddingData" = v.data, "embeddingDtype" = v.dtype
+                FROM (VALUES %s) AS v("userId", data, dtype)
+                WHERE f."userId" = v."userId"
+                """,
+                values
+            )
+        conn.commit()
+        migrated += len(rows)
+        last_user_id = rows[-1]["userId"]
+        print(f"Backfilled {migrated} rows")
+    return migrated
+
+
+def drop_json(conn):
+    """Clear the legacy JSON text once every worker runs in binary mode"""
+    with conn.cursor() as cursor:
+        cursor.execute('UPDATE "FaceEmbedding" SET embedding = NULL WHERE "embeddingData" IS NOT NULL')
+        cleared = cursor.rowcount
+    conn.commit()
+    print(f"Cleared JSON embeddings on {cleared} rows")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate face embeddings to binary storage")
+    parser.add_argument("--report", action="store_true", help="print size and load time for both formats")
+    parser.add_argument("--backfill", action="store_true", help="encode JSON-only rows into the binary column")
+    parser.add_argument("--drop-json", action="store_true", help="clear the JSON column on migrated rows")
+    parser.add_argument("--dtype", choices=sorted(EMBEDDING_DTYPES), default="float32")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+    try:
+        if args.report:
+            report(conn)
+        if args.backfill:
+            backfill(conn, args.dtype, args.batch_size)
+            report(conn)
+        if args.drop_json:
+            drop_json(conn)
+            report(conn)
+    finally:
+        conn.close()
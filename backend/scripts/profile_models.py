@@ -0,0 +1,109 @@
+"""
+Compare face model profiles by per-stage latency and memory.
+
+Each profile is loaded in a fresh subprocess so resident memory is measured
+in isolation. Run from the backend directory:
+
+    python -m scripts.profile_models
+    python -m scripts.profile_models --profiles lean fast --image kiosk.jpg --runs 50
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+
+
+def _rss_mb() -> float:
+    """Current resident set size of this process in MiB"""
+    with open("/proc/self/statm") as f:
+        resident_pages = int(f.read().split()[1])
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+def _summary(samples):
+    values = np.array(samples) * 1000
+    return {
+        "mean_ms": round(float(values.mean()), 2),
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+    }
+
+
+def profile_current(image_path: str, runs: int) -> dict:
+    """Load the model selected by FACE_MODEL_PROFILE and time each pipeline stage"""
+    import cv2
+    from insightface.data import get_image as ins_get_image
+
+    from face_recognition import service
+
+    rss_before = _rss_mb()
+    start = time.perf_counter()
+    service.get_model()
+    load_seconds = time.perf_counter() - start
+    rss_loaded = _rss_mb()
+
+    image = cv2.imread(image_path) if image_path else ins_get_image("t1")
+    face_service = service.FaceRecognitionService()
+
+    detect, align, embed = [], [], []
+    faces = []
+    for i in range(runs + 1):
+        t0 = time.perf_counter()
+        faces = face_service._detect_faces(image)
+        t1 = time.perf_counter()
+        if not faces:
+            break
+        crop = face_service._align_face(image, faces[0])
+        t2 = time.perf_counter()
+        service._embed_crops([crop])
+        t3 = time.perf_counter()
+        # The first pass includes ONNX Runtime warm-up and is not counted
+        if i > 0:
+            detect.append(t1 - t0)
+            align.append(t2 - t1)
+            embed.append(t3 - t2)
+
+    result = {
+        "settings": dict(service.MODEL_SETTINGS),
+        "models": sorted(service.app.models),
+        "load_seconds": round(load_seconds, 2),
+        "model_rss_mb": round(rss_loaded - rss_before, 1),
+        "peak_rss_mb": round(_rss_mb(), 1),
+        "faces_detected": len(faces),
+    }
+    if detect:
+        result["detection"] = _summary(detect)
+        result["alignment"] = _summary(align)
+        result["embedding"] = _summary(embed)
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profile face model profiles")
+    parser.add_argument("--profiles", nargs="+", default=["full", "lean", "fast"])
+    parser.add_argument("--image", default="", help="test image (defaults to InsightFace's bundled t1.jpg)")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(profile_current(args.image, args.runs)))
+        sys.exit(0)
+
+    results = {}
+    for profile in args.profiles:
+        env = dict(os.environ, FACE_MODEL_PROFILE=profile)
+        completed = subprocess.run(
+            [sys.executable, "-m", "scripts.profile_models", "--child",
+             "--image", args.image, "--runs", str(args.runs)],
+            env=env, capture_output=True, text=True
+        )
+        if completed.returncode != 0:
+            results[profile] = {"error": completed.stderr.strip().splitlines()[-1:]}
+            continue
+        results[profile] = json.loads(completed.stdout.strip().splitlines()[-1])
+
+    print(json.dumps(results, indent=2))
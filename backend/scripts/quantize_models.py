@@ -0,0 +1,237 @@
+"""
+Build a dynamically quantized INT8 copy of a model pack and compare it with FP32.
+
+The detection and recognition models are quantized with ONNX Runtime's
+quantize_dynamic: weights are stored as 8-bit integers and activations are
+quantized per inference, so no calibration set is needed. The result is
+written next to the original pack as <pack>_int8, which the service loads
+with FACE_MODEL_PRECISION=int8. Models not selected with --models are copied
+unchanged.
+
+The comparison loads both packs and reports, over a set of face images:
+file sizes; detection and recognition latency (batch 1 and 8); detection
+agreement (faces found, IoU of matched boxes); embedding drift, the cosine
+between the FP32 and INT8 embeddings of the same aligned crop; and match
+accuracy with INT8 probes against an FP32 gallery, which is what already
+enrolled users see after switching. Genuine pairs are each crop against its
+mirror image, impostor pairs every two different crops. Pass your own
+enrollment photos with --images; the default is InsightFace's bundled
+images. Run from the backend directory:
+
+    python -m scripts.quantize_models
+    python -m scripts.quantize_models --pack buffalo_s --models recognition --images photos/*.jpg
+    python -m scripts.quantize_models --compare-only --runs 50
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import tempfile
+import time
+import cv2
+import numpy as np
+
+from face_recognition import service
+
+QUANTIZABLE_TASKS = ("detection", "recognition")
+
+
+def _summary(samples):
+    values = np.array(samples) * 1000
+    return {
+        "mean_ms": round(float(values.mean()), 2),
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+    }
+
+
+def _time(fn, runs: int):
+    fn()  # first run includes ONNX Runtime warm-up
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return _summary(samples)
+
+
+def _task(path: str):
+    """InsightFace task name of an ONNX file ("detection", "recognition", ...), or None"""
+    from insightface.model_zoo import model_zoo
+    model = model_zoo.get_model(path, providers=["CPUExecutionProvider"])
+    return model.taskname if model is not None else None
+
+
+def quantize_pack(source: str, target: str, tasks, weight_type: str = "uint8", per_channel: bool = False):
+    """Write INT8 copies of the models for the given tasks from source into target"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    os.makedirs(target, exist_ok=True)
+    report = []
+    # Only the .onnx files are copied: a package manifest would pin the FP32 checksums
+    for path in sorted(glob.glob(os.path.join(source, "*.onnx"))):
+        name = os.path.basename(path)
+        output = os.path.join(target, name)
+        task = _task(path)
+        if task not in tasks:
+            shutil.copyfile(path, output)
+            report.append({"file": name, "task": task, "quantized": False})
+            continue
+
+        with tempfile.TemporaryDirectory() as workdir:
+            # Shape inference and graph cleanup let more nodes be quantized
+            prepared = os.path.join(workdir, name)
+            try:
+                quant_pre_process(path, prepared)
+            except Exception as e:
+                print(f"Pre-processing {name} failed ({e}), quantizing it as is")
+                prepared = path
+            quantize_dynamic(
+                prepared,
+                output,
+                weight_type=QuantType.QInt8 if weight_type == "int8" else QuantType.QUInt8,
+                per_channel=per_channel
+            )
+        report.append({
+            "file": name,
+            "task": task,
+            "quantized": True,
+            "fp32_mb": round(os.path.getsize(path) / 2**20, 1),
+            "int8_mb": round(os.path.getsize(output) / 2**20, 1),
+        })
+    return report
+
+
+def _normalize(embeddings: np.ndarray) -> np.ndarray:
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+def _iou(a, b) -> float:
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    intersection = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def _detection_agreement(reference, candidate) -> dict:
+    """Greedily pair boxes at IoU > 0.5 between two detectors' outputs"""
+    found = {"fp32_faces": 0, "int8_faces": 0, "matched": 0}
+    ious = []
+    for boxes, other in zip(reference, candidate):
+        found["fp32_faces"] += len(boxes)
+        found["int8_faces"] += len(other)
+        unmatched = list(range(len(other)))
+        for box in boxes:
+            scored = [(_iou(box, other[j]), j) for j in unmatched]
+            best = max(scored, default=(0.0, None))
+            if best[0] > 0.5:
+                unmatched.remove(best[1])
+                ious.append(best[0])
+    found["matched"] = len(ious)
+    found["mean_iou"] = round(float(np.mean(ious)), 4) if ious else None
+    return found
+
+
+def compare(fp32_model, int8_model, images, runs: int, threshold: float) -> dict:
+    """Latency and agreement of two loaded FaceAnalysis-like models over images"""
+    from insightface.utils import face_align
+
+    detections = {"fp32": [], "int8": []}
+    crops = []
+    for image in images:
+        for label, model in (("fp32", fp32_model), ("int8", int8_model)):
+            bboxes, _ = model.det_model.detect(image, max_num=0, metric='default')
+            detections[label].append([box[:4] for box in bboxes])
+        # Recognition is compared on the same aligned crops, from the FP32 detector
+        bboxes, kpss = fp32_model.det_model.detect(image, max_num=0, metric='default')
+        for kps in (kpss if kpss is not None else []):
+            crops.append(face_align.norm_crop(image, landmark=kps, image_size=112))
+    if not crops:
+        raise SystemExit("No faces detected in the given images")
+
+    result = {
+        "images": len(images),
+        "crops": len(crops),
+        "detection": _detection_agreement(detections["fp32"], detections["int8"]),
+        "latency": {},
+    }
+    batch = (crops * 8)[:8]
+    for label, model in (("fp32", fp32_model), ("int8", int8_model)):
+        recognition = model.models["recognition"]
+        result["latency"][label] = {
+            "detect": _time(lambda: model.det_model.detect(images[0], max_num=0, metric='default'), runs),
+            "embed_batch1": _time(lambda: recognition.get_feat(crops[:1]), runs),
+            "embed_batch8": _time(lambda: recognition.get_feat(batch), runs),
+        }
+
+    mirrored = [cv2.flip(crop, 1) for crop in crops]
+    gallery = _normalize(fp32_model.models["recognition"].get_feat(crops))
+    fp32_mirror = _normalize(fp32_model.models["recognition"].get_feat(mirrored))
+    int8_probe = _normalize(int8_model.models["recognition"].get_feat(crops))
+    int8_mirror = _normalize(int8_model.models["recognition"].get_feat(mirrored))
+
+    drift = np.sum(gallery * int8_probe, axis=1)
+    genuine_fp32 = np.sum(gallery * fp32_mirror, axis=1)
+    genuine_int8 = np.sum(gallery * int8_mirror, axis=1)
+    impostor = ~np.eye(len(crops), dtype=bool)
+    impostor_fp32 = (gallery @ gallery.T)[impostor]
+    impostor_int8 = (int8_probe @ gallery.T)[impostor]
+
+    result["recognition"] = {
+        "drift_min_cosine": round(float(drift.min()), 4),
+        "drift_mean_cosine": round(float(drift.mean()), 4),
+        "top1_self_match": round(float(np.mean(np.argmax(int8_probe @ gallery.T, axis=1) == np.arange(len(crops)))), 4),
+        "genuine_accept_fp32": round(float(np.mean(genuine_fp32 > threshold)), 4),
+        "genuine_accept_int8": round(float(np.mean(genuine_int8 > threshold)), 4),
+        "genuine_max_delta": round(float(np.abs(genuine_int8 - genuine_fp32).max()), 4),
+    }
+    if impostor.any():
+        result["recognition"].update({
+            "impostor_accept_fp32": round(float(np.mean(impostor_fp32 > threshold)), 4),
+            "impostor_accept_int8": round(float(np.mean(impostor_int8 > threshold)), 4),
+            "impostor_max_delta": round(float(np.abs(impostor_int8 - impostor_fp32).max()), 4),
+        })
+    return result
+
+
+def _default_images():
+    import insightface
+    directory = os.path.join(os.path.dirname(insightface.__file__), "data", "images")
+    return sorted(glob.glob(os.path.join(directory, "*.jpg")) + glob.glob(os.path.join(directory, "*.png")))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Quantize a model pack to INT8 and compare it with FP32")
+    parser.add_argument("--pack", help="FP32 pack to quantize (default: the configured profile's pack)")
+    parser.add_argument("--models", nargs="+", choices=QUANTIZABLE_TASKS, default=list(QUANTIZABLE_TASKS))
+    parser.add_argument("--weight-type", choices=["uint8", "int8"], default="uint8",
+                        help="weight type; ConvInteger on CPU is fastest with uint8")
+    parser.add_argument("--per-channel", action="store_true", help="one weight scale per output channel")
+    parser.add_argument("--compare-only", action="store_true", help="skip quantization, compare an existing INT8 pack")
+    parser.add_argument("--images", nargs="+", help="face images to compare on (default: InsightFace's bundled images)")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--threshold", type=float, default=0.5, help="recognition threshold to compare decisions at")
+    args = parser.parse_args()
+
+    fp32_settings = service.model_settings(precision="fp32")
+    if args.pack:
+        fp32_settings["name"] = args.pack
+    int8_settings = dict(fp32_settings, name=service.quantized_pack_name(fp32_settings["name"]), precision="int8")
+    # Compare the whole pipeline's models, whatever the profile skips in serving
+    fp32_settings["allowed_modules"] = int8_settings["allowed_modules"] = ["detection", "recognition"]
+
+    report = {"settings": {"fp32": fp32_settings["name"], "int8": int8_settings["name"]}}
+    fp32_model = service.load_model(fp32_settings)  # downloads the pack if needed
+    if not args.compare_only:
+        source = os.path.join(service.MODEL_ROOT, "models", fp32_settings["name"])
+        target = os.path.join(service.MODEL_ROOT, "models", int8_settings["name"])
+        report["files"] = quantize_pack(source, target, args.models, args.weight_type, args.per_channel)
+    int8_model = service.load_model(int8_settings)
+
+    images = [cv2.imread(path) for path in (args.images or _default_images())]
+    images = [image for image in images if image is not None]
+    report["comparison"] = compare(fp32_model, int8_model, images, args.runs, args.threshold)
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,51 @@
+import asyncio
+import httpx
+from face_recognition.admission import AdmissionMiddleware, add_work, expired
+
+def make_app(work_seconds):
+    """ASGI app charging work_seconds[path] of pool time to each request, like the executor does"""
+
+    async def app(scope, receive, send):
+        while (await receive()).get("more_body", False):
+            pass
+        add_work(work_seconds.get(scope["path"], 0.1))
+        body = b'{"expired": %s}' % (b"true" if expired() else b"false")
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": body})
+
+    return app
+
+def post_all(middleware, paths):
+    async def scenario():
+        transport = httpx.ASGITransport(app=middleware)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return [(await client.post(path, json={})).status_code for path in paths]
+    return asyncio.run(scenario())
+
+def test_slow_route_does_not_lock_out_others():
+    work = {"/api/face/recognize": 0.1, "/api/face/recognize/group": 9.6}
+    middleware = AdmissionMiddleware(make_app(work), workers=4, timeout_ms=1000)
+
+    statuses = post_all(middleware, ["/api/face/recognize", "/api/face/recognize/group"] + ["/api/face/recognize"] * 5)
+
+    assert statuses == [200] * 7
+    assert middleware.backlog_seconds == 0.0
+
+def test_shed_route_estimate_decays():
+    work = {"/api/face/recognize/group": 9.6}
+    middleware = AdmissionMiddleware(make_app(work), workers=4, timeout_ms=1000)
+
+    statuses = post_all(middleware, ["/api/face/recognize/group"] * 15)
+
+    # Admitted once, then shed while 9.6 s decays by 20% per shed request
+    # (11 times to get under the 1 s deadline), then admitted again
+    assert statuses[:13] == [200] + [503] * 11 + [200]
+
+def test_bulk_enrollment_is_exempt():
+    work = {"/api/face/register/bulk": 30.0}
+    middleware = AdmissionMiddleware(make_app(work), workers=1, timeout_ms=1000)
+
+    statuses = post_all(middleware, ["/api/face/register/bulk", "/api/face/register/bulk/upload", "/api/face/register/bulk"])
+
+    assert statuses == [200, 200, 200]
+    assert middleware.route_seconds == {}
@@ -0,0 +1,66 @@
+import numpy as np
+from face_recognition.ann import ExactSearch, IVFIndex
+from face_recognition.gallery import GalleryIndex
+
+DIM = 16
+
+def unit(rng):
+    vector = rng.normal(size=DIM).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+def assert_buckets_consistent(index, size):
+    """Every gallery row sits in exactly one bucket, at the position the index records"""
+    seen = []
+    for bucket in range(index.nlist):
+        rows = index._lists[bucket][:index._sizes[bucket]]
+        for position, row in enumerate(rows):
+            assert index._assign[row] == bucket
+            assert index._pos[row] == position
+        seen.extend(int(row) for row in rows)
+    assert sorted(seen) == list(range(size))
+    assert np.all(index._assign[size:] == -1)
+
+def test_random_edits_keep_buckets_consistent_and_search_exact():
+    rng = np.random.default_rng(7)
+    # Probing every list makes the IVF result exact, so it must equal a brute-force scan
+    index = IVFIndex(DIM, nlist=4, nprobe=4, min_train=8, seed=1)
+    gallery = GalleryIndex(dim=DIM, initial_capacity=4, backend=index, precision="float32")
+    exact = GalleryIndex(dim=DIM, initial_capacity=4, backend=ExactSearch(), precision="float32")
+    rows = [{"user_id": f"user-{i}", "embedding": unit(rng)} for i in range(12)]
+    gallery.load(rows)
+    exact.load(rows)
+    assert index.ready
+    next_id = 12
+
+    for _ in range(300):
+        user_ids = gallery.user_ids()
+        action = rng.choice(["add", "update", "remove"]) if len(user_ids) > 2 else "add"
+        if action == "add":
+            user_id, vector = f"user-{next_id}", unit(rng)
+            next_id += 1
+        elif action == "update":
+            user_id, vector = user_ids[rng.integers(len(user_ids))], unit(rng)
+        else:
+            user_id = user_ids[rng.integers(len(user_ids))]
+            assert gallery.remove(user_id) and exact.remove(user_id)
+        if action != "remove":
+            assert gallery.upsert(user_id, vector) and exact.upsert(user_id, vector)
+
+        assert_buckets_consistent(index, len(gallery))
+        probe = unit(rng)
+        assert sorted(index.candidates(probe)) == list(range(len(gallery)))
+        approximate, brute_force = gallery.search(probe, top_k=3), exact.search(probe, top_k=3)
+        assert [user_id for user_id, _ in approximate] == [user_id for user_id, _ in brute_force]
+        assert np.allclose([score for _, score in approximate], [score for _, score in brute_force], atol=1e-6)
+
+def test_untrained_index_defers_to_exact_scan():
+    rng = np.random.default_rng(8)
+    index = IVFIndex(DIM, nlist=4, nprobe=1, min_train=100)
+    gallery = GalleryIndex(dim=DIM, backend=index, precision="float32")
+    gallery.load({"user_id": f"user-{i}", "embedding": unit(rng)} for i in range(10))
+
+    assert not index.ready
+    assert index.candidates(unit(rng)) is None
+    gallery.upsert("user-new", unit(rng))
+    gallery.remove("user-3")
+    assert len(gallery.search(unit(rng), top_k=20)) == 10
@@ -0,0 +1,192 @@
+import time
+import asyncio
+import threading
+from contextlib import contextmanager
+import pytest
+import attendance
+from cache import TTLCache
+
+class FakeConnection:
+    def cursor(self):
+        @contextmanager
+        def cursor():
+            yield None
+        return cursor()
+
+    def commit(self):
+        pass
+
+@pytest.fixture
+def database(monkeypatch):
+    """Records each INSERT batch instead of writing it; set failures to make the next inserts raise"""
+    state = {"batches": [], "failures": 0}
+
+    @contextmanager
+    def get_connection():
+        yield FakeConnection()
+
+    def execute_values(cursor, sql, values, template=None, page_size=100):
+        if state["failures"]:
+            state["failures"] -= 1
+            raise RuntimeError("database unavailable")
+        state["batches"].append([(row[4], row[5]) for row in values])
+
+    monkeypatch.setattr(attendance, "get_connection", get_connection)
+    monkeypatch.setattr(attendance, "execute_values", execute_values)
+    monkeypatch.setattr(attendance, "SHUTDOWN_RETRY_SECONDS", 0.0)
+    monkeypatch.setattr(attendance, "dedupe_cache", TTLCache(300))
+    return state
+
+def row(user_id, class_date="2026-10-16"):
+    return {"user_id": user_id, "class_date": class_date, "date": None, "status": "PRESENT", "time_in": "07:30 AM"}
+
+def test_rows_queued_together_are_written_in_one_batch(database):
+    writer = attendance.AttendanceWriter(flush_interval=10, max_rows=100)
+    for i in range(3):
+        writer.add(row(f"user-{i}"))
+    writer.close()
+
+    assert database["batches"] == [[("user-0", "2026-10-16"), ("user-1", "2026-10-16"), ("user-2", "2026-10-16")]]
+
+def test_full_buffer_flushes_before_the_interval(database):
+    writer = attendance.AttendanceWriter(flush_interval=10, max_rows=5)
+    for i in range(12):
+        writer.add(row(f"user-{i}"))
+    deadline = time.monotonic() + 5
+    while sum(len(batch) for batch in database["batches"]) < 10 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    # Two full buffers went out without waiting 10 s for the interval
+    assert sum(len(batch) for batch in database["batches"]) >= 10
+    writer.close()
+
+    assert sorted(user_id for batch in database["batches"] for user_id, _ in batch) == sorted(f"user-{i}" for i in range(12))
+    assert len(database["batches"]) <= 3
+
+def test_shutdown_retries_a_failed_final_flush(database):
+    database["failures"] = 1
+    writer = attendance.AttendanceWriter(flush_interval=10)
+    writer.add(row("user-0"))
+    writer.close()
+
+    assert database["batches"] == [[("user-0", "2026-10-16")]]
+
+def test_rows_out_of_attempts_are_logged_with_their_keys(database, capsys):
+    database["failures"] = attendance.MAX_WRITE_ATTEMPTS
+    writer = attendance.AttendanceWriter(flush_interval=10)
+    writer.add(row("user-7", "2026-10-17"))
+    writer.close()
+
+    assert database["batches"] == []
+    out = capsys.readouterr().out
+    assert "ERROR: dropped 1 attendance rows" in out
+    assert "user-7 2026-10-17" in out
+
+def test_repeat_scans_within_the_ttl_are_written_once(monkeypatch):
+    added = []
+    monkeypatch.setattr(attendance, "get_schedule", lambda user_id: (None, "Asia/Manila"))
+    monkeypatch.setattr(attendance, "attendance_writer", type("Writer", (), {"add": lambda self, row: added.append(row)})())
+    monkeypatch.setattr(attendance, "dedupe_cache", TTLCache(0.2))
+
+    first = attendance.mark_attendance("user-0")
+    second = attendance.mark_attendance("user-0")
+    other = attendance.mark_attendance("user-1")
+
+    assert not first["already_marked"] and second["already_marked"] and not other["already_marked"]
+    assert second["time_in"] == first["time_in"]
+    assert [row["user_id"] for row in added] == ["user-0", "user-1"]
+
+    # Once the entry expires the scan goes to the writer again (the insert itself dedupes by day)
+    time.sleep(0.25)
+    assert not attendance.mark_attendance("user-0")["already_marked"]
+    assert [row["user_id"] for row in added] == ["user-0", "user-1", "user-0"]
+
+class ReportCursor:
+    """Named cursor over fixed batches; fetchmany blocks while the report's gate is closed"""
+
+    def __init__(self, report):
+        self.report = report
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.report["cursor_closed"] = True
+        return False
+
+    def execute(self, query, params):
+        pass
+
+    def fetchmany(self, size):
+        self.report["fetching"].set()
+        self.report["gate"].wait()
+        return self.report["batches"].pop(0) if self.report["batches"] else []
+
+@pytest.fixture
+def report(monkeypatch):
+    """Report batches served from memory; records where the cursor and connection were released"""
+    state = {
+        "batches": [[("row", i)] for i in range(5)],
+        "gate": threading.Event(),
+        "fetching": threading.Event(),
+        "cursor_closed": False,
+        "released_on": None,
+    }
+    state["gate"].set()
+
+    class ReportConnection:
+        def cursor(self, name=None, cursor_factory=None):
+            return ReportCursor(state)
+
+    @contextmanager
+    def get_connection():
+        try:
+            yield ReportConnection()
+        finally:
+            state["released_on"] = threading.current_thread()
+
+    monkeypatch.setattr(attendance, "get_connection", get_connection)
+    return state
+
+def start_report():
+    batches = attendance.report_batches("SELECT", {})
+    return attendance._report_chunks(next(batches), batches, "ndjson")
+
+def test_report_released_when_the_client_stops_reading(report):
+    async def read_one_chunk():
+        chunks = start_report()
+        await chunks.__anext__()
+        await chunks.__anext__()
+        await chunks.aclose()
+
+    asyncio.run(read_one_chunk())
+
+    assert report["cursor_closed"]
+    # Closed on a worker thread, not on the event loop
+    assert report["released_on"] not in (None, threading.main_thread())
+
+def test_report_released_after_a_fetch_in_flight_when_cancelled(report):
+    async def cancel_mid_fetch():
+        chunks = start_report()
+        await chunks.__anext__()
+        report["gate"].clear()
+        report["fetching"].clear()
+        reading = asyncio.ensure_future(chunks.__anext__())
+        await asyncio.get_running_loop().run_in_executor(None, report["fetching"].wait)
+        reading.cancel()
+        await asyncio.sleep(0.05)
+        # The worker thread is still inside fetchmany, so closing waits for it
+        assert not reading.done()
+        assert report["released_on"] is None
+
+        report["gate"].set()
+        with pytest.raises(asyncio.CancelledError):
+            await reading
+
+    try:
+        asyncio.run(cancel_mid_fetch())
+    finally:
+        # Never leave the worker thread parked on the gate if an assertion failed
+        report["gate"].set()
+
+    assert report["cursor_closed"]
+    assert report["released_on"] not in (None, threading.main_thread())
@@ -0,0 +1,95 @@
+from contextlib import contextmanager
+import pytest
+import auth
+from cache import TTLCache
+
+class FakeListener:
+    """Stands in for ChangeListener: hands out queued emails, or None for a reconnect"""
+
+    def __init__(self):
+        self.batches = []
+
+    def poll(self):
+        return self.batches.pop(0) if self.batches else set()
+
+    def close(self):
+        pass
+
+class FakeCursor:
+    def __init__(self, users):
+        self.users = users
+        self.row = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def fetchone(self):
+        return self.row
+
+class FakeConnection:
+    def __init__(self, users):
+        self.users = users
+
+    def cursor(self):
+        return FakeCursor(self.users)
+
+@pytest.fixture
+def users(monkeypatch):
+    """User rows by email; lookups counts the queries that reached the database"""
+    state = {"rows": {}, "lookups": 0}
+
+    @contextmanager
+    def get_connection():
+        yield FakeConnection(state["rows"])
+
+    def execute_prepared(cursor, name, params=()):
+        state["lookups"] += 1
+        cursor.row = cursor.users.get(params[0])
+
+    listener = FakeListener()
+    monkeypatch.setattr(auth, "get_connection", get_connection)
+    monkeypatch.setattr(auth, "execute_prepared", execute_prepared)
+    monkeypatch.setattr(auth, "user_cache", TTLCache(3600))
+    monkeypatch.setattr(auth, "user_change_listener", listener)
+    state["listener"] = listener
+    return state
+
+def user_row(email, role="STUDENT", password="hash-1"):
+    return {"id": "user-1", "email": email, "name": "Ana", "role": role, "password": password}
+
+def test_cached_user_is_served_without_a_query(users):
+    users["rows"]["ana@example.com"] = user_row("ana@example.com")
+
+    assert auth.get_user("ana@example.com")["role"] == "STUDENT"
+    users["rows"]["ana@example.com"] = user_row("ana@example.com", role="ADMIN")
+    assert auth.get_user("ana@example.com")["role"] == "STUDENT"
+    assert users["lookups"] == 1
+
+def test_user_notify_evicts_the_cached_user_before_its_ttl(users):
+    users["rows"]["ana@example.com"] = user_row("ana@example.com")
+    users["rows"]["ben@example.com"] = user_row("ben@example.com")
+    auth.get_user("ana@example.com")
+    auth.get_user("ben@example.com")
+
+    users["rows"]["ana@example.com"] = user_row("ana@example.com", password="hash-2")
+    users["listener"].batches.append({"ana@example.com"})
+
+    assert auth.get_user("ana@example.com")["password"] == "hash-2"
+    # Only the notified user was re-read
+    auth.get_user("ben@example.com")
+    assert users["lookups"] == 3
+
+def test_listener_reconnect_drops_every_cached_user(users):
+    users["rows"]["ana@example.com"] = user_row("ana@example.com")
+    users["rows"]["ben@example.com"] = user_row("ben@example.com")
+    auth.get_user("ana@example.com")
+    auth.get_user("ben@example.com")
+
+    users["listener"].batches.append(None)
+    auth.get_user("ana@example.com")
+    auth.get_user("ben@example.com")
+
+    assert users["lookups"] == 4
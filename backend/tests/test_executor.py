@@ -0,0 +1,82 @@
+import time
+import asyncio
+import numpy as np
+from face_recognition.batching import EmbeddingBatcher
+from face_recognition.executor import InferenceExecutor
+
+class SlowService:
+    """Stands in for FaceRecognitionService with a blocking embed"""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+
+    def embed_image(self, image):
+        time.sleep(self.seconds)
+        return {"success": True, "embedding": np.ones(512, dtype=np.float32)}
+
+def test_event_loop_stays_responsive_during_inference():
+    executor = InferenceExecutor(mode="thread", workers=2)
+    service = SlowService(0.3)
+
+    async def scenario():
+        ticks = []
+
+        async def tick():
+            # A light request on the same worker: needs the loop every 10 ms
+            while len(ticks) < 30:
+                start = time.perf_counter()
+                await asyncio.sleep(0.01)
+                ticks.append(time.perf_counter() - start)
+
+        results, _ = await asyncio.gather(
+            asyncio.gather(*[executor.embed(service, "image") for _ in range(4)]),
+            tick()
+        )
+        return results, ticks
+
+    try:
+        results, ticks = asyncio.run(scenario())
+    finally:
+        executor.shutdown()
+
+    assert all(result["success"] for result in results)
+    # Blocking embeds on the loop would stall a tick for the full 300 ms
+    assert max(ticks) < 0.1
+
+class BatchingService:
+    """Stands in for FaceRecognitionService: embeds one crop through a shared batcher"""
+
+    def __init__(self, batcher):
+        self.batcher = batcher
+
+    def embed_image(self, image):
+        crop = np.zeros((112, 112, 3), dtype=np.uint8)
+        return {"success": True, "embedding": self.batcher.embed(crop)}
+
+def test_concurrent_embeds_form_batches():
+    batch_sizes = []
+
+    def embed_batch(crops):
+        batch_sizes.append(len(crops))
+        time.sleep(0.02)
+        return np.ones((len(crops), 512), dtype=np.float32)
+
+    # One worker is the default when ONNX Runtime threads take every core
+    executor = InferenceExecutor(mode="thread", workers=1)
+    service = BatchingService(EmbeddingBatcher(embed_batch, max_batch_size=8, max_wait_ms=5))
+
+    async def scenario():
+        # Database work in flight must not take the slots embeds batch in
+        return await asyncio.gather(
+            *[executor.run(time.sleep, 0.1) for _ in range(4)],
+            *[executor.embed(service, "image") for _ in range(16)]
+        )
+
+    try:
+        results = asyncio.run(scenario())
+    finally:
+        executor.shutdown()
+
+    assert all(result["success"] for result in results[4:])
+    assert sum(batch_sizes) == 16
+    assert max(batch_sizes) > 1
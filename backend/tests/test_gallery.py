@@ -0,0 +1,104 @@
+import numpy as np
+from face_recognition.ann import ExactSearch
+from face_recognition.gallery import GalleryIndex
+
+DIM = 16
+
+def unit(rng, dim=DIM):
+    vector = rng.normal(size=dim).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+def naive_search(reference, probe, top_k=1, exclude=None):
+    """The per-request scan GalleryIndex replaced: cosine against every stored row"""
+    probe = probe / np.linalg.norm(probe)
+    scores = [
+        (user_id, float(np.dot(vector / np.linalg.norm(vector), probe)))
+        for user_id, vector in reference.items()
+        if user_id != exclude
+    ]
+    return sorted(scores, key=lambda pair: -pair[1])[:top_k]
+
+def assert_matches_naive(gallery, reference, probe, top_k=3, exclude=None):
+    expected = naive_search(reference, probe, top_k, exclude)
+    actual = gallery.search(probe, top_k=top_k, exclude_user_id=exclude)
+    assert [user_id for user_id, _ in actual] == [user_id for user_id, _ in expected]
+    assert np.allclose([score for _, score in actual], [score for _, score in expected], atol=1e-5)
+
+def make_gallery(rng, count):
+    gallery = GalleryIndex(dim=DIM, initial_capacity=2, backend=ExactSearch(), precision="float32")
+    reference = {f"user-{i}": unit(rng) for i in range(count)}
+    gallery.load({"user_id": user_id, "embedding": vector} for user_id, vector in reference.items())
+    return gallery, reference
+
+def test_upsert_new_and_existing_ids():
+    rng = np.random.default_rng(1)
+    gallery, reference = make_gallery(rng, 5)
+
+    reference["user-new"] = unit(rng)
+    assert gallery.upsert("user-new", reference["user-new"])
+    reference["user-2"] = unit(rng)
+    assert gallery.upsert("user-2", reference["user-2"])
+
+    assert len(gallery) == 6
+    assert np.allclose(gallery.get("user-2"), reference["user-2"], atol=1e-6)
+    for _ in range(10):
+        assert_matches_naive(gallery, reference, unit(rng))
+    # A stored face finds itself
+    assert gallery.search(reference["user-2"])[0][0] == "user-2"
+
+def test_remove_last_and_middle_rows():
+    rng = np.random.default_rng(2)
+    gallery, reference = make_gallery(rng, 6)
+
+    # user-5 is the last row; user-1 is in the middle, so the last row moves into its slot
+    for user_id in ("user-5", "user-1"):
+        assert gallery.remove(user_id)
+        del reference[user_id]
+        assert user_id not in gallery
+        assert sorted(gallery.user_ids()) == sorted(reference)
+        for other_id, vector in reference.items():
+            assert np.allclose(gallery.get(other_id), vector, atol=1e-6)
+        for _ in range(10):
+            assert_matches_naive(gallery, reference, unit(rng))
+
+    assert not gallery.remove("user-1")
+
+def test_exclude_skips_the_user_in_single_and_batched_search():
+    rng = np.random.default_rng(3)
+    gallery, reference = make_gallery(rng, 8)
+
+    probe = reference["user-4"] + 0.01 * unit(rng)
+    assert gallery.search(probe)[0][0] == "user-4"
+    assert_matches_naive(gallery, reference, probe, exclude="user-4")
+
+    probes = [reference["user-4"], reference["user-6"], unit(rng)]
+    excluded = ["user-4", None, "user-0"]
+    results = gallery.search_many(probes, top_k=2, exclude_user_ids=excluded)
+    for probe, exclude, result in zip(probes, excluded, results):
+        expected = naive_search(reference, probe, 2, exclude)
+        assert [user_id for user_id, _ in result] == [user_id for user_id, _ in expected]
+
+def test_returned_scores_are_cosines_for_threshold_checks():
+    rng = np.random.default_rng(4)
+    gallery, reference = make_gallery(rng, 10)
+    threshold = 0.5
+
+    for _ in range(20):
+        # Unnormalized probes score the same as normalized ones
+        probe = 3.0 * (reference["user-7"] + rng.uniform(0.0, 1.5) * unit(rng))
+        (user_id, score), = gallery.search(probe)
+        expected_id, expected_score = naive_search(reference, probe)[0]
+        assert user_id == expected_id
+        assert abs(score - expected_score) < 1e-5
+        assert (score > threshold) == (expected_score > threshold)
+        assert -1.0 - 1e-6 <= score <= 1.0 + 1e-6
+
+def test_invalid_embeddings_are_rejected():
+    rng = np.random.default_rng(5)
+    gallery, _ = make_gallery(rng, 3)
+
+    assert not gallery.accepts(np.ones(DIM + 1))
+    assert not gallery.accepts(np.zeros(DIM))
+    assert not gallery.upsert("user-bad", np.ones(DIM - 1))
+    assert "user-bad" not in gallery
+    assert gallery.search(np.ones(DIM - 1)) == []
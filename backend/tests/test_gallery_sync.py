@@ -0,0 +1,195 @@
+from datetime import datetime, timedelta
+import numpy as np
+from face_recognition.ann import ExactSearch
+from face_recognition.database import GallerySync, SYNC_WATERMARK_OVERLAP
+from face_recognition.gallery import GalleryIndex
+
+DIM = 8
+START = datetime(2026, 1, 1, 8, 0)
+
+class FakeNotifier:
+    """Stands in for ChangeListener: hands out queued userIds, or None for a reconnect"""
+
+    def __init__(self):
+        self.pending = set()
+        self.reconnected = False
+
+    def notify(self, user_id):
+        self.pending.add(user_id)
+
+    def poll(self):
+        if self.reconnected:
+            self.reconnected = False
+            self.pending = set()
+            return None
+        changed, self.pending = self.pending, set()
+        return changed
+
+    def close(self):
+        pass
+
+class FakeDatabase:
+    """FaceEmbedding rows in memory, with the Database methods GallerySync calls"""
+
+    def __init__(self):
+        self.rows = {}
+        self.clock = START
+        self.fail = False
+        self.full_loads = 0
+
+    def save(self, user_id, seed):
+        self.clock += timedelta(seconds=1)
+        vector = np.random.default_rng(seed).normal(size=DIM).astype(np.float32)
+        self.rows[user_id] = (vector, self.clock)
+        return vector
+
+    def get_latest_update(self):
+        if self.fail:
+            return None
+        return max((updated for _, updated in self.rows.values()), default=None)
+
+    def get_all_embeddings(self):
+        if self.fail:
+            return None
+        self.full_loads += 1
+        return [{"user_id": user_id, "embedding": vector} for user_id, (vector, _) in self.rows.items()]
+
+    def get_embedding_user_ids(self):
+        return None if self.fail else set(self.rows)
+
+    def get_embeddings_for_users(self, user_ids):
+        if self.fail:
+            return None
+        return {user_id: self.rows[user_id][0] for user_id in user_ids if user_id in self.rows}
+
+    def get_embeddings_updated_since(self, since):
+        if self.fail:
+            return None
+        return [
+            {"user_id": user_id, "embedding": vector, "updated_at": updated}
+            for user_id, (vector, updated) in self.rows.items()
+            if updated > since
+        ]
+
+def setup(users=3):
+    database = FakeDatabase()
+    for i in range(users):
+        database.save(f"user-{i}", i)
+    notifier = FakeNotifier()
+    # A long sweep interval, so only tests that force a sweep get one
+    sync = GallerySync(database, notifier, watermark_interval=3600)
+    gallery = GalleryIndex(dim=DIM, backend=ExactSearch(), precision="float32")
+    sync.sync(gallery)
+    return database, notifier, sync, gallery
+
+def stored(gallery, database, user_id):
+    vector = database.rows[user_id][0]
+    return np.allclose(gallery.get(user_id), vector / np.linalg.norm(vector), atol=1e-6)
+
+def test_notify_upserts_and_deletes():
+    database, notifier, sync, gallery = setup()
+    assert sorted(gallery.user_ids()) == ["user-0", "user-1", "user-2"]
+
+    database.save("user-3", 3)
+    database.save("user-0", 10)
+    del database.rows["user-1"]
+    for user_id in ("user-3", "user-0", "user-1"):
+        notifier.notify(user_id)
+    sync.sync(gallery)
+
+    assert sorted(gallery.user_ids()) == ["user-0", "user-2", "user-3"]
+    assert stored(gallery, database, "user-0")
+    assert stored(gallery, database, "user-3")
+    assert database.full_loads == 1
+
+def test_failed_reread_stays_pending_and_is_retried():
+    database, notifier, sync, gallery = setup()
+
+    database.save("user-3", 3)
+    notifier.notify("user-3")
+    database.fail = True
+    sync.sync(gallery)
+    assert "user-3" not in gallery
+    assert sync._pending == {"user-3"}
+
+    database.fail = False
+    sync.sync(gallery)
+    assert stored(gallery, database, "user-3")
+    assert sync._pending == set()
+
+def test_sweep_catches_missed_delete_and_update():
+    database, notifier, sync, gallery = setup()
+
+    # Neither change is notified
+    del database.rows["user-1"]
+    database.save("user-2", 20)
+    sync.sync(gallery)
+    assert "user-1" in gallery
+
+    sync._last_sweep = 0.0
+    sync.sync(gallery)
+    assert sorted(gallery.user_ids()) == ["user-0", "user-2"]
+    assert stored(gallery, database, "user-2")
+    assert sync.watermark == database.rows["user-2"][1]
+
+def test_sweep_rereads_rows_older_than_the_watermark():
+    database, notifier, sync, gallery = setup()
+
+    # Committed late with an updatedAt before the watermark and the overlap
+    database.rows["user-9"] = (np.ones(DIM, dtype=np.float32), START - SYNC_WATERMARK_OVERLAP * 2)
+    sync._last_sweep = 0.0
+    sync.sync(gallery)
+    assert "user-9" in gallery
+
+def test_reconnect_forces_full_reload():
+    database, notifier, sync, gallery = setup()
+
+    database.save("user-3", 3)
+    del database.rows["user-0"]
+    notifier.reconnected = True
+    sync.sync(gallery)
+
+    assert database.full_loads == 2
+    assert sorted(gallery.user_ids()) == ["user-1", "user-2", "user-3"]
+
+def test_failed_first_load_is_retried():
+    database = FakeDatabase()
+    database.save("user-0", 0)
+    database.fail = True
+    sync = GallerySync(database, FakeNotifier())
+    gallery = GalleryIndex(dim=DIM, backend=ExactSearch(), precision="float32")
+
+    sync.sync(gallery)
+    assert not gallery.loaded
+    assert sync.watermark is None
+
+    database.fail = False
+    sync.sync(gallery)
+    assert gallery.loaded
+    assert gallery.user_ids() == ["user-0"]
+
+def test_catch_up_from_watermark():
+    database = FakeDatabase()
+    for i in range(4):
+        database.save(f"user-{i}", i)
+    watermark = database.get_latest_update()
+    # A snapshot taken at the watermark; afterwards user-1 changes, user-2 is
+    # deleted and user-4 is added
+    snapshot = {user_id: vector for user_id, (vector, _) in database.rows.items()}
+    database.clock += SYNC_WATERMARK_OVERLAP
+    database.save("user-1", 11)
+    del database.rows["user-2"]
+    database.save("user-4", 4)
+
+    sync = GallerySync(database, FakeNotifier())
+    gallery = GalleryIndex(dim=DIM, backend=ExactSearch(), precision="float32")
+    gallery.load({"user_id": user_id, "embedding": vector} for user_id, vector in snapshot.items())
+
+    assert sync.catch_up(gallery, watermark)
+    assert sorted(gallery.user_ids()) == ["user-0", "user-1", "user-3", "user-4"]
+    assert stored(gallery, database, "user-1")
+    assert sync.watermark == database.rows["user-4"][1]
+    assert database.full_loads == 0
+
+    database.fail = True
+    assert not sync.catch_up(gallery, watermark)
@@ -0,0 +1,71 @@
+import numpy as np
+from face_recognition.ann import ExactSearch
+from face_recognition.gallery import GalleryIndex
+from face_recognition.service import FaceRecognitionService
+
+DIM = 8
+
+def axis(i):
+    vector = np.zeros(DIM, dtype=np.float32)
+    vector[i] = 1.0
+    return vector
+
+def mix(**weights):
+    """Unit vector from weights on the student axes a=0, b=1, c=2, d=3"""
+    vector = sum(weight * axis("abcd".index(name)) for name, weight in weights.items())
+    return vector / np.linalg.norm(vector)
+
+def service_with(students):
+    service = FaceRecognitionService()
+    service.gallery = GalleryIndex(dim=DIM, backend=ExactSearch(), precision="float32")
+    service.gallery.load({"user_id": user_id, "embedding": vector} for user_id, vector in students.items())
+    service._ensure_gallery = lambda: None
+    return service
+
+def faces(count):
+    return [{"bbox": [10.0 * i, 0.0, 10.0 * i + 8, 8.0], "det_score": 0.9} for i in range(count)]
+
+def test_closer_face_keeps_a_contested_student():
+    service = service_with({"student-a": axis(0), "student-b": axis(1), "student-c": axis(2)})
+    # Both faces are closest to student-a; the second is nearer, so the first falls back to student-b
+    embeddings = [mix(a=0.8, b=0.7), mix(a=0.95, b=0.3)]
+
+    result = service.recognize_group(faces(2), embeddings)
+
+    assert [face["user_id"] for face in result["faces"]] == ["student-b", "student-a"]
+    assert result["recognized"] == 2
+    assert abs(result["faces"][0]["confidence"] - float(mix(a=0.8, b=0.7)[1])) < 1e-5
+    assert abs(result["faces"][1]["confidence"] - float(mix(a=0.95, b=0.3)[0])) < 1e-5
+
+def test_each_student_is_assigned_at_most_once():
+    service = service_with({"student-a": axis(0), "student-b": axis(1)})
+    # Three faces of student-a with no usable second candidate
+    embeddings = [mix(a=0.9, c=0.1), mix(a=0.99, c=0.05), mix(a=0.8, c=0.3)]
+
+    result = service.recognize_group(faces(3), embeddings)
+
+    assert [face["user_id"] for face in result["faces"]] == [None, "student-a", None]
+    assert [face["success"] for face in result["faces"]] == [False, True, False]
+    # Unassigned faces still report their best similarity
+    assert abs(result["faces"][0]["confidence"] - float(mix(a=0.9, c=0.1)[0])) < 1e-5
+
+def test_below_threshold_and_rejected_faces_stay_unmatched():
+    service = service_with({"student-a": axis(0), "student-c": axis(2)})
+    embeddings = [mix(c=0.4, d=0.9), None, mix(a=1.0)]
+    detected = faces(3)
+    detected[1]["reason"] = "blurry"
+
+    result = service.recognize_group(detected, embeddings)
+
+    assert [face["user_id"] for face in result["faces"]] == [None, None, "student-a"]
+    assert result["faces"][0]["confidence"] < service.recognition_threshold
+    assert result["faces"][1]["confidence"] == 0
+    assert result["faces"][1]["reason"] == "blurry"
+    assert result["recognized"] == 1
+    assert result["message"] == "Recognized 1 of 3 faces"
+
+def test_empty_gallery():
+    service = service_with({})
+    result = service.recognize_group(faces(1), [axis(0)])
+    assert not result["success"]
+    assert result["recognized"] == 0
@@ -0,0 +1,99 @@
+from types import SimpleNamespace
+import cv2
+import numpy as np
+import pytest
+from face_recognition import quality
+
+# ArcFace's landmark template for an aligned 112x112 crop: eyes, nose, mouth corners
+TEMPLATE = np.array([
+    [38.2946, 51.6963],
+    [73.5318, 51.5014],
+    [56.0252, 71.7366],
+    [41.5493, 92.3655],
+    [70.7299, 92.2041],
+])
+
+FRAME = (480, 640, 3)
+
+def face(det_score=0.9, bbox=(200, 150, 312, 262), kps=None):
+    """Detector output for a frontal face filling bbox, as InsightFace returns it"""
+    x1, y1, x2, y2 = bbox
+    if kps is None:
+        kps = TEMPLATE * ((x2 - x1) / 112.0) + [x1, y1]
+    return SimpleNamespace(det_score=det_score, bbox=np.array(bbox, dtype=np.float32), kps=kps)
+
+def rotated(kps, degrees):
+    center = kps.mean(axis=0)
+    angle = np.radians(degrees)
+    rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    return (kps - center) @ rotation.T + center
+
+def face_crop():
+    """Synthetic aligned crop with face-like edges and contrast"""
+    crop = np.full((112, 112, 3), 90, np.uint8)
+    cv2.ellipse(crop, (56, 60), (40, 50), 0, 0, 360, (150, 160, 190), -1)
+    for eye in TEMPLATE[:2].astype(int):
+        cv2.circle(crop, tuple(int(v) for v in eye), 5, (40, 40, 40), -1)
+    cv2.line(crop, (56, 55), (56, 75), (110, 120, 150), 2)
+    cv2.ellipse(crop, (56, 90), (14, 5), 0, 0, 360, (60, 60, 150), -1)
+    return crop
+
+def test_frontal_face_passes():
+    yaw, pitch, roll = quality.estimate_pose(TEMPLATE)
+    assert abs(yaw) < 0.05 and abs(pitch) < 0.05 and abs(roll) < 1
+    assert quality.check_detection(face(), FRAME) is None
+
+def test_detector_confidence_threshold():
+    assert quality.check_detection(face(det_score=0.59), FRAME) == "low_confidence"
+    assert quality.check_detection(face(det_score=0.6), FRAME) is None
+
+def test_face_size_threshold_uses_the_shorter_side():
+    assert quality.check_detection(face(bbox=(100, 100, 139, 200)), FRAME) == "face_too_small"
+    assert quality.check_detection(face(bbox=(100, 100, 200, 139)), FRAME) == "face_too_small"
+    assert quality.check_detection(face(bbox=(100, 100, 140, 140)), FRAME) is None
+
+def test_face_cut_off_at_the_frame_edge():
+    # 100x100 box: 5% outside the left edge is allowed, 20% is not
+    assert quality.check_detection(face(bbox=(-5, 100, 95, 200)), FRAME) is None
+    assert quality.check_detection(face(bbox=(-20, 100, 80, 200)), FRAME) == "face_cut_off"
+    assert quality.check_detection(face(bbox=(560, 400, 660, 500)), FRAME) == "face_cut_off"
+
+@pytest.mark.parametrize("shift, expected", [
+    ((0.30, 0.0), None),
+    ((0.45, 0.0), "extreme_pose"),
+    ((-0.45, 0.0), "extreme_pose"),
+    ((0.0, 0.20), None),
+    ((0.0, 0.35), "extreme_pose"),
+    ((0.0, -0.35), "extreme_pose"),
+])
+def test_yaw_and_pitch_thresholds(shift, expected):
+    # Move the nose by fractions of the eye distance (yaw) and eye-to-mouth height (pitch)
+    kps = TEMPLATE.copy()
+    eye_distance = TEMPLATE[1, 0] - TEMPLATE[0, 0]
+    face_height = TEMPLATE[3:, 1].mean() - TEMPLATE[:2, 1].mean()
+    kps[2] += [shift[0] * eye_distance, shift[1] * face_height]
+    assert quality.check_detection(face(bbox=(0, 0, 112, 112), kps=kps), FRAME) == expected
+
+def test_roll_threshold():
+    assert quality.estimate_pose(rotated(TEMPLATE, 25))[2] == pytest.approx(25, abs=0.5)
+    assert quality.check_detection(face(bbox=(0, 0, 112, 112), kps=rotated(TEMPLATE, 25)), FRAME) is None
+    assert quality.check_detection(face(bbox=(0, 0, 112, 112), kps=rotated(TEMPLATE, -35)), FRAME) == "extreme_pose"
+
+def test_upside_down_landmarks_are_extreme_pose():
+    assert quality.check_detection(face(bbox=(0, 0, 112, 112), kps=rotated(TEMPLATE, 180)), FRAME) == "extreme_pose"
+
+def test_blurred_crop_is_rejected():
+    crop = face_crop()
+    assert quality.sharpness(crop) > 100
+    assert quality.check_crop(crop) is None
+    assert quality.check_crop(cv2.GaussianBlur(crop, (7, 7), 0)) == "blurry"
+    assert quality.check_crop(cv2.cvtColor(cv2.GaussianBlur(crop, (7, 7), 0), cv2.COLOR_BGR2GRAY)) == "blurry"
+
+def test_disabled_gate_accepts_everything(monkeypatch):
+    monkeypatch.setattr(quality, "FACE_QUALITY_GATE", False)
+    assert quality.check_detection(face(det_score=0.1, bbox=(0, 0, 10, 10)), FRAME) is None
+    assert quality.check_crop(np.full((112, 112, 3), 128, np.uint8)) is None
+
+@pytest.mark.parametrize("reason", sorted(quality.QUALITY_MESSAGES))
+def test_every_reason_has_a_rejection_message(reason):
+    assert quality.rejection(reason) == {"success": False, "reason": reason, "message": quality.QUALITY_MESSAGES[reason]}
@@ -0,0 +1,181 @@
+import os
+from datetime import datetime
+import numpy as np
+import pytest
+from face_recognition.ann import ExactSearch
+from face_recognition.gallery import GalleryIndex
+from face_recognition import shared
+from face_recognition.shared import SharedGallerySync, read_snapshot, write_snapshot
+from test_gallery_sync import DIM, FakeDatabase, FakeNotifier
+
+pytestmark = pytest.mark.skipif(shared.fcntl is None, reason="shared galleries need fcntl")
+
+def new_gallery():
+    return GalleryIndex(dim=DIM, initial_capacity=2, backend=ExactSearch(), precision="float32")
+
+def new_sync(database, path):
+    # The publisher thread only wakes on close(), so each test drives sync() itself
+    return SharedGallerySync(database, path, FakeNotifier(), publish_interval=3600, check_interval=0, startup_wait=0.2)
+
+def unit(vector):
+    return vector / np.linalg.norm(vector)
+
+def populated_database(users=3):
+    database = FakeDatabase()
+    for i in range(users):
+        database.save(f"user-{i}", i)
+    return database
+
+def snapshot_of(database, path, generation=4):
+    """Write what an earlier owner would have published for the database as it is now"""
+    user_ids = sorted(database.rows)
+    matrix = np.stack([unit(database.rows[user_id][0]) for user_id in user_ids])
+    write_snapshot(path, user_ids, matrix, generation, database.get_latest_update())
+    return user_ids, matrix
+
+def assert_serves(gallery, database):
+    assert sorted(gallery.user_ids()) == sorted(database.rows)
+    for user_id, (vector, _) in database.rows.items():
+        assert np.allclose(gallery.get(user_id), unit(vector), atol=1e-6)
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "gallery.snapshot")
+    rng = np.random.default_rng(3)
+    matrix = rng.normal(size=(5, DIM)).astype(np.float32)
+    watermark = datetime(2026, 10, 17, 9, 30, 15, 250000)
+    write_snapshot(path, [f"user-{i}" for i in range(5)], matrix, 7, watermark)
+
+    snapshot = read_snapshot(path, DIM)
+    assert snapshot["user_ids"] == [f"user-{i}" for i in range(5)]
+    assert np.array_equal(np.asarray(snapshot["matrix"]), matrix)
+    assert snapshot["generation"] == 7
+    assert snapshot["watermark"] == watermark
+    assert snapshot["key"] == (os.stat(path).st_ino, os.stat(path).st_mtime_ns)
+
+    # The matrix starts on a page boundary so it maps without copying
+    assert snapshot["matrix"].offset % shared.SNAPSHOT_ALIGNMENT == 0
+
+def test_snapshot_edge_cases(tmp_path):
+    path = str(tmp_path / "gallery.snapshot")
+    assert read_snapshot(path, DIM) is None
+
+    write_snapshot(path, [], np.zeros((0, DIM), dtype=np.float32), 1, None)
+    snapshot = read_snapshot(path, DIM)
+    assert snapshot["user_ids"] == [] and snapshot["matrix"].shape == (0, DIM)
+    assert snapshot["watermark"] is None
+
+    write_snapshot(path, ["user-0"], np.ones((1, DIM), dtype=np.float32), 2, None)
+    assert read_snapshot(path, DIM * 2) is None
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 4)
+    assert read_snapshot(path, DIM) is None
+
+def test_takeover_restores_the_snapshot_and_catches_up(tmp_path):
+    path = str(tmp_path / "gallery.snapshot")
+    database = populated_database()
+    snapshot_of(database, path)
+    # Changed after the snapshot was written
+    database.save("user-new", 10)
+    database.save("user-1", 11)
+    del database.rows["user-2"]
+
+    gallery = new_gallery()
+    sync = new_sync(database, path)
+    try:
+        sync.sync(gallery)
+
+        assert sync.owner and not gallery.read_only
+        assert database.full_loads == 0
+        assert_serves(gallery, database)
+        assert sync._publisher.is_alive()
+        published = read_snapshot(path, DIM)
+        assert published["generation"] == 5
+        assert sorted(published["user_ids"]) == sorted(database.rows)
+    finally:
+        sync.close()
+
+def test_takeover_without_a_snapshot_loads_the_database(tmp_path):
+    path = str(tmp_path / "gallery.snapshot")
+    database = populated_database()
+
+    gallery = new_gallery()
+    sync = new_sync(database, path)
+    try:
+        sync.sync(gallery)
+
+        assert sync.owner and database.full_loads == 1
+        assert_serves(gallery, database)
+        assert sync._publisher.is_alive()
+        assert sorted(read_snapshot(path, DIM)["user_ids"]) == sorted(database.rows)
+    finally:
+        sync.close()
+
+def test_takeover_with_the_database_down_serves_the_snapshot(tmp_path):
+    path = str(tmp_path / "gallery.snapshot")
+    database = populated_database()
+    user_ids, _ = snapshot_of(database, path)
+    watermark = database.get_latest_update()
+    database.fail = True
+
+    gallery = new_gallery()
+    sync = new_sync(database, path)
+    try:
+        sync.sync(gallery)
+
+        assert sync.owner and gallery.loaded and not gallery.read_only
+        assert sorted(gallery.user_ids()) == user_ids
+        assert sync.database_sync.watermark == watermark
+        assert sync._publisher.is_alive()
+    finally:
+        sync.close()
+
+def test_takeover_with_the_database_down_and_no_snapshot(tmp_path):
+    path = str(tmp_path / "gallery.snapshot")
+    database = populated_database()
+    database.fail = True
+
+    gallery = new_gallery()
+    sync = new_sync(database, path)
+    try:
+        sync.sync(gallery)
+
+        assert sync.owner and not gallery.loaded
+        assert sync._publisher.is_alive()
+        assert not os.path.exists(path)
+
+        # The owner's next sync retries the load
+        database.fail = False
+        sync.sync(gallery)
+        assert_serves(gallery, database)
+    finally:
+        sync.close()
+
+def test_reader_taking_over_after_the_snapshot_vanished_keeps_its_rows_writable(tmp_path):
+    path = str(tmp_path / "gallery.snapshot")
+    database = populated_database()
+    owner = new_sync(database, path)
+    owner.sync(new_gallery())
+
+    gallery = new_gallery()
+    reader = new_sync(database, path)
+    try:
+        reader.sync(gallery)
+        assert not reader.owner and gallery.read_only
+        attached = read_snapshot(path, DIM)["watermark"]
+
+        # The owner exits, its snapshot is lost and Postgres is down
+        owner.close()
+        os.remove(path)
+        database.fail = True
+        reader.sync(gallery)
+
+        assert reader.owner and gallery.loaded and not gallery.read_only
+        assert_serves(gallery, database)
+        assert reader.database_sync.watermark == attached
+        assert reader._publisher.is_alive()
+        assert gallery.upsert("user-new", np.ones(DIM, dtype=np.float32))
+        # The private copy was published for the remaining readers
+        assert "user-new" not in read_snapshot(path, DIM)["user_ids"]
+        assert sorted(read_snapshot(path, DIM)["user_ids"]) == sorted(database.rows)
+    finally:
+        reader.close()
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from face_recognition.ann import ExactSearch
+from face_recognition.gallery import GalleryIndex
+from face_recognition.storage import EmbeddingStore, PRECISIONS
+
+DIM = 64
+
+def units(rng, count, dim=DIM):
+    vectors = rng.normal(size=(count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def make_gallery(precision, spill_dir, reference):
+    gallery = GalleryIndex(dim=DIM, initial_capacity=4, backend=ExactSearch(), precision=precision, rerank=16)
+    # Keep the float32 spill file under the test's own directory
+    gallery.store = EmbeddingStore(DIM, 4, precision, spill_dir=spill_dir)
+    gallery.load({"user_id": user_id, "embedding": vector} for user_id, vector in reference.items())
+    return gallery
+
+def brute_force_top1(reference, probe):
+    user_ids = list(reference)
+    scores = np.stack([reference[user_id] for user_id in user_ids]) @ probe
+    best = int(np.argmax(scores))
+    return user_ids[best], float(scores[best])
+
+def assert_top1_matches_float32(gallery, reference, probes):
+    for probe in probes:
+        expected_id, expected_score = brute_force_top1(reference, probe)
+        [(user_id, score)] = gallery.search(probe, top_k=1)
+        assert user_id == expected_id
+        # Reranked scores are full precision cosines, not quantized ones
+        assert score == pytest.approx(expected_score, abs=1e-5)
+
+@pytest.mark.parametrize("precision", PRECISIONS)
+def test_top1_after_rerank_matches_float32_brute_force(precision, tmp_path):
+    rng = np.random.default_rng(7)
+    reference = dict(zip((f"user-{i}" for i in range(600)), units(rng, 600)))
+    gallery = make_gallery(precision, str(tmp_path), reference)
+
+    assert_top1_matches_float32(gallery, reference, units(rng, 200))
+
+@pytest.mark.parametrize("precision", PRECISIONS)
+def test_top1_after_swap_with_last_removals(precision, tmp_path):
+    rng = np.random.default_rng(8)
+    reference = dict(zip((f"user-{i}" for i in range(600)), units(rng, 600)))
+    gallery = make_gallery(precision, str(tmp_path), reference)
+
+    # Removing rows moves the last row's codes, scale and spilled vector into the gap
+    for user_id in rng.choice(list(reference), size=250, replace=False):
+        assert gallery.remove(user_id)
+        del reference[user_id]
+    for i, vector in enumerate(units(rng, 40)):
+        reference[f"late-{i}"] = vector
+        assert gallery.upsert(f"late-{i}", vector)
+    assert len(gallery) == len(reference)
+
+    # Probes close to stored rows must land on exactly that user
+    for user_id in rng.choice(list(reference), size=50, replace=False):
+        noisy = reference[user_id] + 0.05 * units(rng, 1)[0]
+        assert gallery.search(noisy, top_k=1)[0][0] == user_id
+    assert_top1_matches_float32(gallery, reference, units(rng, 200))
@@ -0,0 +1,68 @@
+import numpy as np
+from face_recognition.tracking import FaceTracker, iou
+
+def box(x, y, size=100):
+    return np.array([x, y, x + size, y + size], dtype=np.float32)
+
+def test_iou_of_synthetic_boxes():
+    overlaps = iou(np.stack([box(0, 0)]), np.stack([box(0, 0), box(50, 0), box(200, 200)]))
+    assert np.allclose(overlaps, [[1.0, 5000 / 15000, 0.0]])
+
+def test_moving_face_keeps_its_track():
+    tracker = FaceTracker(iou_threshold=0.4)
+    first, = tracker.update([(box(0, 0), 0.9)])
+    # Moved 10 px: IoU 0.82
+    second, = tracker.update([(box(10, 0), 0.8)])
+    assert second is first
+    assert second.track_id == 1
+    assert np.array_equal(second.bbox, box(10, 0))
+    assert second.det_score == 0.8
+
+def test_low_overlap_starts_a_new_track():
+    tracker = FaceTracker(iou_threshold=0.4)
+    first, = tracker.update([(box(0, 0), 0.9)])
+    # Moved 50 px: IoU 0.33
+    second, = tracker.update([(box(50, 0), 0.9)])
+    assert second is not first
+    assert [track.track_id for track in tracker.tracks] == [1, 2]
+
+def test_two_faces_are_matched_to_the_closest_tracks():
+    tracker = FaceTracker(iou_threshold=0.3)
+    left, right = tracker.update([(box(0, 0), 0.9), (box(120, 0), 0.9)])
+    # Detections arrive in the other order, both shifted right
+    moved_right, moved_left = tracker.update([(box(150, 0), 0.9), (box(30, 0), 0.9)])
+    assert moved_left is left
+    assert moved_right is right
+
+def test_tracks_expire_after_max_misses():
+    tracker = FaceTracker(max_misses=2)
+    track, = tracker.update([(box(0, 0), 0.9)])
+    tracker.update([])
+    tracker.update([])
+    assert tracker.tracks == [track] and track.misses == 2
+    assert tracker.visible == []
+
+    # Seen again before expiring: the miss count resets
+    assert tracker.update([(box(0, 0), 0.9)]) == [track]
+    assert track.misses == 0
+
+    for _ in range(3):
+        tracker.update([])
+    assert tracker.tracks == []
+    replacement, = tracker.update([(box(0, 0), 0.9)])
+    assert replacement is not track
+
+def test_needs_embedding_refresh_and_retry_intervals():
+    tracker = FaceTracker(refresh_seconds=2.0, retry_seconds=0.5)
+    track, = tracker.update([(box(0, 0), 0.9)])
+    assert tracker.needs_embedding(track, now=0.0)
+
+    # Unrecognized: retried after retry_seconds
+    track.embedded_at = 10.0
+    assert not tracker.needs_embedding(track, now=10.4)
+    assert tracker.needs_embedding(track, now=10.5)
+
+    # Recognized: confirmed again after refresh_seconds
+    track.user_id = "student-a"
+    assert not tracker.needs_embedding(track, now=11.9)
+    assert tracker.needs_embedding(track, now=12.0)
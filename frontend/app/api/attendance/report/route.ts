@@ -0,0 +1,32 @@
+import { NextRequest, NextResponse } from 'next/server';
+
+export const dynamic = 'force-dynamic';
+
+// GET /api/attendance/report - Stream a CSV or NDJSON attendance report from the backend
+// Query parameters (format, grade, class_id, role, start_date, end_date) are passed through
+export async function GET(request: NextRequest) {
+  try {
+    const { search } = new URL(request.url);
+    const response = await fetch(`http://localhost:8000/api/attendance/report${search}`);
+
+    if (!response.ok || !response.body) {
+      const data = await response.json();
+      return NextResponse.json(data, { status: response.status });
+    }
+
+    // Pass the body through as it arrives instead of buffering the whole report
+    return new Response(response.body, {
+      status: response.status,
+      headers: {
+        'Content-Type': response.headers.get('Content-Type') ?? 'text/csv',
+        'Content-Disposition': response.headers.get('Content-Disposition') ?? 'attachment',
+      },
+    });
+  } catch (error) {
+    console.error('Error exporting attendance report:', error);
+    return NextResponse.json(
+      { message: 'Internal server error' },
+      { status: 500 }
+    );
+  }
+}
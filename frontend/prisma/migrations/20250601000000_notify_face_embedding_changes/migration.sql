@@ -0,0 +1,19 @@
+-- CreateFunction
+CREATE OR REPLACE FUNCTION notify_face_embedding_change() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('face_embedding_changes', OLD."userId");
+        RETURN OLD;
+    END IF;
+    PERFORM pg_notify('face_embedding_changes', NEW."userId");
+    IF TG_OP = 'UPDATE' AND OLD."userId" <> NEW."userId" THEN
+        PERFORM pg_notify('face_embedding_changes', OLD."userId");
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- CreateTrigger
+CREATE TRIGGER "FaceEmbedding_notify_change"
+AFTER INSERT OR UPDATE OR DELETE ON "FaceEmbedding"
+FOR EACH ROW EXECUTE FUNCTION notify_face_embedding_change();
@@ -0,0 +1,4 @@
+-- AlterTable
+ALTER TABLE "FaceEmbedding" ADD COLUMN     "embeddingData" BYTEA,
+ADD COLUMN     "embeddingDtype" TEXT,
+ALTER COLUMN "embedding" DROP NOT NULL;
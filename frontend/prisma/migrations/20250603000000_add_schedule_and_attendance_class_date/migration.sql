@@ -0,0 +1,32 @@
+-- Schedule and Attendance.classDate were added to schema.prisma without a
+-- migration; databases created with `prisma db push` already have them, so
+-- every statement here is idempotent.
+
+-- CreateTable
+CREATE TABLE IF NOT EXISTS "Schedule" (
+    "id" TEXT NOT NULL,
+    "classId" TEXT NOT NULL,
+    "startTime" TEXT NOT NULL,
+    "endTime" TEXT NOT NULL,
+    "timezone" TEXT NOT NULL DEFAULT 'Asia/Manila',
+    "daysOfWeek" TEXT NOT NULL DEFAULT 'MONDAY,TUESDAY,WEDNESDAY,THURSDAY,FRIDAY',
+    "createdAt" TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "updatedAt" TIMESTAMP(3) NOT NULL,
+
+    CONSTRAINT "Schedule_pkey" PRIMARY KEY ("id")
+);
+
+-- CreateIndex
+CREATE UNIQUE INDEX IF NOT EXISTS "Schedule_classId_key" ON "Schedule"("classId");
+
+-- AddForeignKey
+DO $$ BEGIN
+    ALTER TABLE "Schedule" ADD CONSTRAINT "Schedule_classId_fkey" FOREIGN KEY ("classId") REFERENCES "Class"("id") ON DELETE RESTRICT ON UPDATE CASCADE;
+EXCEPTION WHEN duplicate_object THEN NULL;
+END $$;
+
+-- AlterTable
+ALTER TABLE "Attendance" ADD COLUMN IF NOT EXISTS "classDate" TEXT;
+
+-- CreateIndex
+CREATE UNIQUE INDEX IF NOT EXISTS "Attendance_userId_classDate_key" ON "Attendance"("userId", "classDate");
@@ -0,0 +1,15 @@
+-- CreateFunction
+CREATE OR REPLACE FUNCTION notify_user_auth_change() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('user_auth_changes', OLD."email");
+    IF TG_OP = 'DELETE' THEN
+        RETURN OLD;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- CreateTrigger
+CREATE TRIGGER "User_notify_auth_change"
+AFTER UPDATE OF "email", "password", "role" OR DELETE ON "User"
+FOR EACH ROW EXECUTE FUNCTION notify_user_auth_change();
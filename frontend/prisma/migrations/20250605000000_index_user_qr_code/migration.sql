@@ -0,0 +1,2 @@
+-- CreateIndex
+CREATE INDEX "User_qrCode_idx" ON "User"("qrCode");